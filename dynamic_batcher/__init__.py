@@ -4,22 +4,34 @@ import sys
 from .batcher import (
     DynamicBatcher,
     BatchProcessor,
+    get_batcher,
+    start_daemons,
 )
 from . import (
+    admission,
+    cache,
     redis_engine,
+    memory_engine,
     types,
 )
 from .types import ResponseStream, PendingRequestStream
+from .admission import OverloadedError
 
 
 __all__ = [
     "__version__",
     "DynamicBatcher",
     "BatchProcessor",
+    "get_batcher",
+    "start_daemons",
+    "admission",
+    "cache",
     "redis_engine",
+    "memory_engine",
     "types",
     "ResponseStream",
     "PendingRequestStream",
+    "OverloadedError",
 ]
 
 __version__ = "1.0.6.1"
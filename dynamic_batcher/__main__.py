@@ -16,12 +16,57 @@ Args
     callable (str):
         Callable name to execute. ex.: 'module.submodule.func'.
         The callable should have has only one positional argument that typed 'List'.
+        Optional, if ``--route`` is given.
     
     -bs/--batch-size (int):
         Batch size of BatchProcessor. if it is not provided, use envvar ``DYNAMIC_BATCHER__BATCH_SIZE`` instead. Defaults to ``64``.
     
-    -bt/--batch-time (int):
-        Batch time delay(seconds) of BatchProcessor. if it is not provided, use envvar ``DYNAMIC_BATCHER__BATCH_TIME`` instead. Defaults to ``2``.
+    -bt/--batch-time (float):
+        Batch time delay(seconds) of BatchProcessor, like ``0.01`` for 10ms. if it is not provided, use envvar ``DYNAMIC_BATCHER__BATCH_TIME`` instead. Defaults to ``2``.
+
+    -ex/--executor (str):
+        Executor to run a batch on, ``thread`` or ``process``. if it is not provided, use envvar ``DYNAMIC_BATCHER__EXECUTOR`` instead. Optional.
+        If it is given, the next batch is gathered while batches are running on the executor.
+
+    -pd/--pipeline-depth (int):
+        Number of batches running on the executor at once. if it is not provided, use envvar ``DYNAMIC_BATCHER__PIPELINE_DEPTH`` instead. Defaults to ``1``.
+
+    -tl/--target-latency (float):
+        Seconds of p99 latency to keep. if it is not provided, use envvar ``DYNAMIC_BATCHER__TARGET_LATENCY`` instead. Optional.
+        If it is given, the batch size and the batch time are retuned on every batch, bounded by ``--batch-size`` and ``--batch-time``.
+
+    -cd/--codec (str):
+        Codec for requests not recording their codec, like ``json``, ``msgpack`` or ``pickle``. if it is not provided, use envvar ``DYNAMIC_BATCHER__CODEC`` instead. Defaults to ``json``.
+        Other requests are decoded and responded by their own codecs.
+
+    -ac/--accepted-codecs (str):
+        Codecs to decode requests with, comma-separated like ``json,msgpack``. if it is not provided, use envvar ``DYNAMIC_BATCHER__ACCEPTED_CODECS`` instead. Defaults to ``json,msgpack,numpy``.
+        A request of another codec is responded with ``None``. Add ``pickle`` only if every writer of Redis is trusted.
+
+    -tp/--transport (str):
+        How requests and responses travel through Redis, ``stream`` or ``list``. if it is not provided, use envvar ``DYNAMIC_BATCHER__TRANSPORT`` instead. Defaults to ``stream``.
+        It should be the same as of ``DynamicBatcher``.
+
+    -col/--columnar:
+        Give the callable a batch in columns(``Dict[str, List]``), and take its results in columns. if it is not provided, use envvar ``DYNAMIC_BATCHER__COLUMNAR`` instead. Optional.
+
+    -bb/--bucket-by (str):
+        Field name of bodies as their sizes, to batch requests of similar sizes together. if it is not provided, use envvar ``DYNAMIC_BATCHER__BUCKET_BY`` instead. Optional.
+        A value not a number(like a list of tokens) counts by its length.
+
+    -bd/--bucket-boundaries (str):
+        Ascending upper bounds of sizes of buckets, comma-separated like ``32,64,128``. if it is not provided, use envvar ``DYNAMIC_BATCHER__BUCKET_BOUNDARIES`` instead. Optional.
+        Defaults to powers of 2, if ``--bucket-by`` is given.
+
+    -rt/--route (str):
+        A route(a model) to serve in the same process, as ``NAME=CALLABLE[:OPTION=VALUE,...]``. Repeatable.
+        ``OPTION`` is one of ``batch_size``, ``batch_time``, ``target_latency``, ``pipeline_depth``, ``executor`` and ``bucket_by``,
+        which overrides the one of the command for the route. ``DynamicBatcher(route=NAME)`` sends requests to it.
+        With ``callable`` as well, it serves the default route along.
+
+    -r/--replicas (int):
+        Number of BatchProcessor processes to run. if it is not provided, use envvar ``DYNAMIC_BATCHER__REPLICAS`` instead. Defaults to ``1``.
+        Each replica is a unique consumer of the same processor group, sharing requests safely.
     
     -lf/--log-config-file (str):
         Log Config file path. Optional.
@@ -47,16 +92,74 @@ Example
 
         $ dynamic_batch_processor 'example.add_1' --batch-size=64 --batch-time=2 --log-config-file=logging.conf
 
+        # 4 processes, to use more cores
+        $ dynamic_batch_processor 'example.add_1' --replicas=4
+
+        # gather the next batch while 2 batches are running on threads
+        $ dynamic_batch_processor 'example.add_1' --executor=thread --pipeline-depth=2
+
+        # batch sequences of similar lengths together
+        $ dynamic_batch_processor 'example.generate' --bucket-by=input_ids --bucket-boundaries=32,64,128,256
+
+        # 2 models in one process, each with its own batch policy
+        $ dynamic_batch_processor --batch-time=0.05 \
+            --route 'resnet=models.resnet_predict:batch_size=32,batch_time=0.01' \
+            --route 'bert=models.bert_predict:batch_size=8,executor=thread'
+
 """
 
 import argparse
 import os
+import signal
 import asyncio
+import multiprocessing
 
 from .logger import Logger
 from .validate import validate_callable
 
-from dynamic_batcher import BatchProcessor
+from dynamic_batcher import BatchProcessor, start_daemons
+
+
+# Options of a route, overriding the ones of the command.
+ROUTE_OPTIONS = {
+    "batch_size": int,
+    "batch_time": float,
+    "target_latency": float,
+    "pipeline_depth": int,
+    "executor": str,
+    "bucket_by": str,
+}
+
+
+def parse_route(value: str) -> tuple:
+    """Parse ``NAME=CALLABLE[:OPTION=VALUE,...]`` into ``(NAME, CALLABLE, {OPTION: VALUE})``."""
+    name, sep, spec = value.partition("=")
+    if not name or not sep or not spec:
+        raise argparse.ArgumentTypeError(f"Route should be NAME=CALLABLE[:OPTION=VALUE,...]: {value}")
+    callable_name, _, option_spec = spec.partition(":")
+    options = {}
+    for option in filter(None, option_spec.split(",")):
+        key, _, option_value = option.partition("=")
+        if key not in ROUTE_OPTIONS:
+            raise argparse.ArgumentTypeError(f"Route option should be one of {tuple(ROUTE_OPTIONS)}: {key}")
+        try:
+            options[key] = ROUTE_OPTIONS[key](option_value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid value of route option '{key}': {option_value}")
+    return name, callable_name, options
+
+
+def parse_boundaries(value: str) -> list:
+    """Parse ``32,64,128`` into ``[32, 64, 128]``."""
+    try:
+        return [int(boundary) for boundary in value.split(",") if boundary] or None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Bucket boundaries should be comma-separated integers: {value}")
+
+
+def parse_codecs(value: str) -> tuple:
+    """Parse ``json,msgpack`` into ``("json", "msgpack")``."""
+    return tuple(codec for codec in value.split(",") if codec)
 
 
 argparser = argparse.ArgumentParser(
@@ -67,6 +170,8 @@ argparser = argparse.ArgumentParser(
 argparser.add_argument(
     "callable",
     type=str,
+    nargs="?",
+    default=None,
     help="Callable name to execute. ex.: 'module.submodule.func'"
 )
 
@@ -79,9 +184,89 @@ argparser.add_argument(
 )
 argparser.add_argument(
     "-bt", "--batch-time",
-    help="Batch time delay of BatchProcessor",
+    help="Batch time delay(seconds) of BatchProcessor",
+    type=float,
+    default=float(os.getenv("DYNAMIC_BATCHER__BATCH_TIME", "2")),
+    required=False,
+)
+argparser.add_argument(
+    "-ex", "--executor",
+    help="Executor to run a batch on: 'thread' or 'process'",
+    type=str,
+    choices=["thread", "process"],
+    default=os.getenv("DYNAMIC_BATCHER__EXECUTOR", None),
+    required=False,
+)
+argparser.add_argument(
+    "-pd", "--pipeline-depth",
+    help="Number of batches running on the executor at once",
+    type=int,
+    default=int(os.getenv("DYNAMIC_BATCHER__PIPELINE_DEPTH", "1")),
+    required=False,
+)
+argparser.add_argument(
+    "-tl", "--target-latency",
+    help="Seconds of p99 latency to keep, retuning the batch size and the batch time",
+    type=float,
+    default=float(os.getenv("DYNAMIC_BATCHER__TARGET_LATENCY", "0")) or None,
+    required=False,
+)
+argparser.add_argument(
+    "-cd", "--codec",
+    help="Codec for requests not recording their codec",
+    type=str,
+    default=os.getenv("DYNAMIC_BATCHER__CODEC", "json"),
+    required=False,
+)
+argparser.add_argument(
+    "-ac", "--accepted-codecs",
+    help="Codecs to decode requests with, comma-separated",
+    type=parse_codecs,
+    default=os.getenv("DYNAMIC_BATCHER__ACCEPTED_CODECS", "json,msgpack,numpy"),
+    required=False,
+)
+argparser.add_argument(
+    "-tp", "--transport",
+    help="How requests and responses travel through Redis",
+    type=str,
+    choices=["stream", "list"],
+    default=os.getenv("DYNAMIC_BATCHER__TRANSPORT", "stream"),
+    required=False,
+)
+argparser.add_argument(
+    "-col", "--columnar",
+    help="Handle a batch in columns",
+    action="store_true",
+    default=os.getenv("DYNAMIC_BATCHER__COLUMNAR", "false").lower() in ("1", "true", "yes"),
+    required=False,
+)
+argparser.add_argument(
+    "-bb", "--bucket-by",
+    help="Field name of bodies as their sizes, to batch requests of similar sizes together",
+    type=str,
+    default=os.getenv("DYNAMIC_BATCHER__BUCKET_BY", None) or None,
+    required=False,
+)
+argparser.add_argument(
+    "-bd", "--bucket-boundaries",
+    help="Ascending upper bounds of sizes of buckets, comma-separated",
+    type=parse_boundaries,
+    default=os.getenv("DYNAMIC_BATCHER__BUCKET_BOUNDARIES", None) or None,
+    required=False,
+)
+argparser.add_argument(
+    "-rt", "--route",
+    help="A route to serve in the same process: NAME=CALLABLE[:OPTION=VALUE,...]",
+    type=parse_route,
+    action="append",
+    default=[],
+    required=False,
+)
+argparser.add_argument(
+    "-r", "--replicas",
+    help="Number of BatchProcessor processes",
     type=int,
-    default=int(os.getenv("DYNAMIC_BATCHER__BATCH_TIME", "2")),
+    default=int(os.getenv("DYNAMIC_BATCHER__REPLICAS", "1")),
     required=False,
 )
 
@@ -108,10 +293,9 @@ argparser.add_argument(
 )
 
 
-def run_batch_processor():
-    args, _ = argparser.parse_known_args()
-
-    batch_callable = validate_callable(-1)(args.callable)
+def _run_single_batch_processor(args: argparse.Namespace) -> None:
+    # Shuts down gracefully on SIGTERM, not to leave executor processes behind.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
 
     logger = Logger(
         level=args.log_level,
@@ -119,11 +303,74 @@ def run_batch_processor():
         log_config_json=args.log_config_json,
     )
 
-    batch_processor = BatchProcessor(
-        batch_size=args.batch_size,
-        batch_time=args.batch_time,
-    )
-    asyncio.run(batch_processor.start_daemon(batch_callable))
+    def _create_batch_processor(**options) -> BatchProcessor:
+        return BatchProcessor(**{
+            "batch_size": args.batch_size,
+            "batch_time": args.batch_time,
+            "executor": args.executor,
+            "pipeline_depth": args.pipeline_depth,
+            "target_latency": args.target_latency,
+            "codec": args.codec,
+            "accepted_codecs": args.accepted_codecs,
+            "columnar": args.columnar,
+            "transport": args.transport,
+            "bucket_by": args.bucket_by,
+            "bucket_boundaries": args.bucket_boundaries,
+            **options,
+        })
+
+    daemons = []
+    if args.callable is not None:
+        daemons.append((_create_batch_processor(), validate_callable(-1)(args.callable)))
+    for name, callable_name, options in args.route:
+        daemons.append((_create_batch_processor(route=name, **options), validate_callable(-1)(callable_name)))
+
+    try:
+        if len(daemons) == 1:
+            batch_processor, batch_callable = daemons[0]
+            asyncio.run(batch_processor.start_daemon(batch_callable))
+        else:
+            asyncio.run(start_daemons(daemons))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_batch_processor():
+    args, _ = argparser.parse_known_args()
+    if args.callable is None and not args.route:
+        argparser.error("'callable' or '--route' is required")
+
+    if args.replicas <= 1:
+        _run_single_batch_processor(args)
+        return
+
+    # 'spawn' to start each replica clean: a model runtime may not survive 'fork'.
+    # A spawned process does not re-run `__main__` of a package(`python -m dynamic_batcher`),
+    # so the target is referred by its module name.
+    from dynamic_batcher.__main__ import _run_single_batch_processor as run_replica
+
+    # Not daemonic, to run batches on processes of their own(``--executor process``).
+    ctx = multiprocessing.get_context("spawn")
+    replicas = [
+        ctx.Process(target=run_replica, args=(args,))
+        for _ in range(args.replicas)
+    ]
+    for replica in replicas:
+        replica.start()
+
+    # Stops replicas together, on SIGTERM as well as SIGINT, and waits for them to shut down.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for replica in replicas:
+            replica.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for replica in replicas:
+            if replica.is_alive():
+                replica.terminate()
+        for replica in replicas:
+            replica.join()
 
 
 
@@ -0,0 +1,217 @@
+"""
+====================================
+ :mod:`admission` Module
+====================================
+.. moduleauthor:: Youngju Jaden Kim <pydemia@gmail.com>
+.. note:: Info
+
+Info
+====
+    `AdmissionController`, rejecting requests of `DynamicBatcher` at once when the queue of their route is overloaded,
+    with `OverloadedError` to respond ``429``/``503`` instead of waiting out the timeout.
+
+"""
+
+
+from typing import Optional, Dict, NamedTuple
+import math
+import time
+
+
+__all__ = [
+    "OverloadedError",
+    "QueueLoad",
+    "AdmissionController",
+]
+
+
+class OverloadedError(RuntimeError):
+    """A request rejected by `DynamicBatcher`, without being sent, as the queue of its route is over a limit.
+
+    Attributes:
+        route (str): Route(a model) of the request. ``None`` for the default route.
+        queue_depth (int): Number of requests waiting, with the rejected ones.
+        estimated_wait (float): Seconds estimated to wait in the queue. ``None`` if not known yet.
+        retry_after (float): Seconds to retry after, like ``Retry-After`` of a ``503`` response.
+
+    Example:
+        >>> @app.post("/predict")
+        ... async def predict(body: Dict):
+        ...     try:
+        ...         return await batcher.asend(body)
+        ...     except OverloadedError as e:
+        ...         raise HTTPException(status_code=503, headers={"Retry-After": str(math.ceil(e.retry_after))})
+    """
+    def __init__(self, route: Optional[str], queue_depth: int, estimated_wait: Optional[float], retry_after: float):
+        self.route = route
+        self.queue_depth = queue_depth
+        self.estimated_wait = estimated_wait
+        self.retry_after = retry_after
+        wait = "unknown" if estimated_wait is None else f"{estimated_wait:.3f}s"
+        super().__init__(f"queue overloaded(route: {route}): {queue_depth} requests waiting, estimated wait {wait}")
+
+
+class QueueLoad(NamedTuple):
+    """Load of the queue of a route, at the latest observation.
+
+    Attributes:
+        queue_depth (int): Number of requests waiting, with the ones admitted since the observation.
+        throughput (float): Smoothed number of requests taken by `BatchProcessor` per second. ``None`` if not known yet.
+        estimated_wait (float): Seconds for a new request to wait in the queue. ``None`` if not known yet.
+        observed_at (float): When the queue was observed, in ``time.monotonic()``.
+    """
+    queue_depth: int
+    throughput: Optional[float]
+    estimated_wait: Optional[float]
+    observed_at: float
+
+
+class _RouteLoad:
+    # Observations of the queue of a route.
+    def __init__(self):
+        self.queue_depth = 0
+        self.admitted = 0
+        # Requests admitted before the observation in progress, so counted in it.
+        self.admitted_before: Optional[int] = None
+        self.observed_at = -math.inf
+        self.is_observing = False
+        self.throughput: Optional[float] = None
+        # Start of the current busy period: the counter of requests taken, and when.
+        self.taken: Optional[int] = None
+        self.taken_at = 0.0
+
+
+class AdmissionController:
+    """A controller to reject requests, when the queue of their route is too deep or too slow to drain.
+
+    It observes the queue of each route every `interval` seconds at most, in a round trip shared by the requests:
+    the number of requests waiting, and a counter of the ones taken by `BatchProcessor`(of all processes).
+    Between observations, the requests admitted are added to the queue depth.
+
+    The throughput is how fast the counter grows while the queue is not empty, over `window` seconds at least.
+    Then a request is estimated to wait ``queue_depth / throughput`` seconds, before its batch.
+
+    Args:
+        max_queue_depth (int):
+            Number of requests waiting, to reject the ones over. Defaults to ``0``(unlimited).
+
+        max_queue_wait (float):
+            Seconds estimated to wait in the queue, to reject the requests over. Defaults to ``0``(unlimited).
+            A request is also rejected when it is estimated to wait over its own timeout.
+
+        interval (float):
+            Seconds to reuse an observation of a queue. Defaults to ``0.05``.
+
+        window (float):
+            Seconds to measure the throughput over, at least. Defaults to ``1``.
+
+    Example:
+        >>> controller = AdmissionController(max_queue_depth=1000, max_queue_wait=2)
+        >>> if controller.needs_observation(route="resnet"):
+        ...     controller.observe(route="resnet", queue_depth=40, taken=1200)
+        >>> controller.check(route="resnet", timeout=10)
+        >>> controller.load(route="resnet")
+        QueueLoad(queue_depth=41, throughput=None, estimated_wait=None, observed_at=...)
+
+    """
+    smoothing = 0.3
+
+    def __init__(
+            self,
+            max_queue_depth: int = 0,
+            max_queue_wait: float = 0,
+            interval: float = 0.05,
+            window: float = 1,
+        ):
+        if max_queue_depth < 0 or max_queue_wait < 0:
+            raise ValueError(f"'max_queue_depth' and 'max_queue_wait' should not be negative: {max_queue_depth}, {max_queue_wait}")
+
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_wait = max_queue_wait
+        self.interval = interval
+        self.window = window
+        self._loads: Dict[Optional[str], _RouteLoad] = {}
+
+    def _get(self, route: Optional[str]) -> _RouteLoad:
+        load = self._loads.get(route)
+        if load is None:
+            load = self._loads[route] = _RouteLoad()
+        return load
+
+    def needs_observation(self, route: Optional[str] = None) -> bool:
+        """Whether the queue of a route should be observed now: not observed for `interval`, nor being observed."""
+        load = self._get(route)
+        return not load.is_observing and time.monotonic() - load.observed_at >= self.interval
+
+    def start_observation(self, route: Optional[str] = None) -> None:
+        """Mark the queue of a route as being observed, so that concurrent requests use the latest observation."""
+        load = self._get(route)
+        load.is_observing = True
+        load.admitted_before = load.admitted
+
+    def observe(self, route: Optional[str] = None, queue_depth: int = 0, taken: Optional[int] = None) -> None:
+        """Observe the queue of a route.
+
+        Args:
+            route (str): Route(a model) of the queue. Optional.
+            queue_depth (int): Number of requests waiting.
+            taken (int): A counter of requests taken by `BatchProcessor`. ``None`` if not known.
+        """
+        load = self._get(route)
+        now = time.monotonic()
+        load.queue_depth = max(0, queue_depth)
+        # Requests admitted during the observation may not be counted in it yet.
+        load.admitted = 0 if load.admitted_before is None else max(0, load.admitted - load.admitted_before)
+        load.admitted_before = None
+        load.observed_at = now
+        if taken is None:
+            return
+        # An empty queue is not drained at full speed: a busy period starts over.
+        if load.taken is None or load.queue_depth == 0 or taken < load.taken:
+            load.taken, load.taken_at = taken, now
+            return
+        elapsed = now - load.taken_at
+        if elapsed >= self.window:
+            rate = (taken - load.taken) / elapsed
+            if load.throughput is None:
+                load.throughput = rate
+            else:
+                load.throughput += self.smoothing * (rate - load.throughput)
+            load.taken, load.taken_at = taken, now
+
+    def end_observation(self, route: Optional[str] = None) -> None:
+        """End an observation of a route, observed or failed. A failed one is tried again on the next request."""
+        load = self._get(route)
+        load.is_observing = False
+        load.admitted_before = None
+
+    def load(self, route: Optional[str] = None, count: int = 0) -> QueueLoad:
+        """Load of the queue of a route, with `count` requests more."""
+        load = self._get(route)
+        queue_depth = load.queue_depth + load.admitted + count
+        estimated_wait = None
+        if load.throughput is not None:
+            estimated_wait = queue_depth / load.throughput if load.throughput > 0 else math.inf
+        return QueueLoad(queue_depth, load.throughput, estimated_wait, load.observed_at)
+
+    def check(self, route: Optional[str] = None, count: int = 1, timeout: Optional[float] = None) -> None:
+        """Admit `count` requests to the queue of a route, or reject them all.
+
+        Raises:
+            OverloadedError: the queue is over `max_queue_depth`, or estimated to wait over `max_queue_wait`(or `timeout`).
+        """
+        queue_load = self.load(route, count=count)
+        max_queue_wait = min(self.max_queue_wait or math.inf, math.inf if timeout is None else timeout)
+        is_too_deep = bool(self.max_queue_depth) and queue_load.queue_depth > self.max_queue_depth
+        is_too_slow = queue_load.estimated_wait is not None and queue_load.estimated_wait > max_queue_wait
+        if is_too_deep or is_too_slow:
+            retry_after = self.interval
+            if queue_load.throughput:
+                # Until the queue drains down under the limits.
+                excess = queue_load.queue_depth - min(
+                    self.max_queue_depth or math.inf,
+                    max_queue_wait * queue_load.throughput,
+                )
+                retry_after = max(retry_after, excess / queue_load.throughput)
+            raise OverloadedError(route, queue_load.queue_depth, queue_load.estimated_wait, retry_after)
+        self._get(route).admitted += count
@@ -12,14 +12,30 @@ Info
 """
 
 
-from typing import Optional, List, Dict, Callable, NamedTuple
+from typing import Any, Optional, List, Dict, Tuple, Callable, NamedTuple, Union, AsyncIterator, Awaitable
+from collections import OrderedDict
 import os
 import json
+import math
+import time
+import uuid
+import bisect
+import socket
+import weakref
 import logging
+import functools
 import asyncio
+import concurrent.futures
 import redis
+import redis.asyncio
 from autologging import logged
 from . import logger
+from .codecs import Codec, NumpyCodec, get_codec
+from .controller import AdaptiveBatchController
+from .cache import ResponseCache
+from .admission import AdmissionController
+from . import shm_engine, memory_engine
+from .validate import is_coroutine_callable, is_async_generator_callable, is_generator_callable
 
 from .redis_engine import (
     REDIS__HOST,
@@ -31,6 +47,11 @@ from .redis_engine import (
     REDIS__STREAM_KEY_RESPONSE,
     REDIS__STREAM_GROUP_BATCHER,
     get_client,
+    get_async_client,
+    get_transport,
+    Transport,
+    PRIORITIES,
+    DEFAULT_PRIORITY,
 )
 from .types import ResponseStream, PendingRequestStream
 
@@ -38,17 +59,149 @@ from .types import ResponseStream, PendingRequestStream
 __all__ = [
     "DynamicBatcher",
     "BatchProcessor",
+    "get_batcher",
+    "start_daemons",
 ]
 
 
 DYNAMIC_BATCHER__BATCH_SIZE = int(os.getenv("DYNAMIC_BATCHER__BATCH_SIZE", "64"))
-DYNAMIC_BATCHER__BATCH_TIME = int(os.getenv("DYNAMIC_BATCHER__BATCH_TIME", "2"))
+DYNAMIC_BATCHER__BATCH_TIME = float(os.getenv("DYNAMIC_BATCHER__BATCH_TIME", "2"))
+DYNAMIC_BATCHER__DELIVERY = os.getenv("DYNAMIC_BATCHER__DELIVERY", "poll")
+DYNAMIC_BATCHER__EXECUTOR = os.getenv("DYNAMIC_BATCHER__EXECUTOR", None)
+DYNAMIC_BATCHER__PIPELINE_DEPTH = int(os.getenv("DYNAMIC_BATCHER__PIPELINE_DEPTH", "1"))
+DYNAMIC_BATCHER__TARGET_LATENCY = float(os.getenv("DYNAMIC_BATCHER__TARGET_LATENCY", "0")) or None
+DYNAMIC_BATCHER__CODEC = os.getenv("DYNAMIC_BATCHER__CODEC", "json")
+DYNAMIC_BATCHER__ACCEPTED_CODECS = tuple(
+    codec for codec in os.getenv("DYNAMIC_BATCHER__ACCEPTED_CODECS", "json,msgpack,numpy").split(",") if codec
+)
+DYNAMIC_BATCHER__ENGINE = os.getenv("DYNAMIC_BATCHER__ENGINE", "redis")
+DYNAMIC_BATCHER__TRANSPORT = os.getenv("DYNAMIC_BATCHER__TRANSPORT", "stream")
+DYNAMIC_BATCHER__SHARED_MEMORY = os.getenv("DYNAMIC_BATCHER__SHARED_MEMORY", "false").lower() in ("1", "true", "yes")
+DYNAMIC_BATCHER__COLUMNAR = os.getenv("DYNAMIC_BATCHER__COLUMNAR", "false").lower() in ("1", "true", "yes")
+DYNAMIC_BATCHER__ROUTE = os.getenv("DYNAMIC_BATCHER__ROUTE", None) or None
+DYNAMIC_BATCHER__PRIORITY = os.getenv("DYNAMIC_BATCHER__PRIORITY", DEFAULT_PRIORITY)
+DYNAMIC_BATCHER__BUCKET_BY = os.getenv("DYNAMIC_BATCHER__BUCKET_BY", None) or None
+DYNAMIC_BATCHER__BUCKET_BOUNDARIES = [
+    int(boundary) for boundary in os.getenv("DYNAMIC_BATCHER__BUCKET_BOUNDARIES", "").split(",") if boundary
+] or None
+DYNAMIC_BATCHER__CACHE_SIZE = int(os.getenv("DYNAMIC_BATCHER__CACHE_SIZE", "0"))
+DYNAMIC_BATCHER__CACHE_TTL = float(os.getenv("DYNAMIC_BATCHER__CACHE_TTL", "0"))
+DYNAMIC_BATCHER__COALESCE_WINDOW = float(os.getenv("DYNAMIC_BATCHER__COALESCE_WINDOW", "0"))
+DYNAMIC_BATCHER__MAX_QUEUE_DEPTH = int(os.getenv("DYNAMIC_BATCHER__MAX_QUEUE_DEPTH", "0"))
+DYNAMIC_BATCHER__MAX_QUEUE_WAIT = float(os.getenv("DYNAMIC_BATCHER__MAX_QUEUE_WAIT", "0"))
+
+ENGINES = ("redis", "memory")
+DELIVERY_MODES = ("poll", "push")
+EXECUTORS = ("thread", "process")
+
+_PRIORITY_RANKS = {priority: rank for rank, priority in enumerate(PRIORITIES)}
+
+# Prefixes of a response to a request in shared memory: its size in the slot, or the body itself.
+_SHM_IN_SLOT = b"s"
+_SHM_IN_REDIS = b"r"
+
+# Prefixes of an item of a stream of partial results: a partial result, or the end.
+_CHUNK = b"c"
+_CHUNK_END = b"e"
 
 
 # logging.config.dictConfig(CONFIG_DEFAULTS)
 # logger.Logger(level="DEBUG")
 
 
+class _ResponseListener:
+    """(Internally used) Subscriber of finished ``stream_id``s, published by `BatchProcessor`.
+
+    One listener is shared by every `DynamicBatcher` running on the same event loop,
+    which means one pub/sub channel(and one connection) per gunicorn worker.
+    A notification arrived before its future is registered is kept for a while,
+    so a fast `BatchProcessor` cannot overtake `asend`.
+    """
+    max_unclaimed = 4096
+
+    def __init__(self, redis_client: redis.asyncio.Redis, response_key: str):
+        self.channel = f"{response_key}:{uuid.uuid4().hex}"
+        self._pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._unclaimed: OrderedDict = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_alive(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        await self._pubsub.subscribe(self.channel)
+        self._task = asyncio.create_task(self._listen())
+
+    def register(self, stream_id: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        if self._unclaimed.pop(stream_id, None):
+            future.set_result(stream_id)
+        else:
+            self._futures[stream_id] = future
+        return future
+
+    def discard(self, stream_id: str) -> None:
+        self._futures.pop(stream_id, None)
+
+    async def _listen(self) -> None:
+        async for message in self._pubsub.listen():
+            if message["type"] != "message":
+                continue
+            for stream_id in message["data"].split(","):
+                future = self._futures.pop(stream_id, None)
+                if future is None:
+                    self._unclaimed[stream_id] = True
+                    if len(self._unclaimed) > self.max_unclaimed:
+                        self._unclaimed.popitem(last=False)
+                elif not future.done():
+                    future.set_result(stream_id)
+
+
+def _to_columns(bodies: List[Dict]) -> Dict[str, List]:
+    # A field missing in a body is `None` in its column.
+    for body in bodies:
+        if not isinstance(body, dict):
+            raise TypeError(f"A body should be a Dict to be in columns: {type(body).__name__}")
+    fields = list(dict.fromkeys(field for body in bodies for field in body))
+    return {field: [body.get(field) for body in bodies] for field in fields}
+
+
+def _from_columns(columns: Dict[str, List]) -> List[Dict]:
+    # An array column is converted at once, not per item.
+    columns = {
+        field: column.tolist() if hasattr(column, 'tolist') else list(column)
+        for field, column in columns.items()
+    }
+    batch_sizes = {len(column) for column in columns.values()}
+    if len(batch_sizes) > 1:
+        raise ValueError(f"Columns should have the same length: {sorted(batch_sizes)}")
+    batch_size = batch_sizes.pop() if batch_sizes else 0
+    return [{field: column[index] for field, column in columns.items()} for index in range(batch_size)]
+
+
+class _OutgoingRequest(NamedTuple):
+    # A request encoded to be sent, with where its body is in shared memory(if `slot` is not ``None``).
+    fields: Dict
+    codec: Codec
+    ring: Optional[shm_engine.SharedMemoryRing]
+    slot: Optional[int]
+    deadline: float
+
+
+# The last step of a generator, run on an executor.
+_END_OF_STEPS = object()
+
+
+def _collect_steps(func: Callable, batch: Any) -> List:
+    # Runs a generator to the end, on a process of an executor.
+    return list(func(batch))
+
+
+_RESPONSE_LISTENERS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, _ResponseListener]]" = weakref.WeakKeyDictionary()
+
+
 @logged
 class DynamicBatcher:
     """A Client class for dynamic batch processing.
@@ -69,12 +222,121 @@ class DynamicBatcher:
             Seconds of deadline to wait for a response. Defaults to ``100``.
             If `timeout` is too large, it will be stuck on waiting too long, which is not intended.
             If `timeout` is too small, it will work as impatient, not waiting for the batch process is finished.
+
+        delivery (str):
+            How to get noticed that a response has arrived: ``poll`` or ``push``. Defaults to ``poll``.
+            If ``DYNAMIC_BATCHER__DELIVERY`` is set, the argument default value is overrided.
+
+            - ``poll``: check the request is accepted and the response has arrived, every `delay` seconds.
+            - ``push``: subscribe a pub/sub channel per event loop(a gunicorn worker),
+              where `BatchProcessor` publishes finished requests. Waiting requests cost nothing on Redis.
+
+        codec (:obj: ``str`` or ``Codec``):
+            Codec to (de)serialize bodies: ``json``, ``msgpack``, ``pickle`` or a registered one. Defaults to ``json``.
+            If ``DYNAMIC_BATCHER__CODEC`` is set, the argument default value is overrided.
+            It is recorded in each request, and `BatchProcessor` responds with the same codec.
+
+        shared_memory (bool):
+            Whether to pass bodies through shared memory, when `BatchProcessor` runs on the same host. Defaults to ``False``.
+            If ``DYNAMIC_BATCHER__SHARED_MEMORY`` is set, the argument default value is overrided.
+            Then Redis carries only where a body is, and the response is written back to the same place.
+            A body larger than a slot(``SHM__SLOT_SIZE``), or over the slots(``SHM__SLOTS``), goes through Redis.
+
+        engine (str):
+            Where requests are queued: ``redis`` or ``memory``. Defaults to ``redis``.
+            If ``DYNAMIC_BATCHER__ENGINE`` is set, the argument default value is overrided.
+
+            - ``redis``: Redis streams, shared by processes and hosts.
+            - ``memory``: an in-process queue on the running event loop, without Redis.
+              `BatchProcessor` of ``memory`` should run on the same event loop, like a task of the app.
+              Bodies are given as they are, not serialized, so `codec`, `delivery` and `shared_memory` are ignored.
+
+        transport (str):
+            How requests and responses travel through Redis: ``stream`` or ``list``. Defaults to ``stream``.
+            If ``DYNAMIC_BATCHER__TRANSPORT`` is set, the argument default value is overrided.
+            It should be the same as of `BatchProcessor`.
+
+            - ``stream``: a stream with a consumer group(:class:`~dynamic_batcher.redis_engine.RedisStreamTransport`).
+              A request of a dead `BatchProcessor` is reclaimed by another(at-least-once).
+            - ``list``: a list popped in bulk, and a reply list per request(:class:`~dynamic_batcher.redis_engine.RedisListTransport`).
+              Lighter, but a request of a dead `BatchProcessor` is lost(at-most-once). `delivery` is ignored: it waits on the reply list.
+
+        route (str):
+            Route(a model) to send requests to, with its own queue like ``request:resnet``. Optional.
+            If ``DYNAMIC_BATCHER__ROUTE`` is set, the argument default value is overrided.
+            Without a route, requests go to the default queue(``REDIS__STREAM_KEY_REQUEST``).
+            `asend` can send a request to another route.
+
+        priority (str):
+            Priority class of requests: ``high``, ``normal`` or ``low``. Defaults to ``normal``.
+            If ``DYNAMIC_BATCHER__PRIORITY`` is set, the argument default value is overrided.
+            Each class has its own lane, and `BatchProcessor` fills a batch from the higher lanes first.
+            A ``high`` request dispatches its batch early, without waiting for the batch to be full.
+            `asend` can send a request of another class.
+
+        cache_size (int):
+            Number of responses to cache in the process, by their requests(bodies and routes). Defaults to ``0``.
+            If ``DYNAMIC_BATCHER__CACHE_SIZE`` is set, the argument default value is overrided.
+            A request cached is responded without being sent, and concurrent identical requests share a single one.
+            Only for deterministic models. See :class:`~dynamic_batcher.cache.ResponseCache`.
+
+        cache_ttl (float):
+            Seconds to cache responses on Redis as well, shared by other processes. Defaults to ``0``(not shared).
+            If ``DYNAMIC_BATCHER__CACHE_TTL`` is set, the argument default value is overrided.
+            Ignored on ``memory`` engine.
+
+        coalesce_window (float):
+            Seconds to hold requests of `asend`, to send the ones of the same route and priority together. Defaults to ``0``(not held).
+            If ``DYNAMIC_BATCHER__COALESCE_WINDOW`` is set, the argument default value is overrided.
+            Concurrent requests of a process(a gunicorn worker), like ``0.002`` for 2ms, are written in a single round trip,
+            and waited for by a single waiter, as of `asend_many`. Ignored on ``memory`` engine.
+
+        max_queue_depth (int):
+            Number of requests waiting in the queue of a route, to reject the ones over. Defaults to ``0``(unlimited).
+            If ``DYNAMIC_BATCHER__MAX_QUEUE_DEPTH`` is set, the argument default value is overrided.
+            A request rejected raises :class:`~dynamic_batcher.admission.OverloadedError` at once, without being sent.
+
+        max_queue_wait (float):
+            Seconds estimated to wait in the queue of a route, to reject the requests over. Defaults to ``0``(unlimited).
+            If ``DYNAMIC_BATCHER__MAX_QUEUE_WAIT`` is set, the argument default value is overrided.
+            It is estimated by the queue depth and the throughput of `BatchProcessor` observed.
+            With either limit, a request estimated to wait over its own timeout is rejected as well.
+            See :class:`~dynamic_batcher.admission.AdmissionController`.
     
     Attributes:
         delay (int):
             Seconds of frequency to parse a response, corresponding a request sent.
         timeout (int):
             Seconds of deadline to wait for a response.
+        delivery (str):
+            How to get noticed that a response has arrived: ``poll`` or ``push``.
+        push_fallback_interval (int):
+            Seconds of frequency to check a response by itself on ``push``, in case a notification is lost.
+        codec (Codec):
+            Codec to (de)serialize bodies.
+        shared_memory (bool):
+            Whether to pass bodies through shared memory.
+        engine (str):
+            Where requests are queued: ``redis`` or ``memory``.
+        transport (Transport):
+            How requests and responses travel through Redis, on `route`.
+        route (str):
+            Route(a model) to send requests to, by default.
+        priority (str):
+            Priority class of requests, by default.
+        cache (ResponseCache):
+            Cache of responses, if `cache_size` or `cache_ttl` is given. ``cache.info()`` counts hits and misses.
+        coalesce_window (float):
+            Seconds to hold requests of `asend`, to send them together.
+        coalesce_max_size (int):
+            Number of requests held, to be sent at once without waiting for `coalesce_window`.
+        stream_block_sec (int):
+            Upper bound of seconds to block at once, waiting for a partial result on `astream`.
+        admission (AdmissionController):
+            Admission control of requests, if `max_queue_depth` or `max_queue_wait` is given. ``admission.load(route)`` tells the load of a queue.
+        shared_memory_grace_sec (int):
+            Seconds to keep the slot of a request timed out, before it is reused.
+            `BatchProcessor` does not write a response after the deadline, but may be writing at the moment.
 
     Example:
         Create a `batcher`:
@@ -86,7 +348,50 @@ class DynamicBatcher:
         
         Or, create a fail-fast `batcher`:
             >>> fail_fast_batcher = DynamicBatcher(timeout=3)
+
+        Get noticed by `BatchProcessor`, instead of polling:
+            >>> push_batcher = DynamicBatcher(delivery="push")
+
+        Send bodies in binary:
+            >>> msgpack_batcher = DynamicBatcher(codec="msgpack")
+
+        Send bodies through shared memory, to `BatchProcessor` on the same host:
+            >>> local_batcher = DynamicBatcher(shared_memory=True)
+
+        Batch requests in a single process, without Redis:
+            >>> in_process_batcher = DynamicBatcher(engine="memory")
+
+        Send requests to a model, served by `BatchProcessor` of the same route:
+            >>> resnet_batcher = DynamicBatcher(route="resnet")
+
+        Send bulk requests, not to delay online ones on the same model:
+            >>> backfill_batcher = DynamicBatcher(priority="low")
+
+        Respond repeated requests from a cache, shared by workers for a minute:
+            >>> cached_batcher = DynamicBatcher(cache_size=4096, cache_ttl=60)
+            >>> cached_batcher.cache.info()
+            CacheInfo(hits=0, shared_hits=0, misses=0, coalesced=0, size=0, maxsize=4096)
+
+        Send concurrent requests of a worker together, held for 2ms:
+            >>> coalescing_batcher = DynamicBatcher(coalesce_window=0.002)
+
+        Get partial results of a generator `func` of `BatchProcessor`, as they are made:
+            >>> async for token in batcher.astream({'prompt': 'Hello'}):
+            ...     print(token)
+
+        Reject requests at once, over 1000 waiting or 2 seconds to wait(to respond ``503``):
+            >>> bounded_batcher = DynamicBatcher(max_queue_depth=1000, max_queue_wait=2)
+            >>> await bounded_batcher.asend({'a': 1})
+            OverloadedError: queue overloaded(route: None): 1001 requests waiting, estimated wait 2.184s
     
+    Note:
+        Requests are sent and waited with an asyncio-native client(``redis.asyncio``),
+        which has its own connection pool per event loop, created lazily on the first `asend`.
+        So waiting requests never block the event loop.
+
+        The connection check and the stream setup happen once per process, on the first `DynamicBatcher`.
+        Use :func:`get_batcher` to share one `DynamicBatcher` per process, like a FastAPI dependency.
+
     Raises:
         redis.exceptions.ConnectionError: a redis server is not available.
 
@@ -101,33 +406,113 @@ class DynamicBatcher:
             # group="infergrp",
             delay: int = 0.01,
             timeout: int = 100,
+            delivery: str = DYNAMIC_BATCHER__DELIVERY,
+            codec: Union[str, Codec] = DYNAMIC_BATCHER__CODEC,
+            shared_memory: bool = DYNAMIC_BATCHER__SHARED_MEMORY,
+            engine: str = DYNAMIC_BATCHER__ENGINE,
+            transport: str = DYNAMIC_BATCHER__TRANSPORT,
+            route: Optional[str] = DYNAMIC_BATCHER__ROUTE,
+            priority: str = DYNAMIC_BATCHER__PRIORITY,
+            cache_size: int = DYNAMIC_BATCHER__CACHE_SIZE,
+            cache_ttl: float = DYNAMIC_BATCHER__CACHE_TTL,
+            coalesce_window: float = DYNAMIC_BATCHER__COALESCE_WINDOW,
+            max_queue_depth: int = DYNAMIC_BATCHER__MAX_QUEUE_DEPTH,
+            max_queue_wait: float = DYNAMIC_BATCHER__MAX_QUEUE_WAIT,
         ):
         self.log = self.__log or logging.getLogger(self.__class__.__qualname__)
 
-        self._redis_client = get_client(
-            host=REDIS__HOST,
-            port=REDIS__PORT,
-            db=REDIS__DB,
-            password=REDIS__PASSWORD,
-        )
+        if engine not in ENGINES:
+            raise ValueError(f"'engine' should be one of {ENGINES}: {engine}")
+        if priority not in PRIORITIES:
+            raise ValueError(f"'priority' should be one of {PRIORITIES}: {priority}")
+        self.engine = engine
+        self.route = route
+        self.priority = priority
+        self.transport = get_transport(transport, route=route)
+        self._transports: Dict[Optional[str], Transport] = {route: self.transport}
+        self._redis_client = None
+        if engine == "redis":
+            self._redis_client = get_client(
+                host=REDIS__HOST,
+                port=REDIS__PORT,
+                db=REDIS__DB,
+                password=REDIS__PASSWORD,
+            )
         self._request_key: str = REDIS__STREAM_KEY_REQUEST
         self._response_key: str = REDIS__STREAM_KEY_RESPONSE
         self._processor_group: str = REDIS__STREAM_GROUP_PROCESSOR
         self._batcher_group: str = REDIS__STREAM_GROUP_BATCHER
 
+        if delivery not in DELIVERY_MODES:
+            raise ValueError(f"'delivery' should be one of {DELIVERY_MODES}: {delivery}")
+
         self.delay = delay
         self.timeout = timeout
+        self.delivery = delivery
+        self.push_fallback_interval = 1
+        self.codec = get_codec(codec)
+        self.shared_memory = shared_memory
+        self.shared_memory_grace_sec = 1
+        if engine == "memory":
+            cache_ttl = 0
+        self.cache = ResponseCache(maxsize=cache_size, ttl=cache_ttl, codec=self.codec) if cache_size or cache_ttl else None
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_size = 256
+        self.stream_block_sec = 1
+        self.admission = None
+        if max_queue_depth or max_queue_wait:
+            self.admission = AdmissionController(max_queue_depth=max_queue_depth, max_queue_wait=max_queue_wait)
+        self._coalesced_requests: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, List]]" = weakref.WeakKeyDictionary()
+        self._coalescing_tasks = set()
+
+    @property
+    def _async_redis_client(self) -> redis.asyncio.Redis:
+        return get_async_client(
+            host=REDIS__HOST,
+            port=REDIS__PORT,
+            db=REDIS__DB,
+            password=REDIS__PASSWORD,
+        )
+
+    def _get_transport(self, route: Optional[str]) -> Transport:
+        transport = self._transports.get(route)
+        if transport is None:
+            transport = self._transports[route] = get_transport(self.transport.name, route=route)
+        return transport
 
-    async def asend(self, body: Dict|List, *args, **kwargs) -> Optional[Dict|List]:
-        """Send a request and wait for a response, with JSON-serializable body.
+    async def asend(
+            self,
+            body: Dict|List,
+            *args,
+            timeout: Optional[float] = None,
+            route: Optional[str] = None,
+            priority: Optional[str] = None,
+            **kwargs,
+        ) -> Optional[Dict|List]:
+        """Send a request and wait for a response, with a body serializable by the codec(JSON, by default).
+
+        The request carries its deadline(`timeout` from now), so that `BatchProcessor` drops it without running,
+        when it is expired before a batch.
+        With `cache`, a cached request is responded without being sent, and an identical one in flight is waited for.
+        With `max_queue_depth` or `max_queue_wait`, a request is rejected at once when the queue is overloaded.
 
         Args:
-            body (:obj: ``Dict`` or ``List``): A **JSON-serializable object**, especially ``Dict`` or ``List``.
+            body (:obj: ``Dict`` or ``List``): A **JSON-serializable object**, especially ``Dict`` or ``List``(or serializable by `codec`).
+                A ``numpy.ndarray``, or a ``Dict`` of them, is sent as raw buffers(``numpy`` codec) instead of JSON.
+            timeout (float): Seconds of deadline to wait for a response, for this request only. Optional.
+                Defaults to `timeout` of the `DynamicBatcher`.
+            route (str): Route(a model) to send this request to. Optional.
+                Defaults to `route` of the `DynamicBatcher`.
+            priority (str): Priority class of this request: ``high``, ``normal`` or ``low``. Optional.
+                Defaults to `priority` of the `DynamicBatcher`.
             \*args: Variable length argument list.
             \**kwargs: Arbitrary keyword arguments.
         
         Returns:
             Dict or List: optional
+
+        Raises:
+            OverloadedError: the queue of the route is overloaded, with `max_queue_depth` or `max_queue_wait`.
         
         Example:
 
@@ -163,15 +548,52 @@ class DynamicBatcher:
             INFO:     Application startup complete.
             INFO:     Uvicorn running on http://127.0.0.1:8000 (Press CTRL+C to quit)
         """
-        try:
-            json_body = json.dumps(body)
-        except json.JSONDecodeError as json_e:
-            self.log.error(f"cannot serialize request body: {json_e}\n{json_e.with_traceback}")
+        if route is None:
+            route = self.route
+        if priority is None:
+            priority = self.priority
+        elif priority not in PRIORITIES:
+            raise ValueError(f"'priority' should be one of {PRIORITIES}: {priority}")
+        if self.cache is not None:
+            cache_key = self.cache.make_key(body, route=route)
+            if cache_key is not None:
+                return await self.cache.aget(
+                    cache_key,
+                    lambda: self._asend(body, timeout=timeout, route=route, priority=priority),
+                    timeout=self.timeout if timeout is None else timeout,
+                )
+        return await self._asend(body, timeout=timeout, route=route, priority=priority)
+
+    async def _asend(self, body, timeout: Optional[float] = None, route: Optional[str] = None, priority: str = DEFAULT_PRIORITY):
+        await self._admit(route, timeout=self.timeout if timeout is None else timeout)
+        if self.engine == "memory":
+            return await self._asend_in_memory(body, timeout=timeout, route=route, priority=priority)
+        if self.coalesce_window:
+            return await self._asend_coalesced(body, timeout=timeout, route=route, priority=priority)
+        transport = self._get_transport(route)
+
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.time() + timeout
+        request = self._encode_request(body, deadline=deadline, priority=priority)
+        if request is None:
             return
+        fields, codec, slot = request.fields, request.codec, request.slot
+        r = None
         try:
-            requested_stream_id: bytes = self._redis_client.xadd(self._request_key, {"body": json_body})
-            r = await self._wait_for_start(requested_stream_id, delay=self.delay, timeout=self.timeout)
-            r = await self._wait_for_finish(requested_stream_id, delay=self.delay, timeout=self.timeout)
+            await transport.prepare()
+            if transport.blocking_response:
+                requested_stream_id: str = await transport.send(fields, priority=priority)
+                message = await transport.wait_response(requested_stream_id, timeout=timeout)
+                r = self._as_response(requested_stream_id, message, codec, slot)
+            elif self.delivery == "push":
+                listener = await self._get_response_listener(transport)
+                requested_stream_id: str = await transport.send({**fields, "reply_to": listener.channel}, priority=priority)
+                r = await self._wait_for_notification(listener, requested_stream_id, timeout=timeout, codec=codec, slot=slot, transport=transport)
+            else:
+                requested_stream_id: str = await transport.send(fields, priority=priority)
+                r = await self._wait_for_start(requested_stream_id, delay=self.delay, timeout=timeout, transport=transport)
+                r = await self._wait_for_finish(requested_stream_id, delay=self.delay, timeout=deadline - time.time(), codec=codec, slot=slot, transport=transport)
             return r.body
         except redis.RedisError as redis_e:
             self.log.error(f"redis not available: {redis_e}\n{redis_e.with_traceback}")
@@ -182,13 +604,350 @@ class DynamicBatcher:
         except Exception as unknown_e:
             self.log.error(f"failed to respond (unknown): {unknown_e}")
             return
+        finally:
+            self._release_slot(request, is_responded=bool(r))
+
+    async def asend_many(
+            self,
+            bodies: List[Dict|List],
+            *args,
+            timeout: Optional[float] = None,
+            route: Optional[str] = None,
+            priority: Optional[str] = None,
+            **kwargs,
+        ) -> List[Optional[Dict|List]]:
+        r"""Send requests at once and wait for all of their responses, like fanning out a request into many inputs.
+
+        The requests are written in a single round trip, and their responses are waited for together,
+        in a round trip per check(or a single ``BLPOP`` on ``list`` transport), instead of one per request.
+        They are batched by `BatchProcessor` as the requests sent by `asend`, not as a single batch.
+        They bypass `cache`.
+
+        Args:
+            bodies (:obj: ``List``): Bodies, each as of `asend`.
+            timeout (float): Seconds of deadline to wait for all responses. Optional.
+                Defaults to `timeout` of the `DynamicBatcher`.
+            route (str): Route(a model) to send the requests to. Optional.
+                Defaults to `route` of the `DynamicBatcher`.
+            priority (str): Priority class of the requests: ``high``, ``normal`` or ``low``. Optional.
+                Defaults to `priority` of the `DynamicBatcher`.
+            \*args: Variable length argument list.
+            \**kwargs: Arbitrary keyword arguments.
+
+        Returns:
+            List: Responses in the order of `bodies`, ``None`` for the ones failed or timed out.
+
+        Raises:
+            OverloadedError: the queue of the route is overloaded, counting all of `bodies`. None of them is sent.
+
+        Example:
+            >>> candidates = [{'user': user_id, 'item': item_id} for item_id in item_ids]
+            >>> scores = await batcher.asend_many(candidates)
+        """
+        if route is None:
+            route = self.route
+        if priority is None:
+            priority = self.priority
+        elif priority not in PRIORITIES:
+            raise ValueError(f"'priority' should be one of {PRIORITIES}: {priority}")
+        await self._admit(route, count=len(bodies), timeout=self.timeout if timeout is None else timeout)
+        if self.engine == "memory":
+            return list(await asyncio.gather(*[
+                self._asend_in_memory(body, timeout=timeout, route=route, priority=priority) for body in bodies
+            ]))
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.time() + timeout
+        requests = [self._encode_request(body, deadline=deadline, priority=priority) for body in bodies]
+        return await self._send_many(self._get_transport(route), requests, priority=priority)
+
+    async def astream(
+            self,
+            body: Dict|List,
+            *args,
+            timeout: Optional[float] = None,
+            route: Optional[str] = None,
+            priority: Optional[str] = None,
+            **kwargs,
+        ) -> AsyncIterator[Any]:
+        r"""Send a request, and iterate over its partial results as they are made, like tokens of a generative model.
+
+        A generator `func` of `BatchProcessor` yields a partial result of the batch per step,
+        and the ones of this request are pushed to it right after each step, not after the last one.
+        Other `func` gives its whole result at once, as a single partial result.
+        It bypasses `cache`.
+
+        Args:
+            body (:obj: ``Dict`` or ``List``): A body, as of `asend`.
+            timeout (float): Seconds of deadline to wait for the last partial result. Optional.
+                Defaults to `timeout` of the `DynamicBatcher`.
+            route (str): Route(a model) to send this request to. Optional.
+                Defaults to `route` of the `DynamicBatcher`.
+            priority (str): Priority class of this request: ``high``, ``normal`` or ``low``. Optional.
+                Defaults to `priority` of the `DynamicBatcher`.
+            \*args: Variable length argument list.
+            \**kwargs: Arbitrary keyword arguments.
+
+        Yields:
+            Partial results of the request. It stops early if failed or timed out.
+
+        Raises:
+            OverloadedError: the queue of the route is overloaded, with `max_queue_depth` or `max_queue_wait`.
+
+        Example:
+            >>> @app.post("/generate")
+            ... async def generate(body: Dict):
+            ...     async def tokens():
+            ...         async for token in batcher.astream(body):
+            ...             yield token
+            ...     return StreamingResponse(tokens())
+        """
+        if route is None:
+            route = self.route
+        if priority is None:
+            priority = self.priority
+        elif priority not in PRIORITIES:
+            raise ValueError(f"'priority' should be one of {PRIORITIES}: {priority}")
+        if timeout is None:
+            timeout = self.timeout
+        await self._admit(route, timeout=timeout)
+        deadline = time.time() + timeout
+        if self.engine == "memory":
+            async for chunk in self._astream_in_memory(body, deadline=deadline, route=route, priority=priority):
+                yield chunk
+            return
+
+        request = self._encode_request(body, deadline=deadline, priority=priority)
+        if request is None:
+            return
+        transport = self._get_transport(route)
+        is_ended = False
+        try:
+            await transport.prepare()
+            request_id = await transport.send({**request.fields, "stream": transport.stream_key()}, priority=priority)
+            while not is_ended:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.log.error(f"failed to respond (timeout): {request_id}")
+                    return
+                # Blocks a while at once, not to be over the socket timeout of the client.
+                chunk = await transport.pop_chunk(request_id, timeout=min(remaining, self.stream_block_sec))
+                if chunk is None:
+                    continue
+                if chunk[:1] == _CHUNK_END:
+                    is_ended = True
+                    # The whole response is not to be read.
+                    await transport.pop_response(request_id)
+                    return
+                yield request.codec.decode(chunk[1:])
+        except redis.RedisError as redis_e:
+            self.log.error(f"redis not available: {redis_e}\n{redis_e.with_traceback}")
+        except Exception as unknown_e:
+            self.log.error(f"failed to respond (unknown): {unknown_e}")
+        finally:
+            self._release_slot(request, is_responded=is_ended)
+
+    async def _astream_in_memory(self, body, deadline: float, route: Optional[str] = None, priority: str = DEFAULT_PRIORITY) -> AsyncIterator[Any]:
+        broker = memory_engine.get_broker(route)
+        request_id, _ = broker.put(body, deadline=deadline, priority=priority, stream=True)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(broker.get_chunk(request_id), timeout=deadline - time.time())
+                except asyncio.TimeoutError:
+                    self.log.error(f"failed to respond (timeout): {request_id}")
+                    return
+                if chunk is memory_engine.END_OF_STREAM:
+                    return
+                yield chunk
+        finally:
+            broker.discard(request_id)
+
+    async def _admit(self, route: Optional[str], count: int = 1, timeout: Optional[float] = None) -> None:
+        # Raises `OverloadedError` to reject requests. The queue is observed once in a while, by one of the requests.
+        if self.admission is None:
+            return
+        if self.admission.needs_observation(route):
+            self.admission.start_observation(route)
+            try:
+                if self.engine == "memory":
+                    broker = memory_engine.get_broker(route)
+                    queue_depth, taken = broker.qsize(), broker.taken
+                else:
+                    queue_depth, taken = await self._get_transport(route).queue_stats()
+                self.admission.observe(route, queue_depth=queue_depth, taken=taken)
+            except redis.RedisError as e:
+                self.log.error(f'Error while observing the queue {e}')
+            finally:
+                self.admission.end_observation(route)
+        self.admission.check(route, count=count, timeout=timeout)
+
+    def _encode_request(self, body, deadline: float, priority: str = DEFAULT_PRIORITY) -> Optional[_OutgoingRequest]:
+        # JSON cannot encode arrays: they are sent as raw buffers.
+        codec = self.codec
+        if codec.name == "json" and NumpyCodec.is_tensor(body):
+            codec = get_codec(NumpyCodec.name)
+        try:
+            encoded_body = codec.encode(body)
+        except Exception as encode_e:
+            self.log.error(f"cannot serialize request body: {encode_e}\n{encode_e.with_traceback}")
+            return
+        fields = {"codec": codec.name, "deadline": deadline}
+        if priority != DEFAULT_PRIORITY:
+            fields["priority"] = priority
+        if self.shared_memory and isinstance(encoded_body, str):
+            encoded_body = encoded_body.encode()
+        ring, slot = self._acquire_slot(len(encoded_body))
+        if slot is not None:
+            fields.update({
+                "shm": ring.name,
+                "shm_offset": ring.offset(slot),
+                "shm_capacity": ring.slot_size,
+                "shm_size": ring.write(slot, encoded_body),
+            })
+        else:
+            fields["body"] = encoded_body
+        return _OutgoingRequest(fields, codec, ring, slot, deadline)
+
+    def _release_slot(self, request: _OutgoingRequest, is_responded: bool) -> None:
+        if request.slot is None:
+            return
+        if is_responded:
+            request.ring.release(request.slot)
+        else:
+            asyncio.get_running_loop().call_later(self.shared_memory_grace_sec, request.ring.release, request.slot)
+
+    async def _send_many(self, transport: Transport, requests: List[Optional[_OutgoingRequest]], priority: str = DEFAULT_PRIORITY) -> List:
+        # Requests failed to encode are `None`, and so are their responses.
+        responses = [None] * len(requests)
+        sent = [(index, request) for index, request in enumerate(requests) if request is not None]
+        if not sent:
+            return responses
+        try:
+            await transport.prepare()
+            fields_list = [request.fields for _, request in sent]
+            listener = None
+            if not transport.blocking_response and self.delivery == "push":
+                listener = await self._get_response_listener(transport)
+                fields_list = [{**fields, "reply_to": listener.channel} for fields in fields_list]
+            request_ids = await transport.send_many(fields_list, priority=priority)
+            messages = await self._wait_for_many(transport, request_ids, [request.deadline for _, request in sent], listener)
+            for (index, request), request_id, message in zip(sent, request_ids, messages):
+                try:
+                    r = self._as_response(request_id, message, request.codec, request.slot)
+                except Exception as decode_e:
+                    self.log.error(f"cannot de-serialize response body: {decode_e}")
+                    continue
+                if r:
+                    responses[index] = r.body
+        except redis.RedisError as redis_e:
+            self.log.error(f"redis not available: {redis_e}\n{redis_e.with_traceback}")
+        except Exception as unknown_e:
+            self.log.error(f"failed to respond (unknown): {unknown_e}")
+        finally:
+            for index, request in sent:
+                self._release_slot(request, is_responded=responses[index] is not None)
+        return responses
+
+    async def _wait_for_many(self, transport: Transport, request_ids: List[str], deadlines: List[float], listener: Optional[_ResponseListener] = None) -> List[Optional[bytes]]:
+        # A single waiter for all: each check pops the responses arrived, in a round trip.
+        if transport.blocking_response:
+            return await transport.wait_responses(request_ids, timeout=max(deadlines) - time.time())
+        futures = {request_id: listener.register(request_id) for request_id in request_ids} if listener else {}
+        messages: Dict[str, bytes] = {}
+        pending = list(zip(request_ids, deadlines))
+        try:
+            while pending:
+                # Notified before the check, but without a response: failed.
+                notified = {request_id for request_id, future in futures.items() if future.done()}
+                popped = await transport.pop_responses([request_id for request_id, _ in pending])
+                for (request_id, _), message in zip(pending, popped):
+                    if message:
+                        messages[request_id] = message
+                now = time.time()
+                pending = [
+                    (request_id, deadline) for request_id, deadline in pending
+                    if request_id not in messages and request_id not in notified and deadline > now
+                ]
+                if not pending:
+                    break
+                remaining = max(deadline for _, deadline in pending) - now
+                if listener is None:
+                    await asyncio.sleep(min(self.delay, remaining))
+                else:
+                    await asyncio.wait(
+                        [futures[request_id] for request_id, _ in pending],
+                        timeout=min(self.push_fallback_interval, remaining),
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+        finally:
+            for request_id in futures:
+                listener.discard(request_id)
+        return [messages.get(request_id) for request_id in request_ids]
+
+    async def _asend_coalesced(self, body, timeout: Optional[float] = None, route: Optional[str] = None, priority: str = DEFAULT_PRIORITY):
+        # Requests of the same route and priority within `coalesce_window` are sent together, by `_send_many`.
+        if timeout is None:
+            timeout = self.timeout
+        request = self._encode_request(body, deadline=time.time() + timeout, priority=priority)
+        if request is None:
+            return
+        loop = asyncio.get_running_loop()
+        groups = self._coalesced_requests.setdefault(loop, {})
+        group = groups.get((route, priority))
+        if group is None:
+            group = groups[(route, priority)] = []
+            loop.call_later(self.coalesce_window, self._flush_coalesced, loop, route, priority, group)
+        future = loop.create_future()
+        group.append((request, future))
+        if len(group) >= self.coalesce_max_size:
+            self._flush_coalesced(loop, route, priority, group)
+        return await future
+
+    def _flush_coalesced(self, loop: asyncio.AbstractEventLoop, route: Optional[str], priority: str, group: List) -> None:
+        # The timer of a group flushed already by its size does nothing.
+        groups = self._coalesced_requests.get(loop, {})
+        if groups.get((route, priority)) is not group:
+            return
+        del groups[(route, priority)]
+        task = loop.create_task(self._send_coalesced(route, priority, group))
+        self._coalescing_tasks.add(task)
+        task.add_done_callback(self._coalescing_tasks.discard)
+
+    async def _send_coalesced(self, route: Optional[str], priority: str, group: List) -> None:
+        responses = await self._send_many(self._get_transport(route), [request for request, _ in group], priority=priority)
+        for (_, future), response in zip(group, responses):
+            if not future.done():
+                future.set_result(response)
+
+    async def _asend_in_memory(self, body, timeout: Optional[float] = None, route: Optional[str] = None, priority: str = DEFAULT_PRIORITY):
+        if timeout is None:
+            timeout = self.timeout
+        broker = memory_engine.get_broker(route)
+        request_id, future = broker.put(body, deadline=time.time() + timeout, priority=priority)
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            self.log.error(f"failed to respond (timeout): {request_id}")
+            return
+        finally:
+            broker.discard(request_id)
+
+    def _acquire_slot(self, size: int) -> Tuple[Optional[shm_engine.SharedMemoryRing], Optional[int]]:
+        if not self.shared_memory:
+            return None, None
+        ring = shm_engine.get_ring()
+        if size > ring.slot_size:
+            return ring, None
+        return ring, ring.acquire()
 
 
-    async def _wait_for_start(self, stream_id: bytes, delay: int = 0.1, timeout=10) -> Optional[ResponseStream]:
+    async def _wait_for_start(self, stream_id: bytes, delay: int = 0.1, timeout=10, transport: Optional[Transport] = None) -> Optional[ResponseStream]:
+        r = None
         is_accepted = False
         total_delay = 0
         while is_accepted or (total_delay < timeout):
-            r = self._get_request_accepted(stream_id)
+            r = await self._get_request_accepted(stream_id, transport)
             if r:
                 is_accepted = True
                 break
@@ -196,11 +955,12 @@ class DynamicBatcher:
             total_delay += delay
         return r
 
-    async def _wait_for_finish(self, stream_id: bytes, delay: int = 0.1, timeout=10) -> Optional[ResponseStream]:
+    async def _wait_for_finish(self, stream_id: bytes, delay: int = 0.1, timeout=10, codec: Optional[Codec] = None, slot: Optional[int] = None, transport: Optional[Transport] = None) -> Optional[ResponseStream]:
+        r = None
         is_arrived = False
         total_delay = 0
         while is_arrived or (total_delay < timeout):
-            r = self._get_response_arrived_as_record(stream_id)
+            r = await self._get_response_arrived_as_record(stream_id, codec, slot, transport)
             if r:
                 is_arrived = True
                 break
@@ -208,33 +968,69 @@ class DynamicBatcher:
             total_delay += delay
         return r
 
-    def _get_request_accepted(self, stream_id: bytes) -> Optional[bytes]:
-        messages: List = self._redis_client.xpending_range(
-            self._request_key,
-            groupname=self._processor_group,
-            count=1,
-            min=stream_id,
-            max=stream_id,
-        )
-        if messages:
-            message = PendingRequestStream(**messages[0])
-            pending_time = (message.time_since_delivered - message.times_delivered) / 1000
-            return message.message_id
+    async def _get_response_listener(self, transport: Optional[Transport] = None) -> _ResponseListener:
+        # A listener per route: IDs of different routes may be the same.
+        response_key = (transport or self.transport).response_key
+        listeners = _RESPONSE_LISTENERS.setdefault(asyncio.get_running_loop(), {})
+        listener = listeners.get(response_key)
+        if listener is None or not listener.is_alive:
+            listener = _ResponseListener(self._async_redis_client, response_key)
+            await listener.start()
+            listeners[response_key] = listener
+        return listener
+
+    async def _wait_for_notification(self, listener: _ResponseListener, stream_id: bytes, timeout=10, codec: Optional[Codec] = None, slot: Optional[int] = None, transport: Optional[Transport] = None) -> Optional[ResponseStream]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        future = listener.register(stream_id)
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(future),
+                        timeout=min(self.push_fallback_interval, remaining),
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                # Notified before the check, but without a response: failed.
+                is_notified = future.done()
+                r = await self._get_response_arrived_as_record(stream_id, codec, slot, transport)
+                if r or is_notified:
+                    return r
+        finally:
+            listener.discard(stream_id)
+
+    async def _get_request_accepted(self, stream_id: bytes, transport: Optional[Transport] = None) -> Optional[bytes]:
+        if await (transport or self.transport).is_accepted(stream_id):
+            return stream_id
         else:
             return
 
-    def _get_response_arrived_as_record(self, stream_id: bytes) -> Optional[ResponseStream]:
-        message: Optional[str] = self._redis_client.get(stream_id)
+    async def _get_response_arrived_as_record(self, stream_id: bytes, codec: Optional[Codec] = None, slot: Optional[int] = None, transport: Optional[Transport] = None) -> Optional[ResponseStream]:
+        message = await (transport or self.transport).pop_response(stream_id)
+        return self._as_response(stream_id, message, codec, slot)
+
+    def _as_response(self, stream_id: str, message: Optional[bytes], codec: Optional[Codec] = None, slot: Optional[int] = None) -> Optional[ResponseStream]:
+        # A response is encoded by the codec of its request.
+        codec = codec or self.codec
+        if message and slot is not None:
+            # In the slot with its size, or in Redis if it is larger than the slot.
+            if message[:1] == _SHM_IN_SLOT:
+                message = shm_engine.get_ring().read(slot, int(message[1:]))
+            else:
+                message = message[1:]
         if message:
-            _body = json.loads(message)
-            self._redis_client.delete(stream_id)
+            _body = codec.decode(message)
             return ResponseStream(stream_id, _body)
         else:
             return
 
-    def _get_response_arrived_as_stream(self, stream_id: bytes) -> Optional[ResponseStream]:
-        message: Optional[Dict] = self._redis_client.get(stream_id)
-        messages: List = self._redis_client.xrange(
+    async def _get_response_arrived_as_stream(self, stream_id: bytes) -> Optional[ResponseStream]:
+        redis_client = self._async_redis_client
+        messages: List = await redis_client.xrange(
             self._response_key,
             min=stream_id,
             max=stream_id,
@@ -242,13 +1038,39 @@ class DynamicBatcher:
         if messages:
             message = messages[0]
             _id, _body = message
-            self._redis_client.xack(self._response_key, self._batcher_group, _id)
-            self._redis_client.xdel(self._response_key, _id)
+            await redis_client.xack(self._response_key, self._batcher_group, _id)
+            await redis_client.xdel(self._response_key, _id)
             return ResponseStream(_id, _body)
         else:
             return
 
 
+@functools.lru_cache(maxsize=None)
+def get_batcher(**kwargs) -> DynamicBatcher:
+    r"""Get a `DynamicBatcher` cached per process, with the same arguments.
+
+    Create it once at startup, then every call on the hot path is free.
+
+    Args:
+        \**kwargs: Arguments of `DynamicBatcher`, which should be hashable.
+
+    Example:
+        >>> from fastapi import FastAPI, Depends
+        >>> from dynamic_batcher import DynamicBatcher, get_batcher
+        >>> app = FastAPI()
+        >>> def get_dynamic_batcher() -> DynamicBatcher:
+        ...     return get_batcher(timeout=100)
+        >>> @app.on_event("startup")
+        ... async def setup_batcher():
+        ...     get_dynamic_batcher()
+        >>> @app.post("/items")
+        ... async def infer_item(body: Dict, batcher: DynamicBatcher = Depends(get_dynamic_batcher)):
+        ...     return await batcher.asend(body)
+
+    """
+    return DynamicBatcher(**kwargs)
+
+
 class BatchProcessor:
     """A Client class for dynamic batch processing.
     A `BatchProcessor` tries to connect a redis server with connection info., given by the following ``ENVVAR``:
@@ -274,21 +1096,177 @@ class BatchProcessor:
                 values passed > ENVVAR > default value
         
 
-        batch_time (int):
-            Seconds of deadline to wait for requests. Defaults to ``2``.
+        batch_time (float):
+            Seconds of deadline to wait for requests, like ``0.01`` for 10ms. Defaults to ``2``.
+            The deadline counts from when the oldest request of the batch was sent, on a monotonic clock.
             If `timeout` is too large, it will be stuck on waiting too long, which is not intended.
             If `timeout` is too small, it will work as impatient, not waiting for the batch process is finished.
+
+        consumer_name (str):
+            Consumer name in the processor group. Optional.
+            Defaults to a unique name made of hostname, pid and a random suffix,
+            so that several replicas on one stream share the requests without conflicts.
+
+        executor (str):
+            Where to run a batch: ``thread`` or ``process``. Optional.
+            If ``DYNAMIC_BATCHER__EXECUTOR`` is set, the argument default value is overrided.
+            If it is not given, a batch runs on the event loop, and the next batch is gathered after it is finished.
+            If it is given, a batch runs on the executor(pipelined) while the event loop keeps gathering the next batch.
+            On ``process``, `func` should be picklable, like a module-level function.
+
+        pipeline_depth (int):
+            Number of batches running at once, on the executor or as coroutines. Defaults to ``1``.
+            If ``DYNAMIC_BATCHER__PIPELINE_DEPTH`` is set, the argument default value is overrided.
+            Ignored if `executor` is not given and `func` is not a coroutine function.
+
+        target_latency (float):
+            Seconds of p99 latency to keep. Optional.
+            If ``DYNAMIC_BATCHER__TARGET_LATENCY`` is set, the argument default value is overrided.
+            If it is given, an `AdaptiveBatchController` retunes the batch size and the batch time on every batch,
+            to maximize throughput within the latency. `batch_size` and `batch_time` become their upper bounds.
+
+        codec (:obj: ``str`` or ``Codec``):
+            Codec for requests not recording their codec(sent by an old `DynamicBatcher`). Defaults to ``json``.
+            If ``DYNAMIC_BATCHER__CODEC`` is set, the argument default value is overrided.
+            Other requests are decoded by their own codecs, each codec once for a batch, and responded with the same codec.
+            It should be one of `accepted_codecs`.
+
+        accepted_codecs (:obj: ``Tuple[str]``):
+            Names of codecs to decode requests with. Defaults to ``("json", "msgpack", "numpy")``.
+            If ``DYNAMIC_BATCHER__ACCEPTED_CODECS`` is set(comma-separated), the argument default value is overrided.
+            A request of another codec is responded with ``None``, without being decoded.
+            ``pickle`` runs any code of a request on decoding: accept it only if every writer of Redis is trusted.
+            A registered codec(:func:`~dynamic_batcher.codecs.register_codec`) should be accepted as well.
+
+        columnar (bool):
+            Whether to give `func` a batch in columns, ``Dict[str, List]`` of each field across the batch,
+            instead of ``List[Dict]``. Defaults to ``False``.
+            If ``DYNAMIC_BATCHER__COLUMNAR`` is set, the argument default value is overrided.
+            Then `func` should return columns as well, a ``Dict`` of each field to a ``List``(or an array) in the batch order.
+
+        engine (str):
+            Where requests are queued: ``redis`` or ``memory``. Defaults to ``redis``.
+            If ``DYNAMIC_BATCHER__ENGINE`` is set, the argument default value is overrided.
+            On ``memory``, it takes requests of `DynamicBatcher` of ``memory`` on the same event loop, without Redis.
+
+        transport (str):
+            How requests and responses travel through Redis: ``stream`` or ``list``. Defaults to ``stream``.
+            If ``DYNAMIC_BATCHER__TRANSPORT`` is set, the argument default value is overrided.
+            It should be the same as of `DynamicBatcher`. On ``list``, stale requests are not reclaimed.
+
+        route (str):
+            Route(a model) to take requests of, with its own queue like ``request:resnet``. Optional.
+            If ``DYNAMIC_BATCHER__ROUTE`` is set, the argument default value is overrided.
+            Without a route, it takes requests of the default queue.
+            Use :func:`start_daemons` to serve several routes in one process, each with its own batch policy.
+
+        bucket_by (:obj: ``str`` or ``Callable``):
+            Size of a request, to batch requests of similar sizes together(like sequence lengths, to pad less). Optional.
+            A field name of the body, or a callable taking the body. A value not a number counts by its ``len()``.
+            If ``DYNAMIC_BATCHER__BUCKET_BY`` is set(a field name), the argument default value is overrided.
+            Then each batch is of a single bucket, and each bucket is due `batch_time` after its oldest request,
+            so a small bucket still goes on time. Bodies are decoded once more, to find their sizes.
+
+        bucket_boundaries (:obj: ``List[int]``):
+            Ascending upper bounds of sizes of buckets, like ``[32, 64, 128, 256]``. Optional.
+            If ``DYNAMIC_BATCHER__BUCKET_BOUNDARIES`` is set(comma-separated), the argument default value is overrided.
+            Sizes over the last one are in the last bucket. Defaults to powers of 2, if `bucket_by` is given.
     
     Attributes:
-        delay (int):
-            Seconds of frequency to parse a request.
-        
         batch_size (int):
             Number of requests for a batch.
         
-        batch_time (int):
+        batch_time (float):
             Seconds of deadline to wait for requests.
 
+        consumer_name (str):
+            Consumer name in the processor group.
+
+        reclaim_idle_sec (int):
+            Seconds a delivered request stays unfinished before it is regarded as stale(its consumer is dead),
+            then reclaimed by another `BatchProcessor`. Defaults to ``60``.
+            It should be longer than the time a batch takes.
+
+        reclaim_interval_sec (int):
+            Seconds of frequency to reclaim stale requests. Defaults to ``10``.
+
+        response_expiration_sec (int):
+            Upper bound of seconds to keep a response not taken. Defaults to ``600``.
+            A request with a deadline keeps its response until `response_grace_sec` after it, as no one waits for it after.
+
+        response_grace_sec (int):
+            Seconds to keep a response after the deadline of its request, for clocks of hosts not in sync. Defaults to ``1``.
+
+        housekeeping_interval_sec (int):
+            Seconds of frequency to housekeep Redis, on a task of its own, off the batches. Defaults to ``10``.
+            It trims requests acknowledged(never the ones not read yet), purges stale requests, and removes idle consumers.
+            Shared memory of clients gone is detached as well.
+
+        stale_request_sec (int):
+            Seconds after a request was sent, to purge it if still unfinished(failing on every `BatchProcessor`),
+            and after a consumer was active, to remove it without unfinished requests(a dead `BatchProcessor`). Defaults to ``600``.
+            It should be longer than `reclaim_idle_sec`, and the timeout of `DynamicBatcher`.
+
+        shed_count (int):
+            Number of requests dropped without running, since their deadlines(given by `DynamicBatcher`) had passed.
+
+        executor (str):
+            Where to run a batch: ``thread``, ``process`` or ``None``(on the event loop).
+
+        pipeline_depth (int):
+            Number of batches running at once, on the executor or as coroutines.
+
+        controller (AdaptiveBatchController):
+            A controller retuning the batch size and the batch time, if `target_latency` is given.
+
+        codec (Codec):
+            Codec for requests not recording their codec.
+
+        accepted_codecs (:obj: ``Tuple[str]``):
+            Names of codecs to decode requests with.
+
+        columnar (bool):
+            Whether `func` handles a batch in columns.
+
+        engine (str):
+            Where requests are queued: ``redis`` or ``memory``.
+
+        transport (Transport):
+            How requests and responses travel through Redis, on `route`.
+
+        route (str):
+            Route(a model) to take requests of.
+
+        bucket_by (:obj: ``str`` or ``Callable``):
+            Size of a request, to batch requests of similar sizes together.
+
+        bucket_boundaries (:obj: ``List[int]``):
+            Ascending upper bounds of sizes of buckets.
+
+        max_block_ms (int):
+            Upper bound of milliseconds for a single blocking read.
+            A batch waits for `batch_time` over several reads if `batch_time` is longer than this.
+
+        read_backoff_sec (float):
+            Seconds to wait after a read failed, like Redis not available. Defaults to ``0.1``.
+            It doubles on every failure in a row, up to `max_block_ms`.
+
+        high_priority_batch_time (float):
+            Seconds a batch waits at most, after a ``high`` request in it was sent. Defaults to ``0``,
+            which dispatches the batch as soon as a ``high`` request is read, with the requests read along.
+
+        starvation_sec (int):
+            Seconds a request of any priority waits at most, before it goes ahead of the higher lanes. Defaults to ``5``.
+            It should be shorter than `reclaim_idle_sec`.
+
+    Note:
+        Requests are read in bulk, as many as the batch needs, blocking until the batch time is over.
+        Under load a single read fills a batch, and an idle `BatchProcessor` just waits on Redis.
+
+        A batch is filled from the higher priority lanes first(``high``, ``normal``, then ``low``).
+        Requests of lower lanes read over the batch are kept for the next batch, and another read on every batch
+        lets higher ones overtake them.
+
     Example:
         Create a `processor`:
             >>> import asyncio
@@ -296,6 +1274,17 @@ class BatchProcessor:
             >>> processor = BatchProcessor()
             >>> asyncio.run(batch_processor.start_daemon(lambda x: x))
 
+        Or, batch requests of a FastAPI app in the same process, without Redis:
+            >>> app = FastAPI()
+            >>> batcher = DynamicBatcher(engine="memory")
+            >>> processor = BatchProcessor(engine="memory", executor="thread")
+            >>> @app.on_event("startup")
+            ... async def start_batch_processor():
+            ...     asyncio.create_task(processor.start_daemon(sum_values))
+
+        Or, batch sequences of similar lengths together, to pad less:
+            >>> processor = BatchProcessor(bucket_by="input_ids", bucket_boundaries=[32, 64, 128, 256, 512])
+
     Raises:
         redis.exceptions.ConnectionError: a redis server is not available.
     """
@@ -303,26 +1292,94 @@ class BatchProcessor:
     def __init__(
             self,
             batch_size: int = DYNAMIC_BATCHER__BATCH_SIZE or 64,
-            batch_time: int = DYNAMIC_BATCHER__BATCH_TIME or 2,
+            batch_time: float = DYNAMIC_BATCHER__BATCH_TIME or 2,
+            consumer_name: Optional[str] = None,
+            executor: Optional[str] = DYNAMIC_BATCHER__EXECUTOR,
+            pipeline_depth: int = DYNAMIC_BATCHER__PIPELINE_DEPTH,
+            target_latency: Optional[float] = DYNAMIC_BATCHER__TARGET_LATENCY,
+            codec: Union[str, Codec] = DYNAMIC_BATCHER__CODEC,
+            accepted_codecs: Tuple[str, ...] = DYNAMIC_BATCHER__ACCEPTED_CODECS,
+            columnar: bool = DYNAMIC_BATCHER__COLUMNAR,
+            engine: str = DYNAMIC_BATCHER__ENGINE,
+            transport: str = DYNAMIC_BATCHER__TRANSPORT,
+            route: Optional[str] = DYNAMIC_BATCHER__ROUTE,
+            bucket_by: Optional[Union[str, Callable[[Any], int]]] = DYNAMIC_BATCHER__BUCKET_BY,
+            bucket_boundaries: Optional[List[int]] = DYNAMIC_BATCHER__BUCKET_BOUNDARIES,
         ):
 
         self.log = logging.getLogger(logger.LOGGERNAME_BATCHPROCESSOR)
         self.log.info("LOG_LEVEL: %s", logging.getLevelName(self.log.level))
-        self.delay = 0.001
+        if executor is not None and executor not in EXECUTORS:
+            raise ValueError(f"'executor' should be one of {EXECUTORS}: {executor}")
+        if pipeline_depth < 1:
+            raise ValueError(f"'pipeline_depth' should be a positive integer: {pipeline_depth}")
+        if engine not in ENGINES:
+            raise ValueError(f"'engine' should be one of {ENGINES}: {engine}")
+        if bucket_boundaries and list(bucket_boundaries) != sorted(set(bucket_boundaries)):
+            raise ValueError(f"'bucket_boundaries' should be ascending: {bucket_boundaries}")
+
         self.batch_size = batch_size
         self.batch_time = batch_time
-        self._redis_client = get_client(
-            host=REDIS__HOST,
-            port=REDIS__PORT,
-            db=REDIS__DB,
-            password=REDIS__PASSWORD,
-        )
+        self.executor = executor
+        self.pipeline_depth = pipeline_depth
+        self.codec = get_codec(codec)
+        self.accepted_codecs = tuple(accepted_codecs)
+        if self.codec.name not in self.accepted_codecs:
+            raise ValueError(f"'codec' should be one of 'accepted_codecs' {self.accepted_codecs}: {self.codec.name}")
+        self.columnar = columnar
+        self.controller: Optional[AdaptiveBatchController] = None
+        if target_latency:
+            self.controller = AdaptiveBatchController(
+                target_latency=target_latency,
+                max_batch_size=batch_size,
+                max_batch_time=batch_time,
+            )
+        self.engine = engine
+        self.route = route
+        self.bucket_by = bucket_by
+        self.bucket_boundaries = list(bucket_boundaries) if bucket_boundaries else None
+        self.transport = get_transport(transport, route=route)
+        self._redis_client = None
+        if engine == "redis":
+            self._redis_client = get_client(
+                host=REDIS__HOST,
+                port=REDIS__PORT,
+                db=REDIS__DB,
+                password=REDIS__PASSWORD,
+            )
         self._request_key = REDIS__STREAM_KEY_REQUEST
         self._response_key = REDIS__STREAM_KEY_RESPONSE
         self._processor_group = REDIS__STREAM_GROUP_PROCESSOR
         self._batcher_group = REDIS__STREAM_GROUP_BATCHER
+        self.consumer_name = consumer_name or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
 
         self.response_expiration_sec = 600
+        self.response_grace_sec = 1
+        self.max_block_ms = 1000
+        self.read_backoff_sec = 0.1
+        self._read_backoff = None
+        self.reclaim_idle_sec = 60
+        self.reclaim_interval_sec = 10
+        self.housekeeping_interval_sec = 10
+        self.stale_request_sec = 600
+        self.high_priority_batch_time = 0.0
+        self.starvation_sec = 5
+        self._reclaimed: List = []
+        self._backlog: List = []
+        self._reclaimed_at = None
+        self._reclaim_cursor = "0-0"
+        self._arrivals_observed_at = None
+        self.shed_count = 0
+
+    @property
+    def _async_redis_client(self) -> redis.asyncio.Redis:
+        return get_async_client(
+            host=REDIS__HOST,
+            port=REDIS__PORT,
+            db=REDIS__DB,
+            password=REDIS__PASSWORD,
+        )
+
     async def start_daemon(self, func: Callable) -> None:
         """Start a single batch process as a daemon.
         This will concatenate given requests to one batch, call `func`, and split into corresponding responses.
@@ -331,7 +1388,20 @@ class BatchProcessor:
             func (:obj: `Callable`): A callable object, like function or method.
                 `func` should have only one positional argument, and its type should be ``List``; to handle the argument as a scalable batch.
                 The type of the argument and the returning value should be ``List``, to handle a scalable batch and operate elementwisely.
-                Also both argument and returning value should be **JSON (de)serializable**.
+                Also both argument and returning value should be **(de)serializable** by the codec of requests(JSON, by default).
+
+                `func` can be a coroutine function(``async def``), which is awaited on the event loop.
+                Up to `pipeline_depth` batches run concurrently, while the next batch is gathered.
+                `func` can be a generator function(or an async one) as well, yielding a ``List`` of the batch per step.
+                Then the response of each request is a ``List`` of its results over the steps,
+                and a request of `DynamicBatcher.astream` gets its result of each step right after the step.
+                On a ``process`` executor, the steps of a generator come at once after the last one.
+
+                Requests of ``numpy.ndarray`` are run apart, as a stacked array(or a ``Dict`` of them) per batch.
+                Then `func` should return an array(or a ``Dict`` of them) whose first dimension is the batch size.
+
+                On `columnar`, `func` gets ``Dict[str, List]``, each field across the batch,
+                and should return a ``Dict`` of each field to a ``List``(or an array) of the batch.
 
         Returns:
             None
@@ -362,115 +1432,678 @@ class BatchProcessor:
                 >>> from dynamic_batcher import BatchProcessor
                 >>> batch_processor = BatchProcessor()
                 >>> asyncio.run(batch_processor.start_daemon(sum_values))
+
+            Or, await an I/O-bound batch, 4 batches at once:
+
+                >>> import httpx
+                >>> async def sum_values_remotely(bodies: List[Dict]) -> List[Dict]:
+                ...     async with httpx.AsyncClient() as client:
+                ...         response = await client.post('http://model-server/sum', json=bodies)
+                ...     return response.json()
+                >>> batch_processor = BatchProcessor(pipeline_depth=4)
+                >>> asyncio.run(batch_processor.start_daemon(sum_values_remotely))
+
+            Or, vectorize over columns:
+
+                >>> import numpy as np
+                >>> def sum_values_in_columns(columns: Dict[str, List]) -> Dict[str, List]:
+                ...     return {'sum': np.sum(columns['values'], axis=1)}
+                >>> sum_values_in_columns({'values': [[1, 2, 3], [4, 5, 6]]})
+                {'sum': array([ 6, 15])}
+                >>> batch_processor = BatchProcessor(columnar=True)
+                >>> asyncio.run(batch_processor.start_daemon(sum_values_in_columns))
             
             
         """
         self.log.info(
             'BatchProcessor start: ' +
             ', '.join([
-                f'delay={self.delay}',
                 f'batch_size={self.batch_size}',
                 f'batch_time={self.batch_time}',
+                f'consumer_name={self.consumer_name}',
+                f'executor={self.executor}',
+                f'pipeline_depth={self.pipeline_depth}',
+                f'target_latency={self.controller.target_latency if self.controller else None}',
+                f'accepted_codecs={",".join(self.accepted_codecs)}',
+                f'columnar={self.columnar}',
+                f'engine={self.engine}',
+                f'transport={self.transport.name}',
+                f'route={self.route}',
+                f'bucket_by={getattr(self.bucket_by, "__name__", self.bucket_by)}',
             ])
         )
-        while True:
-            await self._run(func)
-            await self._trim()
+        housekeeping = None
+        if self.engine == "redis":
+            await self.transport.prepare()
+            housekeeping = asyncio.create_task(self._housekeep())
+        is_async = is_coroutine_callable(func) or is_async_generator_callable(func)
+        try:
+            if self.executor is None and not is_async:
+                while True:
+                    await self._reclaim_stale_requests()
+                    await self._run(func)
+            else:
+                await self._start_pipeline(func)
+        finally:
+            if housekeeping is not None:
+                housekeeping.cancel()
+
+    async def _start_pipeline(self, func: Callable) -> None:
+        # Gathers the next batch while `pipeline_depth` batches are running on the executor, or as coroutines.
+        if is_coroutine_callable(func) or is_async_generator_callable(func):
+            executor = None
+        elif self.executor == "process":
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.pipeline_depth)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.pipeline_depth)
+        slots = asyncio.Semaphore(self.pipeline_depth)
+        running = set()
 
+        def _on_finished(task: asyncio.Task) -> None:
+            running.discard(task)
+            slots.release()
+
+        try:
+            while True:
+                await self._reclaim_stale_requests()
+                requests = await self._gather()
+                if not requests:
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(self._process(func, requests, executor=executor))
+                running.add(task)
+                task.add_done_callback(_on_finished)
+        finally:
+            for task in running:
+                task.cancel()
+            if executor is not None:
+                executor.shutdown(wait=False)
 
     async def _run(self, func: Callable) -> None:
-        delay_period = 0
-        batch_gathered = 0
-        requests = []
-        while delay_period < self.batch_time and batch_gathered < self.batch_size:
-            # self.log.debug(
-            #     f'alive: {delay_period:.3f}/{self.batch_time}, {batch_gathered}/{self.batch_size}'
-            # )
-            new_request = await self._get_next_request()
-            if new_request:
-                requests.extend(new_request)
-
-            batch_gathered = len(requests)
-            delay_period += self.delay
-
-            await asyncio.sleep(self.delay)
+        requests = await self._gather()
+        if requests:
+            await self._process(func, requests)
+
+    async def _gather(self) -> List:
+        # A batch is due `batch_time` after the oldest request in it was sent(not after gathering started),
+        # or `high_priority_batch_time` after the oldest ``high`` one, on the monotonic clock of the event loop.
+        # Without any request, it waits for the first one.
+        # With `bucket_by`, a batch is of a single bucket, due on its own requests: the first bucket full or due goes.
+        loop = asyncio.get_running_loop()
+        batch_size, batch_time = await self._get_batch_policy()
+        started_at = loop.time()
+        deadline = None
+        requests = self._reclaimed[:batch_size] + self._backlog
+        del self._reclaimed[:batch_size]
+        self._backlog = []
+        arrived = 0
+        # Reads at least once, for requests of higher lanes than the ones kept.
+        is_first_read = True
+        while True:
+            buckets = self._group_by_bucket(requests)
+            largest_bucket_size = max((len(bucket) for bucket in buckets.values()), default=0)
+            if requests:
+                due = loop.time() + min(self._get_remaining_time(bucket, batch_time) for bucket in buckets.values())
+                deadline = due if deadline is None else min(deadline, due)
+            if deadline is None:
+                block_ms = self.max_block_ms
+            else:
+                block_ms = int((deadline - loop.time()) * 1000)
+            if not is_first_read and (largest_bucket_size >= batch_size or block_ms <= 0):
+                break
+            if largest_bucket_size >= batch_size:
+                # Full already, with the requests kept: just peeks at higher lanes.
+                block_ms = 1
+            is_first_read = False
+            # `block=0` means forever on Redis, so blocks at least 1ms.
+            new_requests = await self._get_next_request(
+                count=max(1, batch_size - largest_bucket_size),
+                block=max(1, min(block_ms, self.max_block_ms)),
+            )
+            if new_requests:
+                arrived += len(new_requests)
+                requests.extend(await self._shed_expired_requests(new_requests))
+            elif not requests:
+                break
+        requests, self._backlog = self._pick_batch(requests, batch_size, batch_time)
+
+        if self.controller is not None:
+            now = loop.time()
+            self.controller.observe_arrivals(arrived, now - (self._arrivals_observed_at or started_at))
+            self._arrivals_observed_at = now
 
         if requests:
             self.log.debug(
-                f'batch start: {delay_period:.3f}/{self.batch_time}, {batch_gathered}/{self.batch_size}'
+                f'batch start: {self._get_waited_time(requests):.3f}/{batch_time:.3f}, {len(requests)}/{batch_size}'
+                + (f', bucket {requests[0][1].get("_bucket")}' if self.bucket_by is not None else '')
+                + (f', {len(self._backlog)} kept' if self._backlog else '')
             )
-            streams = [v[0] for i, v in requests]
-            streams = sorted(streams, key=lambda x: x[0])
-            stream_ids = [i for i, v in streams]
-            stream_bodies = [json.loads(v['body']) for i, v in streams]
-
+        return requests
+
+    def _pick_batch(self, requests: List, batch_size: int, batch_time: float) -> Tuple[List, List]:
+        # Takes the most urgent bucket, of the ones full or due. Returns the batch and the rest to keep.
+        buckets = list(self._group_by_bucket(requests).values())
+        if not buckets:
+            return [], []
+
+        def _urgency(bucket: List) -> Tuple[bool, float]:
+            remaining_time = self._get_remaining_time(bucket, batch_time)
+            return (len(bucket) < batch_size and remaining_time > 0, remaining_time)
+
+        bucket = min(buckets, key=_urgency)
+        batch, rest = self._prioritize(bucket, batch_size)
+        return batch, rest + [request for other in buckets if other is not bucket for request in other]
+
+    def _group_by_bucket(self, requests: List) -> Dict[Any, List]:
+        if self.bucket_by is None:
+            return {None: requests} if requests else {}
+        buckets: Dict[Any, List] = {}
+        for stream_id, fields in requests:
+            if '_bucket' not in fields:
+                fields['_bucket'] = self._find_bucket(stream_id, fields)
+            buckets.setdefault(fields['_bucket'], []).append((stream_id, fields))
+        return buckets
+
+    def _find_bucket(self, stream_id: str, fields: Dict) -> Optional[int]:
+        # The index of the first boundary not under the size, or of powers of 2 without boundaries.
+        # A body failed to find its size is in the bucket `None`, to be found while decoding.
+        try:
+            self._read_shared_memory([(stream_id, fields)])
+            body = self._get_codec(fields).decode(fields['body'])
+            size = self.bucket_by(body) if callable(self.bucket_by) else body[self.bucket_by]
+            if not isinstance(size, (int, float)):
+                size = len(size)
+        except Exception as e:
+            self.log.debug(f'Error while finding the bucket of message {stream_id}: {e}')
+            return None
+        if self.bucket_boundaries:
+            return bisect.bisect_left(self.bucket_boundaries, size)
+        return (math.ceil(size) - 1).bit_length() if size > 1 else 0
+
+    def _get_remaining_time(self, requests: List, batch_time: float) -> float:
+        remaining_time = batch_time - self._get_waited_time(requests, batch_time)
+        high_requests = [(i, v) for i, v in requests if v.get('priority') == PRIORITIES[0]]
+        if high_requests:
+            remaining_time = min(
+                remaining_time,
+                self.high_priority_batch_time - self._get_waited_time(high_requests, self.high_priority_batch_time),
+            )
+        return remaining_time
+
+    def _prioritize(self, requests: List, batch_size: int) -> Tuple[List, List]:
+        # Takes requests starving first(the oldest first), then of the higher lanes. Returns the batch and the rest.
+        now = time.time()
+
+        def _rank(request: Tuple[str, Dict]) -> Tuple:
+            stream_id, fields = request
+            sent_at = int(stream_id.split('-', 1)[0]) / 1000
+            if now - sent_at >= self.starvation_sec:
+                return (0, sent_at)
+            return (1, _PRIORITY_RANKS.get(fields.get('priority'), _PRIORITY_RANKS[DEFAULT_PRIORITY]), sent_at)
+
+        requests = sorted(requests, key=_rank)
+        return requests[:batch_size], requests[batch_size:]
+
+    async def _shed_expired_requests(self, requests: List) -> List:
+        # Callers of expired requests have given up: ack and delete them without running.
+        now = time.time()
+        alive, expired_ids = [], []
+        for stream_id, fields in requests:
+            deadline = fields.get('deadline')
+            if deadline is not None and float(deadline) < now:
+                expired_ids.append(stream_id)
+            else:
+                alive.append((stream_id, fields))
+        if expired_ids:
+            self.shed_count += len(expired_ids)
+            self.log.debug(f'Shed expired requests: {len(expired_ids)} (total {self.shed_count})')
+            if self.engine == "memory":
+                return alive
             try:
-                results = func(stream_bodies)
+                await self.transport.drop(expired_ids)
             except Exception as e:
-                self.log.error(f'Error while running `{func.__name__}`: {e}')
-                results = None
+                self.log.error(f'Error while shedding message {e}')
+        return alive
+
+    @staticmethod
+    def _get_waited_time(requests: List, max_waited_time: Optional[float] = None) -> float:
+        # A stream ID is `<milliseconds>-<sequence>`, stamped by Redis when the request is sent.
+        # Clamped, for the clock of Redis may differ from this host.
+        sent_at = min(int(stream_id.split('-', 1)[0]) for stream_id, _ in requests) / 1000
+        waited_time = max(0.0, time.time() - sent_at)
+        if max_waited_time is not None:
+            waited_time = min(waited_time, max_waited_time)
+        return waited_time
+
+    async def _get_batch_policy(self) -> Tuple[int, float]:
+        if self.controller is None:
+            return self.batch_size, self.batch_time
+        if self.engine == "memory":
+            self.controller.observe_queue_depth(memory_engine.get_broker(self.route).qsize())
+            return self.controller.update()
+        try:
+            self.controller.observe_queue_depth(await self.transport.queue_depth())
+        except Exception as e:
+            self.log.error(f'Error while reading queue depth {e}')
+        return self.controller.update()
 
-            await self._mark_as_finished_as_record(stream_ids, results)
+    async def _process(
+            self,
+            func: Callable,
+            requests: List,
+            executor: Optional[concurrent.futures.Executor] = None,
+        ) -> None:
+        # Requests may have been expired, waiting for a pipeline slot.
+        requests = await self._shed_expired_requests(requests)
+        if not requests:
+            return
+        streams = sorted(requests, key=lambda x: x[0])
+        stream_ids = [i for i, v in streams]
+        reply_channels = [v.get('reply_to') for i, v in streams]
+        self._read_shared_memory(streams)
+        codecs, batches = self._decode_batches(streams)
+
+        # Requests failed to decode are responded with `None`.
+        results: List = [None for _ in streams]
+        is_generator = is_async_generator_callable(func) or is_generator_callable(func)
+        for indices, batch, split_batch in batches:
+            on_step = None
+            if is_generator and any(streams[index][1].get('stream') for index in indices):
+                on_step = functools.partial(
+                    self._push_chunks,
+                    [streams[index] for index in indices],
+                    [codecs[index] for index in indices],
+                )
+            batch_results = await self._execute(func, batch, len(indices), split_batch, executor, on_step=on_step)
+            if batch_results is not None:
+                for index, result in zip(indices, batch_results):
+                    results[index] = result
 
+        try:
+            await self._mark_as_finished_as_record(stream_ids, results, reply_channels, codecs, [v for i, v in streams])
+        except Exception as e:
+            self.log.error(f'Error while finishing message {e}')
+        if any(v.get('stream') for i, v in streams):
+            # A generator has pushed its partial results already. Other `func` pushes its whole result as one.
+            await self._push_chunks(streams, codecs, None if is_generator else results, is_last=True)
 
-    async def _mark_as_finished_as_record(self, stream_ids: List[str], results: Optional[List[Dict]]) -> None:
-        for stream_id, stream_body in zip(stream_ids, results):
-            self._redis_client.set(
-                stream_id,
-                json.dumps(stream_body),
-                ex=self.response_expiration_sec,
-            )
+    async def _execute(
+            self,
+            func: Callable,
+            batch: Any,
+            batch_size: int,
+            split_batch: Callable[[Any], List],
+            executor: Optional[concurrent.futures.Executor] = None,
+            on_step: Optional[Callable[[List], Awaitable[None]]] = None,
+        ) -> Optional[List]:
+        # Runs `func` on a batch, and splits its results into each request.
+        # A generator gives results of each step to `on_step`, and ones over the steps to each request.
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        try:
+            if is_coroutine_callable(func):
+                results = split_batch(await func(batch))
+            elif is_async_generator_callable(func) or is_generator_callable(func):
+                results = [[] for _ in range(batch_size)]
+                async for step_results in self._iterate_steps(func, batch, executor):
+                    step_results = split_batch(step_results)
+                    for request_results, step_result in zip(results, step_results):
+                        request_results.append(step_result)
+                    if on_step is not None:
+                        await on_step(step_results)
+            elif executor is None:
+                results = split_batch(func(batch))
+            else:
+                results = split_batch(await loop.run_in_executor(executor, func, batch))
+        except Exception as e:
+            self.log.error(f'Error while running `{func.__name__}`: {e}')
+            results = None
+        if self.controller is not None:
+            self.controller.observe_execution(batch_size, loop.time() - started_at)
+        return results
+
+    @staticmethod
+    async def _iterate_steps(func: Callable, batch: Any, executor: Optional[concurrent.futures.Executor] = None) -> AsyncIterator[Any]:
+        # A generator is stepped on the executor(if any), not to block the event loop.
+        # A generator cannot be sent to another process: it runs to the end there.
+        if is_async_generator_callable(func):
+            async for step_results in func(batch):
+                yield step_results
+            return
+        loop = asyncio.get_running_loop()
+        if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+            for step_results in await loop.run_in_executor(executor, _collect_steps, func, batch):
+                yield step_results
+            return
+        steps = func(batch)
+        while True:
+            if executor is None:
+                step_results = next(steps, _END_OF_STEPS)
+            else:
+                step_results = await loop.run_in_executor(executor, next, steps, _END_OF_STEPS)
+            if step_results is _END_OF_STEPS:
+                return
+            yield step_results
 
-        self._redis_client.xdel(self._request_key, *stream_ids)
+    async def _push_chunks(
+            self,
+            streams: List,
+            codecs: List[Optional[Codec]],
+            results: Optional[List],
+            is_last: bool = False,
+        ) -> None:
+        # Partial results of streaming requests(`DynamicBatcher.astream`), and the end of them if `is_last`.
+        # Without `results`, only the end is pushed. A result failed to encode ends its stream.
+        request_ids, chunks, request_fields = [], [], []
+        for index, (stream_id, fields) in enumerate(streams):
+            if not fields.get('stream'):
+                continue
+            request_fields.append(fields)
+            request_chunks = []
+            if results is not None and codecs[index] is not None:
+                if self.engine == "memory":
+                    request_chunks.append(results[index])
+                else:
+                    try:
+                        data = codecs[index].encode(results[index])
+                        request_chunks.append(_CHUNK + (data.encode() if isinstance(data, str) else data))
+                    except Exception as e:
+                        self.log.error(f'Error while encoding a partial result of message {stream_id}: {e}')
+                        is_last = True
+            if is_last:
+                request_chunks.append(memory_engine.END_OF_STREAM if self.engine == "memory" else _CHUNK_END)
+            request_ids.append(stream_id)
+            chunks.append(request_chunks)
+
+        if self.engine == "memory":
+            broker = memory_engine.get_broker(self.route)
+            for request_id, request_chunks in zip(request_ids, chunks):
+                for chunk in request_chunks:
+                    broker.push_chunk(request_id, chunk)
+            return
+        try:
+            await self.transport.push_chunks(
+                request_ids,
+                chunks,
+                self._get_expirations(request_fields),
+                reply_keys=[fields['stream'] for fields in request_fields],
+            )
+        except Exception as e:
+            self.log.error(f'Error while pushing partial results {e}')
+
+    def _decode_batches(self, streams: List) -> Tuple[List[Optional[Codec]], List[Tuple[List[int], Any, Callable]]]:
+        # Decodes the bodies of each codec at once.
+        # Returns codecs of requests(`None` if unknown), and batches to run as `(indices, batch, split_batch)`.
+        # Bodies decoded into ``List`` are run together, and each stacking codec is run apart.
+        codecs: List[Optional[Codec]] = [None for _ in streams]
+        indices_by_codec: Dict[str, List[int]] = {}
+        for index, (_, fields) in enumerate(streams):
+            indices_by_codec.setdefault(fields.get('codec') or self.codec.name, []).append(index)
+
+        batches = []
+        list_indices, list_bodies = [], []
+        for codec_name, indices in indices_by_codec.items():
+            try:
+                codec = self._get_codec({'codec': codec_name})
+            except (ValueError, ImportError) as e:
+                self.log.error(f'Error while decoding message {e}: {len(indices)} requests')
+                continue
+            for index in indices:
+                codecs[index] = codec
+            if not codec.stacks_batch:
+                indices, batch = self._decode_batch(codec, streams, indices)
+                list_indices.extend(indices)
+                list_bodies.extend(batch or [])
+                continue
+            for indices in self._group_by_stack_key(codec, streams, indices):
+                indices, batch = self._decode_batch(codec, streams, indices)
+                if indices:
+                    batches.append((indices, batch, codec.split_batch))
+        if list_indices:
+            if not self.columnar:
+                batches.insert(0, (list_indices, list_bodies, list))
+            else:
+                try:
+                    batches.insert(0, (list_indices, _to_columns(list_bodies), _from_columns))
+                except Exception as e:
+                    self.log.error(f'Error while building columns: {e}')
+        return codecs, batches
+
+    def _get_codec(self, fields: Dict) -> Codec:
+        # Only accepted codecs decode a request: any client able to write to Redis chooses the codec.
+        # A request in the same process(``memory`` engine) carries the codec itself.
+        codec_name = fields.get('codec') or self.codec.name
+        if isinstance(codec_name, Codec):
+            return codec_name
+        if codec_name not in self.accepted_codecs:
+            raise ValueError(f"Codec not accepted: {codec_name}. Accepted: {self.accepted_codecs}")
+        return self.codec if codec_name == self.codec.name else get_codec(codec_name)
+
+    @staticmethod
+    def _group_by_stack_key(codec: Codec, streams: List, indices: List[int]) -> List[List[int]]:
+        # Broken bodies are grouped together, to be found while decoding.
+        groups: Dict[Any, List[int]] = {}
+        for index in indices:
+            try:
+                key = codec.stack_key(streams[index][1]['body'])
+            except Exception:
+                key = None
+            groups.setdefault(key, []).append(index)
+        return list(groups.values())
+
+    def _decode_batch(self, codec: Codec, streams: List, indices: List[int]) -> Tuple[List[int], Any]:
+        # Returns indices decoded, and their batch.
+        datas = [streams[index][1]['body'] for index in indices]
+        try:
+            batch = codec.decode_batch(datas)
+            # A batch not of a result per request would respond to the others: it is decoded one by one.
+            if codec.stacks_batch or len(batch) == len(datas):
+                return indices, batch
+            self.log.error(f'Error while decoding messages as a batch: {len(batch)} bodies of {len(datas)} requests')
+        except Exception:
+            pass
+
+        # Finds which ones are broken.
+        decoded_indices = []
+        for index, data in zip(indices, datas):
+            try:
+                codec.decode(data)
+                decoded_indices.append(index)
+            except Exception as e:
+                self.log.error(f'Error while decoding message {streams[index][0]}: {e}')
+        if not decoded_indices:
+            return [], None
+        try:
+            batch = codec.decode_batch([streams[index][1]['body'] for index in decoded_indices])
+        except Exception as e:
+            self.log.error(f'Error while decoding messages as a batch: {e}')
+            return [], None
+        if not codec.stacks_batch and len(batch) != len(decoded_indices):
+            self.log.error(f'Error while decoding messages as a batch: {len(batch)} bodies of {len(decoded_indices)} requests')
+            return [], None
+        return decoded_indices, batch
+
+    def _read_shared_memory(self, streams: List) -> None:
+        # Bodies in shared memory of clients on the same host. A client gone leaves its body empty, failed to decode.
+        for stream_id, fields in streams:
+            if 'shm' not in fields or 'body' in fields:
+                continue
+            try:
+                shm = shm_engine.attach(fields['shm'])
+                fields['body'] = shm_engine.read_slot(shm, int(fields['shm_offset']), int(fields['shm_size']))
+            except Exception as e:
+                self.log.error(f'Error while reading message {stream_id} in shared memory: {e}')
+                shm_engine.detach(fields['shm'])
+                fields['body'] = b''
+
+    def _encode_response(self, fields: Dict, data: Union[bytes, str]) -> Union[bytes, str]:
+        # A response to a request in shared memory is written back to its slot, if it fits in time.
+        # Otherwise, or the client has given up(the slot can be reused), it goes through Redis.
+        if 'shm' not in fields:
+            return data
+        if isinstance(data, str):
+            data = data.encode()
+        if len(data) <= int(fields['shm_capacity']) and time.time() < float(fields.get('deadline') or 'inf'):
+            try:
+                shm = shm_engine.attach(fields['shm'])
+                size = shm_engine.write_slot(shm, int(fields['shm_offset']), int(fields['shm_capacity']), data)
+                return _SHM_IN_SLOT + str(size).encode()
+            except Exception as e:
+                self.log.error(f'Error while writing response in shared memory: {e}')
+                shm_engine.detach(fields['shm'])
+        return _SHM_IN_REDIS + data
 
+    async def _mark_as_finished_as_record(
+            self,
+            stream_ids: List[str],
+            results: Optional[List[Dict]],
+            reply_channels: Optional[List[Optional[str]]] = None,
+            codecs: Optional[List[Optional[Codec]]] = None,
+            fields: Optional[List[Dict]] = None,
+        ) -> None:
+        # Results, acks, deletion and notifications of a batch are sent in a single round trip.
+        # A result is encoded by the codec of its request. Without a known codec, it cannot be responded.
+        if results is None:
+            results = [None for i in stream_ids]
+        if codecs is None:
+            codecs = [self.codec for i in stream_ids]
+        if fields is None:
+            fields = [{} for i in stream_ids]
+        if self.engine == "memory":
+            broker = memory_engine.get_broker(self.route)
+            for stream_id, stream_body in zip(stream_ids, results):
+                broker.resolve(stream_id, stream_body)
+            return
+        responses = []
+        for stream_id, stream_body, codec, stream_fields in zip(stream_ids, results, codecs, fields):
+            # One result failed to encode fails its own request only: the batch is finished anyway.
+            try:
+                response = None if codec is None else self._encode_response(stream_fields, codec.encode(stream_body))
+            except Exception as e:
+                self.log.error(f'Error while encoding a result of message {stream_id}: {e}')
+                response = None
+            responses.append(response)
+        await self.transport.finish(stream_ids, responses, self._get_expirations(fields), reply_channels)
 
     async def _mark_as_finished_as_stream(self, stream_ids: List[str], results: Optional[List[Dict]]) -> None:
         if results is None:
             results = [None for i in stream_ids]
-        for stream_id, stream_body in zip(stream_ids, results):
-            self._redis_client.xadd(
-                self._response_key,
-                stream_body,
-                stream_id,
-            )
-        # self._redis_client.xack(self.request_key, self.processor_group, *stream_ids)
-        self._redis_client.xdel(self._request_key, *stream_ids)
-
-
-    async def _get_next_request(self) -> Optional[List]:
+        async with self._async_redis_client.pipeline(transaction=True) as pipe:
+            for stream_id, stream_body in zip(stream_ids, results):
+                pipe.xadd(
+                    self._response_key,
+                    stream_body,
+                    stream_id,
+                )
+            pipe.xack(self._request_key, self._processor_group, *stream_ids)
+            pipe.xdel(self._request_key, *stream_ids)
+            await pipe.execute()
+
+
+    async def _get_next_request(self, count: int = 1, block: Optional[int] = None) -> Optional[List]:
+        if self.engine == "memory":
+            return await memory_engine.get_broker(self.route).get(count=count, block=block)
 
         try:
-            requests: List = self._redis_client.xreadgroup(
-                groupname=self._processor_group,
-                consumername=self._processor_group,
-                streams={self._request_key: '>'},
-                count=1,
-                # block=self.batch_time,
-                noack=False,
-            )
-            if requests:
-                return requests
-            else:
-                return
-
+            requests = await self.transport.read(self.consumer_name, count=count, block=block)
         except Exception as e:
             self.log.error(f'Error while reading message {e}')
+            await self._back_off_reading(e)
+            return
+        self._read_backoff = None
+        if requests:
+            return requests
+        else:
+            return
 
-    async def _trim(self) -> None:
+    async def _back_off_reading(self, error: Exception) -> None:
+        # Not to spin on a failing read: waits longer on every failure in a row.
+        if isinstance(error, redis.ResponseError) and str(error).startswith('NOGROUP'):
+            # The stream or its group is gone, like flushed: creates it again.
+            try:
+                await self.transport.prepare(force=True)
+            except Exception as e:
+                self.log.error(f'Error while preparing {e}')
+        backoff = self.read_backoff_sec if self._read_backoff is None else self._read_backoff * 2
+        self._read_backoff = min(backoff, self.max_block_ms / 1000)
+        await asyncio.sleep(self._read_backoff)
+
+    async def _reclaim_stale_requests(self) -> None:
+        # Take over requests delivered to a dead consumer, which never have been finished.
+        # A batch at most per call: keeps going on the next batch until the scan wraps around,
+        # then waits for `reclaim_interval_sec`.
+        loop = asyncio.get_running_loop()
+        if self._reclaimed or self.engine == "memory" or not self.transport.redeliverable:
+            return
+        if self._reclaim_cursor == "0-0":
+            if self._reclaimed_at is not None and loop.time() - self._reclaimed_at < self.reclaim_interval_sec:
+                return
+            self._reclaimed_at = loop.time()
         try:
-            remaining_msg_cnt = self.batch_size * 10
-            request_trimmed_cnt: int = self._redis_client.xtrim(
-                self._request_key,
-                maxlen=remaining_msg_cnt,
+            self._reclaim_cursor, messages = await self.transport.reclaim(
+                self.consumer_name,
+                min_idle_ms=self.reclaim_idle_sec * 1000,
+                start_id=self._reclaim_cursor,
+                count=self.batch_size,
             )
-            self.log.debug(f'Trimmed old requests: {request_trimmed_cnt}')
+            if messages:
+                self.log.info(f'Reclaimed stale requests: {len(messages)}')
+                self._reclaimed.extend(messages)
+        except Exception as e:
+            self._reclaim_cursor = "0-0"
+            self.log.error(f'Error while reclaiming message {e}')
 
-            response_trimmed_cnt: int = self._redis_client.xtrim(
-                self._response_key,
-                maxlen=remaining_msg_cnt,
-            )
-            self.log.debug(f'Trimmed old responses: {response_trimmed_cnt}')
+    async def _housekeep(self) -> None:
+        # Runs on its own schedule, off the batches: see `Transport.housekeep`.
+        while True:
+            try:
+                detached = shm_engine.prune()
+                if detached:
+                    self.log.info(f'Detached shared memory of clients gone: {len(detached)}')
+                trimmed, purged, removed = await self.transport.housekeep(
+                    self.consumer_name,
+                    stale_ms=self.stale_request_sec * 1000,
+                    expiration_ms=self.response_expiration_sec * 1000,
+                )
+                if purged or removed:
+                    self.log.info(f'Purged stale requests: {purged}, removed idle consumers: {removed}')
+                self.log.debug(f'Trimmed acknowledged requests: {trimmed}')
+            except Exception as e:
+                self.log.error(f'Error while housekeeping {e}')
+            await asyncio.sleep(self.housekeeping_interval_sec)
 
-        except Exception as e:
-            self.log.error(f'Error while trimming message {e}'
-            )
\ No newline at end of file
+    def _get_expirations(self, fields: List[Dict]) -> List[int]:
+        # A response is kept until the deadline of its request(with a grace), as no one waits for it after.
+        now = time.time()
+        expirations = []
+        for request_fields in fields:
+            seconds = self.response_expiration_sec
+            deadline = request_fields.get('deadline')
+            if deadline:
+                seconds = min(seconds, max(1, math.ceil(float(deadline) - now + self.response_grace_sec)))
+            expirations.append(seconds)
+        return expirations
+
+
+async def start_daemons(daemons: List[Tuple[BatchProcessor, Callable]]) -> None:
+    """Start `BatchProcessor`s of several routes(models) in one process, on the same event loop.
+
+    Each route gathers its own batches with its own batch policy(`batch_size`, `batch_time`, ...),
+    and a batch of any route is run as soon as it is due, so small models do not need their own processes.
+    Batches run on the event loop take turns in the order they are due. Ones on an executor, or coroutines, run along.
+
+    Args:
+        daemons (:obj: ``List[Tuple[BatchProcessor, Callable]]``):
+            Pairs of a `BatchProcessor` of a route, and the callable to run its batches.
+
+    Example:
+        >>> asyncio.run(start_daemons([
+        ...     (BatchProcessor(route="resnet", batch_size=32, batch_time=0.01), resnet_predict),
+        ...     (BatchProcessor(route="bert", batch_size=8, batch_time=0.05, executor="thread"), bert_predict),
+        ... ]))
+
+    """
+    routes = [processor.route for processor, _ in daemons]
+    if len(set(routes)) != len(routes):
+        raise ValueError(f"Routes should be unique: {routes}")
+    await asyncio.gather(*[processor.start_daemon(func) for processor, func in daemons])
@@ -0,0 +1,242 @@
+"""
+====================================
+ :mod:`cache` Module
+====================================
+.. moduleauthor:: Youngju Jaden Kim <pydemia@gmail.com>
+.. note:: Info
+
+Info
+====
+    `ResponseCache`, responses of `DynamicBatcher` cached by their requests.
+
+    - A bounded LRU in the process, and optionally a shared one on Redis with a TTL.
+    - Concurrent identical requests are coalesced into a single request to `BatchProcessor`.
+
+"""
+
+
+from typing import Any, Optional, Dict, Tuple, Callable, Awaitable, NamedTuple, Union
+from collections import OrderedDict
+import json
+import asyncio
+import hashlib
+import logging
+import weakref
+import redis
+import redis.asyncio
+from autologging import logged
+from .codecs import Codec, NumpyCodec, get_codec
+from .redis_engine import (
+    REDIS__HOST,
+    REDIS__PORT,
+    REDIS__DB,
+    REDIS__PASSWORD,
+    REDIS__CACHE_KEY,
+    get_async_client,
+    route_key,
+)
+
+
+__all__ = [
+    "CacheInfo",
+    "ResponseCache",
+]
+
+
+class CacheInfo(NamedTuple):
+    """Counters of a `ResponseCache`, like ``functools.lru_cache``.
+
+    Attributes:
+        hits (int): Requests responded from the cache, on the process or on Redis.
+        shared_hits (int): Requests responded from the cache on Redis, of `hits`.
+        misses (int): Requests sent to `BatchProcessor`.
+        coalesced (int): Requests waiting for an identical request in flight, instead of being sent.
+        size (int): Number of responses in the process.
+        maxsize (int): Upper bound of `size`.
+    """
+    hits: int
+    shared_hits: int
+    misses: int
+    coalesced: int
+    size: int
+    maxsize: int
+
+
+@logged
+class ResponseCache:
+    """A cache of responses, keyed by a hash of the canonical request body and its route.
+
+    A body is canonical as JSON with sorted keys, so the order of keys does not matter.
+    A body not JSON-serializable(like an array) is hashed as encoded by `codec`.
+    Responses are kept encoded, and decoded for each request: a response modified by a caller does not change the cache.
+
+    Args:
+        maxsize (int):
+            Number of responses to keep in the process, the least recently used ones are evicted. Defaults to ``1024``.
+
+        ttl (float):
+            Seconds to keep responses on Redis, shared by other processes. Defaults to ``0``(not shared).
+
+        codec (:obj: ``str`` or ``Codec``):
+            Codec to encode responses(and bodies not JSON-serializable). Defaults to ``json``.
+
+    Example:
+        >>> cache = ResponseCache(maxsize=1024, ttl=60)
+        >>> key = cache.make_key({'a': 1}, route="resnet")
+        >>> await cache.aget(key, lambda: batcher.asend({'a': 1}), timeout=10)
+        {'a': 2}
+        >>> cache.info()
+        CacheInfo(hits=0, shared_hits=0, misses=1, coalesced=0, size=1, maxsize=1024)
+
+    Note:
+        Only deterministic responses should be cached: the same request is responded the same until evicted.
+        A failed request(``None``) is not cached.
+
+    """
+    def __init__(
+            self,
+            maxsize: int = 1024,
+            ttl: float = 0,
+            codec: Union[str, Codec] = "json",
+        ):
+        self.log = self.__log or logging.getLogger(self.__class__.__qualname__)
+
+        if maxsize < 0 or ttl < 0:
+            raise ValueError(f"'maxsize' and 'ttl' should not be negative: {maxsize}, {ttl}")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.codec = get_codec(codec)
+        self._responses: OrderedDict = OrderedDict()
+        # Requests in flight are tasks, bound to their event loop.
+        self._in_flight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Task]]" = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.shared_hits, self.misses, self.coalesced, len(self._responses), self.maxsize)
+
+    def clear(self) -> None:
+        """Clear the responses in the process, and the counters. The ones on Redis expire by themselves."""
+        self._responses.clear()
+        self.hits = self.shared_hits = self.misses = self.coalesced = 0
+
+    def _get_codec(self, obj: Any) -> Codec:
+        # JSON cannot encode arrays: they are encoded as raw buffers.
+        if self.codec.name == "json" and NumpyCodec.is_tensor(obj):
+            return get_codec(NumpyCodec.name)
+        return self.codec
+
+    def make_key(self, body: Any, route: Optional[str] = None) -> Optional[str]:
+        """Key of a request, like ``cache:resnet:<hash>``. ``None`` if the body cannot be hashed."""
+        try:
+            canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        except (TypeError, ValueError):
+            try:
+                canonical = self._get_codec(body).encode(body)
+            except Exception:
+                return None
+        if isinstance(canonical, str):
+            canonical = canonical.encode()
+        elif not isinstance(canonical, (bytes, bytearray)):
+            return None
+        return f"{route_key(REDIS__CACHE_KEY, route)}:{hashlib.blake2b(canonical, digest_size=16).hexdigest()}"
+
+    def _encode(self, response: Any) -> Optional[bytes]:
+        # The codec name comes first, to decode it on other processes.
+        codec = self._get_codec(response)
+        try:
+            data = codec.encode(response)
+        except Exception:
+            return None
+        return f"{codec.name}:".encode() + (data.encode() if isinstance(data, str) else bytes(data))
+
+    @staticmethod
+    def _decode(data: bytes) -> Any:
+        codec_name, _, encoded = data.partition(b":")
+        return get_codec(codec_name.decode()).decode(encoded)
+
+    def _keep(self, key: str, data: bytes) -> None:
+        if not self.maxsize:
+            return
+        self._responses[key] = data
+        self._responses.move_to_end(key)
+        while len(self._responses) > self.maxsize:
+            self._responses.popitem(last=False)
+
+    async def aget(
+            self,
+            key: str,
+            send: Callable[[], Awaitable[Any]],
+            timeout: Optional[float] = None,
+        ) -> Any:
+        """Get the response of a request from the cache, or by `send` on a miss.
+
+        An identical request in flight is waited for, instead of another `send`.
+
+        Args:
+            key (str): Key of the request, by `make_key`.
+            send (Callable): Coroutine function to send the request, returning its response.
+            timeout (float): Seconds to wait for the response. Optional.
+
+        Returns:
+            The response, or ``None`` if failed or timed out.
+        """
+        data = self._responses.get(key)
+        if data is not None:
+            self._responses.move_to_end(key)
+            self.hits += 1
+            return self._decode(data)
+
+        in_flight = self._in_flight.setdefault(asyncio.get_running_loop(), {})
+        task = in_flight.get(key)
+        if task is None:
+            task = in_flight[key] = asyncio.create_task(self._fetch(key, send))
+            task.add_done_callback(lambda _: in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        try:
+            # Shielded: a caller given up does not cancel the request of the others.
+            data, response = await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            self.log.error(f"failed to respond (timeout): {key}")
+            return
+        return response if data is None else self._decode(data)
+
+    async def _fetch(self, key: str, send: Callable[[], Awaitable[Any]]) -> Tuple[Optional[bytes], Any]:
+        # Returns the response encoded(to be decoded for each caller), or as it is if it cannot be encoded.
+        redis_client = None
+        if self.ttl:
+            redis_client = get_async_client(
+                host=REDIS__HOST,
+                port=REDIS__PORT,
+                db=REDIS__DB,
+                password=REDIS__PASSWORD,
+                decode_responses=False,
+            )
+            try:
+                data = await redis_client.get(key)
+            except redis.RedisError as e:
+                self.log.error(f'Error while getting a cached response: {e}')
+                data = None
+            if data is not None:
+                self.hits += 1
+                self.shared_hits += 1
+                self._keep(key, data)
+                return data, None
+
+        self.misses += 1
+        response = await send()
+        if response is None:
+            return None, None
+        data = self._encode(response)
+        if data is None:
+            return None, response
+        self._keep(key, data)
+        if redis_client is not None:
+            try:
+                await redis_client.set(key, data, px=int(self.ttl * 1000))
+            except redis.RedisError as e:
+                self.log.error(f'Error while caching a response: {e}')
+        return data, None
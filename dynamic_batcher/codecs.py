@@ -0,0 +1,296 @@
+"""
+====================================
+ :mod:`codecs` Module
+====================================
+.. moduleauthor:: Youngju Jaden Kim <pydemia@gmail.com>
+.. note:: Info
+
+Info
+====
+    Codecs to (de)serialize request and response bodies between `DynamicBatcher` and `BatchProcessor`.
+    The codec name of a request is recorded in its stream entry, so both sides agree on it.
+
+    - ``json`` (default): JSON, human readable.
+    - ``msgpack``: MessagePack binary. It requires ``msgpack`` (``pip install dynamic-batcher[msgpack]``).
+    - ``pickle``: pickle protocol 5. Any Python object, but decoding it can run any code.
+      `BatchProcessor` does not accept it unless it is in ``accepted_codecs``.
+    - ``numpy``: raw buffers of ``numpy.ndarray`` with dtype/shape headers, stacked into one array for a batch.
+      It requires ``numpy`` (``pip install dynamic-batcher[numpy]``).
+
+"""
+
+
+from typing import Any, List, Dict, Tuple, Type, Union
+import sys
+import json
+import math
+import pickle
+import struct
+
+
+__all__ = [
+    "Codec",
+    "JSONCodec",
+    "MsgpackCodec",
+    "PickleCodec",
+    "NumpyCodec",
+    "register_codec",
+    "get_codec",
+]
+
+
+class Codec:
+    """Base class of codecs. A subclass should have a unique `name`, and implement `encode` and `decode`.
+
+    `decode_batch` decodes all bodies of a batch at once, into the argument of `func`; a ``List`` by default.
+    Override it if the format can do it in one call. It should raise if a body is not exactly one object,
+    then the bodies are decoded one by one to find the broken ones.
+
+    A codec with `stacks_batch` decodes its bodies into one object, like a stacked array, instead of a ``List``.
+    Its requests are run apart from the others, and `split_batch` splits the result of `func` into each request.
+    Requests of the same `stack_key` are stacked together.
+
+    Example:
+        Define and register a custom codec:
+            >>> import json
+            >>> import zlib
+            >>> from dynamic_batcher.codecs import Codec, register_codec
+            >>> class CompressedJSONCodec(Codec):
+            ...     name = "json+zlib"
+            ...     def encode(self, obj):
+            ...         return zlib.compress(json.dumps(obj).encode())
+            ...     def decode(self, data):
+            ...         return json.loads(zlib.decompress(data))
+            >>> register_codec(CompressedJSONCodec())
+            >>> batcher = DynamicBatcher(codec="json+zlib")
+            >>> # On `BatchProcessor`, registered as well:
+            >>> processor = BatchProcessor(accepted_codecs=("json", "json+zlib"))
+
+    """
+    name: str = None
+    stacks_batch: bool = False
+
+    def encode(self, obj: Any) -> Union[bytes, str]:
+        raise NotImplementedError
+
+    def decode(self, data: Union[bytes, str]) -> Any:
+        raise NotImplementedError
+
+    def decode_batch(self, datas: List[Union[bytes, str]]) -> Any:
+        return [self.decode(data) for data in datas]
+
+    def split_batch(self, results: Any) -> List:
+        return list(results)
+
+    def stack_key(self, data: Union[bytes, str]) -> Any:
+        return None
+
+
+def _as_bytes(data: Union[bytes, str]) -> bytes:
+    return data.encode() if isinstance(data, str) else data
+
+
+class JSONCodec(Codec):
+    name = "json"
+
+    def encode(self, obj: Any) -> str:
+        return json.dumps(obj)
+
+    _decoder = json.JSONDecoder()
+
+    def decode(self, data: Union[bytes, str]) -> Any:
+        # Bodies are in UTF-8, as encoded: not detected per body, as `json.loads` does.
+        return self._decoder.decode(data if isinstance(data, str) else bytes(data).decode())
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError as e:
+            raise ImportError(
+                "'msgpack' codec requires msgpack: pip install dynamic-batcher[msgpack]"
+            ) from e
+        self._msgpack = msgpack
+
+    def encode(self, obj: Any) -> bytes:
+        return self._msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data: Union[bytes, str]) -> Any:
+        return self._msgpack.unpackb(_as_bytes(data), raw=False)
+
+    def decode_batch(self, datas: List[Union[bytes, str]]) -> List:
+        # Unpacks the bodies joined in one buffer, checking each body ends where the next one starts.
+        # Bodies under an array header are not checked: a body of two objects would shift the others.
+        buffer = b"".join(_as_bytes(data) for data in datas)
+        unpacker = self._msgpack.Unpacker(raw=False, max_buffer_size=max(len(buffer), 1))
+        unpacker.feed(buffer)
+        results, end = [], 0
+        for data in datas:
+            end += len(data)
+            results.append(unpacker.unpack())
+            if unpacker.tell() != end:
+                raise ValueError(f"A body is not a single MessagePack object: {bytes(data[:64])!r}")
+        return results
+
+
+class PickleCodec(Codec):
+    name = "pickle"
+    protocol = 5
+
+    def encode(self, obj: Any) -> bytes:
+        return pickle.dumps(obj, protocol=self.protocol)
+
+    def decode(self, data: Union[bytes, str]) -> Any:
+        return pickle.loads(_as_bytes(data))
+
+
+class NumpyCodec(Codec):
+    """Raw buffers of a ``numpy.ndarray``, or a ``Dict`` of them, with dtype/shape headers.
+
+    Bodies of a batch are stacked into one array per field(with one copy each).
+    Bodies of different dtypes or shapes are stacked and run apart.
+    `func` gets the stacked array(or a ``Dict`` of them), and should return an array(or a ``Dict`` of them)
+    whose first dimension is the batch size. It is split into views of each request, not through Python lists.
+
+    Decoded arrays are read-only views of the received buffer.
+
+    Example:
+        >>> import numpy as np
+        >>> def double(batch: np.ndarray) -> np.ndarray:
+        ...     return batch * 2
+        >>> asyncio.run(batch_processor.start_daemon(double))
+        >>> # On clients, arrays are sent as raw buffers:
+        >>> await batcher.asend(np.ones((3, 224, 224), dtype=np.float32))
+
+    """
+    name = "numpy"
+    stacks_batch = True
+    _header_size = struct.Struct("<I")
+
+    def __init__(self):
+        try:
+            import numpy
+        except ImportError as e:
+            raise ImportError(
+                "'numpy' codec requires numpy: pip install dynamic-batcher[numpy]"
+            ) from e
+        self._numpy = numpy
+
+    @staticmethod
+    def is_tensor(obj: Any) -> bool:
+        """Whether `obj` is a ``numpy.ndarray``, or a ``Dict`` of them."""
+        # Without numpy imported, `obj` cannot be an array.
+        numpy = sys.modules.get("numpy")
+        if numpy is None:
+            return False
+        if isinstance(obj, numpy.ndarray):
+            return True
+        return isinstance(obj, dict) and bool(obj) and all(isinstance(v, numpy.ndarray) for v in obj.values())
+
+    def encode(self, obj: Any) -> bytes:
+        if obj is None:
+            fields = None
+        elif isinstance(obj, dict):
+            fields = {key: self._numpy.asarray(value, order="C") for key, value in obj.items()}
+        else:
+            fields = {None: self._numpy.asarray(obj, order="C")}
+        arrays = list(fields.values()) if fields is not None else []
+        for array in arrays:
+            if array.dtype.hasobject:
+                raise ValueError(f"Cannot encode an array of objects: {array.dtype}")
+
+        header = json.dumps({
+            "arrays": None if fields is None else [
+                [key, array.dtype.str, list(array.shape)] for key, array in fields.items()
+            ],
+        }).encode()
+        return b"".join([
+            self._header_size.pack(len(header)),
+            header,
+            *[memoryview(array.reshape(-1)).cast("B") for array in arrays],
+        ])
+
+    def stack_key(self, data: bytes) -> bytes:
+        # The encoded header: field names, dtypes and shapes.
+        return bytes(data[:self._header_size.size + self._header_size.unpack_from(data)[0]])
+
+    def _read_header(self, data: bytes) -> Tuple[Any, int]:
+        (size,) = self._header_size.unpack_from(data)
+        offset = self._header_size.size + size
+        return json.loads(bytes(data[self._header_size.size:offset]))["arrays"], offset
+
+    def _read_array(self, data: bytes, dtype: str, shape: List[int], offset: int) -> Tuple[Any, int]:
+        dtype = self._numpy.dtype(dtype)
+        count = math.prod(shape)
+        array = self._numpy.frombuffer(data, dtype=dtype, count=count, offset=offset).reshape(tuple(shape))
+        return array, offset + count * dtype.itemsize
+
+    @staticmethod
+    def _as_body(fields: Dict) -> Any:
+        return fields[None] if list(fields) == [None] else fields
+
+    def decode(self, data: bytes) -> Any:
+        layout, offset = self._read_header(data)
+        if layout is None:
+            return None
+        fields = {}
+        for key, dtype, shape in layout:
+            fields[key], offset = self._read_array(data, dtype, shape, offset)
+        return self._as_body(fields)
+
+    def decode_batch(self, datas: List[bytes]) -> Any:
+        headers = [self._read_header(data) for data in datas]
+        layout = headers[0][0]
+        if layout is None or any(other_layout != layout for other_layout, _ in headers):
+            raise ValueError("Arrays of a batch should share dtypes and shapes, to be stacked")
+
+        offsets = [offset for _, offset in headers]
+        fields = {}
+        for key, dtype, shape in layout:
+            stacked = self._numpy.empty((len(datas), *shape), dtype=dtype)
+            for index, data in enumerate(datas):
+                stacked[index], offsets[index] = self._read_array(data, dtype, shape, offsets[index])
+            fields[key] = stacked
+        return self._as_body(fields)
+
+    def split_batch(self, results: Any) -> List:
+        # Iterating an array yields views along the first dimension.
+        if isinstance(results, dict):
+            size = len(next(iter(results.values()))) if results else 0
+            return [{key: value[index] for key, value in results.items()} for index in range(size)]
+        return list(results)
+
+
+_BUILTIN_CODECS: Dict[str, Type[Codec]] = {
+    JSONCodec.name: JSONCodec,
+    MsgpackCodec.name: MsgpackCodec,
+    PickleCodec.name: PickleCodec,
+    NumpyCodec.name: NumpyCodec,
+}
+_CODECS: Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec) -> None:
+    """Register a codec by its name, to be chosen by `DynamicBatcher` and found by `BatchProcessor`."""
+    if not codec.name:
+        raise ValueError(f"Codec should have a name: {codec}")
+    _CODECS[codec.name] = codec
+
+
+def get_codec(codec: Union[str, Codec]) -> Codec:
+    """Get a registered codec by its name. A built-in codec is created on the first use.
+
+    Raises:
+        ValueError: the codec is not registered.
+        ImportError: the codec requires a package not installed.
+    """
+    if isinstance(codec, Codec):
+        return codec
+    if codec not in _CODECS:
+        if codec not in _BUILTIN_CODECS:
+            raise ValueError(f"Unknown codec: {codec}. Available: {sorted({*_BUILTIN_CODECS, *_CODECS})}")
+        register_codec(_BUILTIN_CODECS[codec]())
+    return _CODECS[codec]
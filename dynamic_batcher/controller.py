@@ -0,0 +1,170 @@
+"""
+====================================
+ :mod:`controller` Module
+====================================
+.. moduleauthor:: Youngju Jaden Kim <pydemia@gmail.com>
+.. note:: Info
+
+Info
+====
+    `AdaptiveBatchController`, tuning a batch size and a batch time of `BatchProcessor` to a target latency.
+
+"""
+
+
+from typing import Tuple
+from collections import deque
+import math
+
+
+__all__ = [
+    "AdaptiveBatchController",
+]
+
+
+class AdaptiveBatchController:
+    """A controller to maximize throughput of `BatchProcessor`, keeping p99 latency under a target.
+
+    It observes the arrival rate of requests, the queue depth, and the execution time of each batch size,
+    then retunes the batch size and the batch time on every batch:
+
+        - The execution time is fitted to ``t(size) = a + b * size`` over the latest batches,
+          and its p99 is estimated with the spread of the residuals.
+        - The batch size is the largest one whose time to fill(from the queue and new arrivals)
+          and to execute fits in the target latency.
+        - The batch time is what remains of the target latency after the execution.
+
+    Args:
+        target_latency (float):
+            Seconds of p99 latency to keep, from a request being sent to its response.
+
+        max_batch_size (int):
+            Upper bound of the batch size.
+
+        max_batch_time (float):
+            Upper bound of seconds to wait for requests.
+
+        min_batch_time (float):
+            Lower bound of seconds to wait for requests. Defaults to ``0.001``.
+
+        headroom (float):
+            Ratio of `target_latency` to plan with, for the overheads not observed(Redis, network). Defaults to ``0.8``.
+
+        window (int):
+            Number of the latest batches to fit the execution time. Defaults to ``64``.
+
+    Attributes:
+        batch_size (int):
+            Batch size for the next batch.
+
+        batch_time (float):
+            Seconds to wait for requests, for the next batch.
+
+        arrival_rate (float):
+            Smoothed number of requests arrived per second.
+
+        queue_depth (int):
+            Number of requests waiting to be read, at the latest observation.
+
+    Example:
+        >>> controller = AdaptiveBatchController(target_latency=0.1, max_batch_size=64, max_batch_time=0.05)
+        >>> controller.observe_arrivals(count=100, elapsed=0.1)
+        >>> controller.observe_execution(batch_size=8, elapsed=0.01)
+        >>> controller.observe_execution(batch_size=32, elapsed=0.02)
+        >>> controller.update()
+        (13, 0.05)
+
+    """
+    smoothing = 0.2
+
+    def __init__(
+            self,
+            target_latency: float,
+            max_batch_size: int,
+            max_batch_time: float,
+            min_batch_time: float = 0.001,
+            headroom: float = 0.8,
+            window: int = 64,
+        ):
+        if target_latency <= 0:
+            raise ValueError(f"'target_latency' should be positive: {target_latency}")
+
+        self.target_latency = target_latency
+        self.max_batch_size = max_batch_size
+        self.max_batch_time = max_batch_time
+        self.min_batch_time = min(min_batch_time, max_batch_time)
+        self.headroom = headroom
+
+        self.arrival_rate = 0.0
+        self.queue_depth = 0
+        self._executions = deque(maxlen=window)
+
+        self.batch_size = max_batch_size
+        self.batch_time = min(max_batch_time, target_latency * headroom / 2)
+
+    def observe_arrivals(self, count: int, elapsed: float) -> None:
+        if elapsed <= 0:
+            return
+        rate = count / elapsed
+        self.arrival_rate += self.smoothing * (rate - self.arrival_rate)
+
+    def observe_queue_depth(self, depth: int) -> None:
+        self.queue_depth = max(0, depth)
+
+    def observe_execution(self, batch_size: int, elapsed: float) -> None:
+        self._executions.append((batch_size, elapsed))
+
+    def estimate_execution_time(self, batch_size: int) -> float:
+        """Estimated p99 of seconds to execute a batch of `batch_size`."""
+        if not self._executions:
+            return 0.0
+
+        sizes = [size for size, _ in self._executions]
+        times = [elapsed for _, elapsed in self._executions]
+        n = len(sizes)
+        mean_size = sum(sizes) / n
+        mean_time = sum(times) / n
+        var_size = sum((size - mean_size) ** 2 for size in sizes)
+        if var_size > 0:
+            slope = sum((size - mean_size) * (elapsed - mean_time) for size, elapsed in self._executions) / var_size
+            slope = max(0.0, slope)
+            intercept = max(0.0, mean_time - slope * mean_size)
+        else:
+            # A single size observed: assume it scales linearly beyond, conservatively.
+            slope = mean_time / mean_size if mean_size else 0.0
+            intercept = 0.0
+            if batch_size <= mean_size:
+                slope, intercept = 0.0, mean_time
+
+        residuals = [elapsed - (intercept + slope * size) for size, elapsed in self._executions]
+        spread = math.sqrt(sum(r ** 2 for r in residuals) / n)
+        return intercept + slope * batch_size + 2.33 * spread
+
+    def update(self) -> Tuple[int, float]:
+        """Retune the batch size and the batch time with the observations so far.
+
+        Returns:
+            Tuple[int, float]: the batch size and the batch time, for the next batch.
+        """
+        budget = self.target_latency * self.headroom
+
+        def _fits(batch_size: int) -> bool:
+            waiting = max(0, batch_size - self.queue_depth)
+            if waiting and self.arrival_rate <= 0:
+                return False
+            fill_time = waiting / self.arrival_rate if waiting else 0.0
+            return fill_time + self.estimate_execution_time(batch_size) <= budget
+
+        # Both filling and executing take longer as the batch grows: search the largest fitting size.
+        low, high = 1, self.max_batch_size
+        while low < high:
+            mid = (low + high + 1) // 2
+            if _fits(mid):
+                low = mid
+            else:
+                high = mid - 1
+        self.batch_size = low
+
+        batch_time = budget - self.estimate_execution_time(self.batch_size)
+        self.batch_time = min(self.max_batch_time, max(self.min_batch_time, batch_time))
+        return self.batch_size, self.batch_time
@@ -0,0 +1,155 @@
+"""
+====================================
+ :mod:`memory_engine` Module
+====================================
+.. moduleauthor:: Youngju Jaden Kim <pydemia@gmail.com>
+.. note:: Info
+
+Info
+====
+    An in-process broker between `DynamicBatcher` and `BatchProcessor`, on the same event loop, without Redis.
+
+    Requests are queued as they are(not serialized), with IDs like Redis stream IDs(``<milliseconds>-<sequence>``),
+    and their responses are set to ``asyncio.Future`` of the callers.
+    Partial results of a streaming request are put to its ``asyncio.Queue``, ended by `END_OF_STREAM`.
+
+"""
+
+
+from typing import Any, Optional, List, Dict, Tuple
+from collections import deque
+import time
+import asyncio
+import weakref
+from .codecs import Codec
+from .redis_engine import PRIORITIES, DEFAULT_PRIORITY
+
+
+__all__ = [
+    "END_OF_STREAM",
+    "MemoryBroker",
+    "get_broker",
+]
+
+
+class _PassThroughCodec(Codec):
+    # Bodies are given to `func` as they are.
+    name = "memory"
+
+    def encode(self, obj: Any) -> Any:
+        return obj
+
+    def decode(self, data: Any) -> Any:
+        return data
+
+
+PASS_THROUGH = _PassThroughCodec()
+
+# The last item of a stream of partial results.
+END_OF_STREAM = object()
+
+
+class MemoryBroker:
+    """A queue of requests, and futures of their responses, on an event loop.
+
+    Each priority has its own queue(a lane), and `get` takes requests from the higher lanes first.
+
+    Example:
+        >>> broker = get_broker()
+        >>> request_id, future = broker.put({'a': 1}, deadline=time.time() + 10)
+        >>> await broker.get(count=8, block=1000)
+        [('1700000000000-0', {'body': {'a': 1}, 'codec': ..., 'deadline': 1700000010.0, 'priority': 'normal'})]
+        >>> broker.resolve(request_id, {'a': 2})
+        >>> await future
+        {'a': 2}
+
+    """
+
+    def __init__(self):
+        self._lanes: Dict[str, deque] = {priority: deque() for priority in PRIORITIES}
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._chunks: Dict[str, asyncio.Queue] = {}
+        self._arrived = asyncio.Event()
+        self._last_ms = 0
+        self._sequence = 0
+        # Requests taken by `get` so far.
+        self.taken = 0
+
+    def _next_id(self) -> str:
+        ms = int(time.time() * 1000)
+        if ms <= self._last_ms:
+            ms = self._last_ms
+            self._sequence += 1
+        else:
+            self._last_ms, self._sequence = ms, 0
+        return f"{ms}-{self._sequence}"
+
+    def qsize(self) -> int:
+        return sum(len(requests) for requests in self._lanes.values())
+
+    def put(
+            self,
+            body: Any,
+            deadline: Optional[float] = None,
+            priority: str = DEFAULT_PRIORITY,
+            stream: bool = False,
+        ) -> Tuple[str, asyncio.Future]:
+        """Queue a request. With `stream`, its partial results are taken by `get_chunk` as well."""
+        request_id = self._next_id()
+        future = asyncio.get_running_loop().create_future()
+        self._futures[request_id] = future
+        fields = {"body": body, "codec": PASS_THROUGH, "deadline": deadline, "priority": priority}
+        if stream:
+            fields["stream"] = True
+            self._chunks[request_id] = asyncio.Queue()
+        self._lanes[priority].append((request_id, fields))
+        self._arrived.set()
+        return request_id, future
+
+    async def get(self, count: int = 1, block: Optional[int] = None) -> List[Tuple[str, Dict]]:
+        """Get up to `count` requests from the higher lanes first, waiting `block` milliseconds(forever if ``None``) for the first one."""
+        if not self.qsize():
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), None if block is None else block / 1000)
+            except asyncio.TimeoutError:
+                return []
+        requests = []
+        for lane in self._lanes.values():
+            while lane and len(requests) < count:
+                requests.append(lane.popleft())
+        self.taken += len(requests)
+        return requests
+
+    def resolve(self, request_id: str, result: Any) -> None:
+        future = self._futures.pop(request_id, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def push_chunk(self, request_id: str, chunk: Any) -> None:
+        queue = self._chunks.get(request_id)
+        if queue is not None:
+            queue.put_nowait(chunk)
+
+    def end_stream(self, request_id: str) -> None:
+        self.push_chunk(request_id, END_OF_STREAM)
+
+    async def get_chunk(self, request_id: str) -> Any:
+        """Wait for the next partial result of a streaming request, or `END_OF_STREAM`."""
+        return await self._chunks[request_id].get()
+
+    def discard(self, request_id: str) -> None:
+        self._futures.pop(request_id, None)
+        self._chunks.pop(request_id, None)
+
+
+_BROKERS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Optional[str], MemoryBroker]]" = weakref.WeakKeyDictionary()
+
+
+def get_broker(route: Optional[str] = None) -> MemoryBroker:
+    """Get the broker of a route(a model) on the running event loop, created on the first use."""
+    brokers = _BROKERS.setdefault(asyncio.get_running_loop(), {})
+    broker = brokers.get(route)
+    if broker is None:
+        broker = brokers[route] = MemoryBroker()
+    return broker
@@ -1,6 +1,14 @@
-from typing import Optional
+from typing import Optional, List, Dict, Tuple, Type, Union
 import os
+import json
+import time
+import uuid
+import struct
+import asyncio
+import weakref
+from collections import OrderedDict, deque
 import redis
+import redis.asyncio
 from autologging import logged
 
 
@@ -18,8 +26,24 @@ __all__ = [
     # "shutdown",
     # "restart",
     "info",
+    "REDIS__MAX_CONNECTIONS",
+    "setup",
     "get_client",
     "get_default_client",
+    "get_async_client",
+    "get_default_async_client",
+    "REDIS__LIST_KEY_REQUEST",
+    "REDIS__LIST_KEY_RESPONSE",
+    "REDIS__CACHE_KEY",
+    "route_key",
+    "PRIORITIES",
+    "DEFAULT_PRIORITY",
+    "lane_key",
+    "Transport",
+    "RedisStreamTransport",
+    "RedisListTransport",
+    "TRANSPORTS",
+    "get_transport",
 ]
 
 
@@ -33,6 +57,14 @@ REDIS__STREAM_GROUP_PROCESSOR = os.getenv("REDIS__STREAM_GROUP_PROCESSOR", "proc
 REDIS__STREAM_KEY_RESPONSE = os.getenv("REDIS__STREAM_KEY_RESPONSE", "response")
 REDIS__STREAM_GROUP_BATCHER = os.getenv("REDIS__STREAM_GROUP_BATCHER", "batcher")
 
+# Upper bound of connections of a pool: one pool per process(and per event loop, for asyncio).
+REDIS__MAX_CONNECTIONS = int(os.getenv("REDIS__MAX_CONNECTIONS", "128"))
+
+REDIS__LIST_KEY_REQUEST = os.getenv("REDIS__LIST_KEY_REQUEST", "request_list")
+REDIS__LIST_KEY_RESPONSE = os.getenv("REDIS__LIST_KEY_RESPONSE", "response_list")
+
+REDIS__CACHE_KEY = os.getenv("REDIS__CACHE_KEY", "cache")
+
 
 def info():
     return {
@@ -43,29 +75,33 @@ def info():
         "REDIS__STREAM_GROUP_PROCESSOR": REDIS__STREAM_GROUP_PROCESSOR,
         "REDIS__STREAM_KEY_RESPONSE": REDIS__STREAM_KEY_RESPONSE,
         "REDIS__STREAM_GROUP_BATCHER": REDIS__STREAM_GROUP_BATCHER,
+        "REDIS__LIST_KEY_REQUEST": REDIS__LIST_KEY_REQUEST,
+        "REDIS__LIST_KEY_RESPONSE": REDIS__LIST_KEY_RESPONSE,
+        "REDIS__CACHE_KEY": REDIS__CACHE_KEY,
     }
 
 
-@logged
-def get_client(
-        *args,
-        host: str = "localhost",
-        port: int = 6379,
-        db: int = 0,
-        password: Optional[str] = None,
-        # key: str = "infer",
-        # group: str = "infergrp",
-        **kwargs,
-    ) -> redis.Redis:
-    redis_client = redis.Redis(
-        *args,
-        host=host,
-        port=port,
-        db=db,
-        password=password,
-        decode_responses=True,
-        **kwargs,
-    )
+# Lanes of requests, from the highest priority.
+PRIORITIES = ("high", "normal", "low")
+DEFAULT_PRIORITY = "normal"
+
+
+def lane_key(key: str, priority: str = DEFAULT_PRIORITY) -> str:
+    """Key of a priority lane, like ``request@high``. The default lane(``normal``) uses the key as it is."""
+    return key if priority == DEFAULT_PRIORITY else f"{key}@{priority}"
+
+
+def route_key(key: str, route: Optional[str] = None) -> str:
+    """Key of a route(a model), like ``request:resnet``. The default route(``None``) uses the key as it is."""
+    return key if route is None else f"{key}:{route}"
+
+
+def setup(redis_client: redis.Redis) -> None:
+    """Check the connection, and create streams and groups if not exist.
+
+    Raises:
+        ConnectionError: a redis server is not available.
+    """
     if not redis_client.ping():
         raise ConnectionError(
             f"Unable to connect Redis server: {REDIS__HOST}:{REDIS__PORT}"
@@ -97,7 +133,61 @@ def get_client(
         )
     except redis.ResponseError as e:
         pass
-    
+
+
+# Clients are cached per process with their connection info., to be set up once.
+_CLIENTS: Dict[Tuple, redis.Redis] = {}
+
+
+@logged
+def get_client(
+        *args,
+        host: str = "localhost",
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        # key: str = "infer",
+        # group: str = "infergrp",
+        max_connections: int = REDIS__MAX_CONNECTIONS,
+        **kwargs,
+    ) -> redis.Redis:
+    """Get a client, cached per process. The first call for connection info. checks the connection and sets up streams.
+
+    The client has a connection pool of up to `max_connections`, waiting for a connection if all are in use.
+    Extra arguments(`args`, `kwargs`) create a new client, not cached.
+
+    Raises:
+        ConnectionError: a redis server is not available.
+    """
+    if args or kwargs:
+        redis_client = redis.Redis(
+            *args,
+            host=host,
+            port=port,
+            db=db,
+            password=password,
+            decode_responses=True,
+            max_connections=max_connections,
+            **kwargs,
+        )
+        setup(redis_client)
+        return redis_client
+
+    client_key = (host, port, db, password, max_connections)
+    redis_client = _CLIENTS.get(client_key)
+    if redis_client is None:
+        redis_client = redis.Redis(
+            connection_pool=redis.BlockingConnectionPool(
+                host=host,
+                port=port,
+                db=db,
+                password=password,
+                decode_responses=True,
+                max_connections=max_connections,
+            ),
+        )
+        setup(redis_client)
+        _CLIENTS[client_key] = redis_client
     return redis_client
 
 
@@ -108,3 +198,774 @@ def get_default_client():
         db=REDIS__DB,
         password=REDIS__PASSWORD,
     )
+
+
+# Connection pools of `redis.asyncio` are bound to the event loop they were created on,
+# so they are kept per loop and released with it.
+_ASYNC_CONNECTION_POOLS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, redis.asyncio.ConnectionPool]]" = weakref.WeakKeyDictionary()
+
+
+def get_async_client(
+        host: str = "localhost",
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        decode_responses: bool = True,
+        max_connections: int = REDIS__MAX_CONNECTIONS,
+        **kwargs,
+    ) -> redis.asyncio.Redis:
+    r"""Get an asyncio-native client, sharing a connection pool of the running event loop.
+
+    The pool is created lazily on the first call within an event loop,
+    and reused by the following calls on the same loop with the same connection info(and the same pool arguments).
+    Streams and groups are not created here: use :func:`get_client` once for the setup.
+
+    Args:
+        host (str): Redis host. Defaults to ``localhost``.
+        port (int): Redis port. Defaults to ``6379``.
+        db (int): Redis DB number. Defaults to ``0``.
+        password (str): Redis password. Optional.
+        decode_responses (bool): Decode responses into ``str``. Defaults to ``True``.
+            ``False`` to read binary(non UTF-8) values as ``bytes``, with its own pool.
+        max_connections (int): Upper bound of connections of the pool. Defaults to ``128``.
+            If ``REDIS__MAX_CONNECTIONS`` is set, the argument default value is overrided.
+            A call waits for a connection if all are in use.
+        \**kwargs: Arbitrary keyword arguments for `redis.asyncio.ConnectionPool`.
+
+    Returns:
+        redis.asyncio.Redis
+
+    Raises:
+        RuntimeError: there is no running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    pools = _ASYNC_CONNECTION_POOLS.setdefault(loop, {})
+    # Values of `kwargs` may not be hashable, like an SSL context.
+    pool_key = (
+        host,
+        port,
+        db,
+        password,
+        decode_responses,
+        max_connections,
+        tuple(sorted((name, repr(value)) for name, value in kwargs.items())),
+    )
+    pool = pools.get(pool_key)
+    if pool is None:
+        pool = redis.asyncio.BlockingConnectionPool(
+            host=host,
+            port=port,
+            db=db,
+            password=password,
+            decode_responses=decode_responses,
+            max_connections=max_connections,
+            **kwargs,
+        )
+        pools[pool_key] = pool
+    return redis.asyncio.Redis(connection_pool=pool)
+
+
+def get_default_async_client(decode_responses: bool = True) -> redis.asyncio.Redis:
+    return get_async_client(
+        host=REDIS__HOST,
+        port=REDIS__PORT,
+        db=REDIS__DB,
+        password=REDIS__PASSWORD,
+        decode_responses=decode_responses,
+    )
+
+
+# Fields of a request, kept as ``bytes`` to be decoded by its codec.
+_PAYLOAD_FIELDS = ("body",)
+
+
+class Transport:
+    """Interface of how requests and responses travel through Redis, between `DynamicBatcher` and `BatchProcessor`.
+
+    A request is a ``Dict`` of fields: ``body``(encoded by its codec) and metadata(``codec``, ``deadline``, ...).
+    It is read as ``(request_id, fields)``, where a request ID is ``<milliseconds>-<sequence>`` of when it was sent,
+    with ``body`` in ``bytes`` and the others in ``str``.
+
+    A subclass implements both sides:
+
+        - `DynamicBatcher`: `send`, then `wait_response` if `blocking_response`,
+          or polls `is_accepted` and `pop_response` otherwise.
+          Requests in bulk go by `send_many`, then `wait_responses` or `pop_responses`, in a round trip each.
+          Partial results of a streaming request(``stream`` of `stream_key`) are waited for by `pop_chunk`,
+          pushed by `push_chunks` to the reply list of the event loop sending it, read by a single ``BLPOP`` on the loop.
+        - `BatchProcessor`: `read`, then `finish`(or `drop`, if expired), with `reclaim`, `queue_depth`,
+          and `housekeep` on its own schedule, to bound what is left on Redis.
+          `queue_stats` tells both sides how many requests are waiting, and how many have been taken so far.
+
+    Responses(and partial results) expire by `expiration` seconds, given per request or for all of them.
+
+    Both sides call `prepare` before the others, to create what a route needs on Redis.
+    ``prepare(force=True)`` creates it again, if it is gone(like flushed).
+
+    Requests of each priority(`PRIORITIES`) go to their own lane. `read` takes them from the higher lanes first,
+    but may return more than `count`, up to `count` of each lane.
+
+    Attributes:
+        name (str): Name to choose the transport by.
+        blocking_response (bool): Whether `wait_response` blocks until a response arrives, without polling.
+        redeliverable (bool): Whether a request of a dead `BatchProcessor` can be reclaimed(at-least-once).
+        route (str): Route(a model) of the requests, with its own keys. ``None`` for the default route.
+
+    """
+    name: str = None
+    blocking_response: bool = False
+    redeliverable: bool = False
+    route: Optional[str] = None
+    _header_size = struct.Struct("<I")
+
+    @property
+    def _async_redis_client(self) -> redis.asyncio.Redis:
+        return get_default_async_client()
+
+    @property
+    def _async_raw_redis_client(self) -> redis.asyncio.Redis:
+        # To read bodies as they are, encoded by the codec.
+        return get_default_async_client(decode_responses=False)
+
+    async def prepare(self, force: bool = False) -> None:
+        pass
+
+    async def send(self, fields: Dict, priority: str = DEFAULT_PRIORITY) -> str:
+        raise NotImplementedError
+
+    async def send_many(self, fields_list: List[Dict], priority: str = DEFAULT_PRIORITY) -> List[str]:
+        return [await self.send(fields, priority=priority) for fields in fields_list]
+
+    async def is_accepted(self, request_id: str) -> bool:
+        raise NotImplementedError
+
+    async def pop_response(self, request_id: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def pop_responses(self, request_ids: List[str]) -> List[Optional[bytes]]:
+        return [await self.pop_response(request_id) for request_id in request_ids]
+
+    async def wait_response(self, request_id: str, timeout: float) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def wait_responses(self, request_ids: List[str], timeout: float) -> List[Optional[bytes]]:
+        raise NotImplementedError
+
+    async def read(self, consumer_name: str, count: int, block: int) -> List[Tuple[str, Dict]]:
+        raise NotImplementedError
+
+    async def finish(
+            self,
+            request_ids: List[str],
+            responses: List[Optional[bytes]],
+            expiration: Union[int, List[int]],
+            reply_channels: Optional[List[Optional[str]]] = None,
+        ) -> None:
+        raise NotImplementedError
+
+    async def drop(self, request_ids: List[str]) -> None:
+        raise NotImplementedError
+
+    async def reclaim(self, consumer_name: str, min_idle_ms: int, start_id: str, count: int) -> Tuple[str, List]:
+        return "0-0", []
+
+    def stream_key(self) -> str:
+        # The reply list of the event loop, given as ``stream`` of a streaming request to push its partial results to.
+        return self._get_reader().key
+
+    async def push_chunks(
+            self,
+            request_ids: List[str],
+            chunks: List[List[bytes]],
+            expiration: Union[int, List[int]],
+            reply_keys: List[str],
+        ) -> None:
+        # Partial results of requests, to the reply lists of their senders(`stream_key`), in a single round trip.
+        async with self._async_redis_client.pipeline(transaction=False) as pipe:
+            for request_id, request_chunks, seconds, reply_key in zip(request_ids, chunks, _per_request(expiration, request_ids), reply_keys):
+                if request_chunks:
+                    pipe.rpush(reply_key, *[self._encode_entry(request_id, {"kind": "chunk", "body": chunk}) for chunk in request_chunks])
+                    pipe.expire(reply_key, seconds)
+            await pipe.execute()
+
+    async def pop_chunk(self, request_id: str, timeout: float) -> Optional[bytes]:
+        # Handed by the reader of the event loop: streams waiting do not hold connections of the pool.
+        return await self._get_reader().take("chunk", request_id, timeout=timeout)
+
+    def _get_reader(self) -> "_ReplyReader":
+        readers = _REPLY_READERS.setdefault(asyncio.get_running_loop(), {})
+        reader = readers.get(self.response_key)
+        if reader is None:
+            reader = _ReplyReader(self.response_key)
+            readers[self.response_key] = reader
+        return reader
+
+    def _encode_entry(self, request_id: str, fields: Dict) -> bytes:
+        # A header of metadata in JSON, followed by the body as it is.
+        body = fields.get("body", b"")
+        if isinstance(body, str):
+            body = body.encode()
+        header = json.dumps({"id": request_id, **{k: v for k, v in fields.items() if k != "body"}}).encode()
+        return self._header_size.pack(len(header)) + header + body
+
+    @classmethod
+    def _decode_entry(cls, entry: bytes) -> Tuple[str, Dict]:
+        (size,) = cls._header_size.unpack_from(entry)
+        offset = cls._header_size.size + size
+        fields = json.loads(entry[cls._header_size.size:offset])
+        fields["body"] = entry[offset:]
+        return fields.pop("id"), fields
+
+    async def queue_depth(self) -> int:
+        raise NotImplementedError
+
+    async def queue_stats(self) -> Tuple[int, Optional[int]]:
+        # Requests waiting, and a counter of requests taken by `BatchProcessor`(``None`` if not known).
+        return await self.queue_depth(), None
+
+    async def housekeep(self, consumer_name: str, stale_ms: int, expiration_ms: int) -> Tuple[int, int, int]:
+        """Bound what is left on Redis, off the batches. It never deletes a request not read yet.
+
+        Args:
+            consumer_name (str): Consumer name of the caller, not to be removed.
+            stale_ms (int): Milliseconds after a request was sent, to purge it if still unfinished,
+                and after a consumer was active, to remove it without unfinished requests.
+            expiration_ms (int): Milliseconds to keep responses in a stream, if any.
+
+        Returns:
+            Tuple[int, int, int]: Numbers of requests trimmed, requests purged and consumers removed.
+        """
+        return 0, 0, 0
+
+
+class RedisStreamTransport(Transport):
+    """Requests in a stream, read by a consumer group: at-least-once, reclaimed from a dead `BatchProcessor`.
+
+    A response is a key of its request ID, and a finished request is published to its ``reply_to`` channel.
+    On a route, IDs of its own stream may be the same as of the others: its responses are keyed under the route.
+
+    Each priority has its own stream(a lane), read at once. IDs of a lane but ``normal`` are tagged like ``<id>@high``.
+    """
+    name = "stream"
+    redeliverable = True
+
+    def __init__(
+            self,
+            request_key: str = REDIS__STREAM_KEY_REQUEST,
+            response_key: str = REDIS__STREAM_KEY_RESPONSE,
+            processor_group: str = REDIS__STREAM_GROUP_PROCESSOR,
+            route: Optional[str] = None,
+        ):
+        self.route = route
+        self.request_key = route_key(request_key, route)
+        self.response_key = route_key(response_key, route)
+        self.processor_group = processor_group
+        self.lane_keys: Dict[str, str] = {priority: lane_key(self.request_key, priority) for priority in PRIORITIES}
+        self._priorities: Dict[str, str] = {key: priority for priority, key in self.lane_keys.items()}
+        self._is_prepared = False
+        # A counter of requests finished, for `queue_stats` without ``entries-read``(before Redis 7).
+        self.finished_key = f"{self.request_key}:finished"
+        # Upper bound of stale requests purged per lane, by a `housekeep`.
+        self.housekeeping_count = 1000
+
+    def _response_name(self, request_id: str) -> str:
+        return request_id if self.route is None else f"{self.response_key}:{request_id}"
+
+    @staticmethod
+    def _tag(stream_id: str, priority: str) -> str:
+        return stream_id if priority == DEFAULT_PRIORITY else f"{stream_id}@{priority}"
+
+    def _untag(self, request_id: str) -> Tuple[str, str]:
+        # Returns the stream ID and the stream of its lane.
+        stream_id, _, priority = request_id.partition("@")
+        return stream_id, self.lane_keys[priority or DEFAULT_PRIORITY]
+
+    def _group_by_lane(self, request_ids: List[str]) -> Dict[str, List[str]]:
+        stream_ids: Dict[str, List[str]] = {}
+        for request_id in request_ids:
+            stream_id, key = self._untag(request_id)
+            stream_ids.setdefault(key, []).append(stream_id)
+        return stream_ids
+
+    async def prepare(self, force: bool = False) -> None:
+        # The default lane of the default route is set up by `get_client`, and the others here.
+        if self._is_prepared and not force:
+            return
+        for key in self.lane_keys.values():
+            try:
+                # From the beginning, not to miss requests sent before the group is created.
+                await self._async_redis_client.xgroup_create(
+                    name=key,
+                    groupname=self.processor_group,
+                    id="0",
+                    mkstream=True,
+                )
+            except redis.ResponseError:
+                pass
+        self._is_prepared = True
+
+    async def send(self, fields: Dict, priority: str = DEFAULT_PRIORITY) -> str:
+        stream_id = await self._async_redis_client.xadd(self.lane_keys[priority], fields)
+        return self._tag(stream_id, priority)
+
+    async def send_many(self, fields_list: List[Dict], priority: str = DEFAULT_PRIORITY) -> List[str]:
+        async with self._async_redis_client.pipeline(transaction=False) as pipe:
+            for fields in fields_list:
+                pipe.xadd(self.lane_keys[priority], fields)
+            stream_ids = await pipe.execute()
+        return [self._tag(stream_id, priority) for stream_id in stream_ids]
+
+    async def is_accepted(self, request_id: str) -> bool:
+        # A finished request is acked, so it is not pending anymore: its response tells it was accepted.
+        stream_id, key = self._untag(request_id)
+        async with self._async_redis_client.pipeline(transaction=False) as pipe:
+            pipe.xpending_range(
+                key,
+                groupname=self.processor_group,
+                count=1,
+                min=stream_id,
+                max=stream_id,
+            )
+            pipe.exists(self._response_name(request_id))
+            messages, is_finished = await pipe.execute()
+        return bool(messages) or bool(is_finished)
+
+    async def pop_response(self, request_id: str) -> Optional[bytes]:
+        async with self._async_raw_redis_client.pipeline(transaction=True) as pipe:
+            response_name = self._response_name(request_id)
+            message, _ = await pipe.get(response_name).delete(response_name).execute()
+        return message
+
+    async def pop_responses(self, request_ids: List[str]) -> List[Optional[bytes]]:
+        async with self._async_raw_redis_client.pipeline(transaction=True) as pipe:
+            for request_id in request_ids:
+                response_name = self._response_name(request_id)
+                pipe.get(response_name).delete(response_name)
+            results = await pipe.execute()
+        return results[::2]
+
+    async def read(self, consumer_name: str, count: int, block: int) -> List[Tuple[str, Dict]]:
+        # Up to `count` of each lane.
+        requests: List = await self._async_raw_redis_client.xreadgroup(
+            groupname=self.processor_group,
+            consumername=consumer_name,
+            streams={key: '>' for key in self.lane_keys.values()},
+            count=count,
+            block=block,
+            noack=False,
+        )
+        return [
+            (self._tag(stream_id, self._priorities[key.decode()]), fields)
+            for key, messages in requests or []
+            for stream_id, fields in _decode_stream_entries(messages)
+        ]
+
+    async def finish(
+            self,
+            request_ids: List[str],
+            responses: List[Optional[bytes]],
+            expiration: Union[int, List[int]],
+            reply_channels: Optional[List[Optional[str]]] = None,
+        ) -> None:
+        # Responses, acks, deletion and notifications of a batch are sent in a single round trip.
+        async with self._async_redis_client.pipeline(transaction=True) as pipe:
+            for request_id, response, seconds in zip(request_ids, responses, _per_request(expiration, request_ids)):
+                if response is not None:
+                    pipe.set(self._response_name(request_id), response, ex=seconds)
+            for key, stream_ids in self._group_by_lane(request_ids).items():
+                pipe.xack(key, self.processor_group, *stream_ids)
+                pipe.xdel(key, *stream_ids)
+            pipe.incrby(self.finished_key, len(request_ids))
+            if reply_channels:
+                _publish_finished(pipe, request_ids, reply_channels)
+            await pipe.execute()
+
+    async def drop(self, request_ids: List[str]) -> None:
+        async with self._async_redis_client.pipeline(transaction=True) as pipe:
+            for key, stream_ids in self._group_by_lane(request_ids).items():
+                pipe.xack(key, self.processor_group, *stream_ids)
+                pipe.xdel(key, *stream_ids)
+            pipe.incrby(self.finished_key, len(request_ids))
+            await pipe.execute()
+
+    async def reclaim(self, consumer_name: str, min_idle_ms: int, start_id: str, count: int) -> Tuple[str, List]:
+        # Scans the lanes in turn, from ``0-0`` to ``0-0``: the cursor between is always tagged with its lane.
+        stream_id, _, priority = start_id.partition("@")
+        priority = priority or PRIORITIES[0]
+        next_id, messages, *_ = await self._async_raw_redis_client.xautoclaim(
+            self.lane_keys[priority],
+            self.processor_group,
+            consumer_name,
+            min_idle_time=min_idle_ms,
+            start_id=stream_id,
+            count=count,
+        )
+        next_id = next_id.decode()
+        if next_id == "0-0":
+            lane = PRIORITIES.index(priority) + 1
+            next_id = "0-0" if lane == len(PRIORITIES) else f"0-0@{PRIORITIES[lane]}"
+        else:
+            next_id = f"{next_id}@{priority}"
+        # Entries already deleted from the stream have no fields.
+        messages = _decode_stream_entries([(i, v) for i, v in messages if v])
+        return next_id, [(self._tag(i, priority), v) for i, v in messages]
+
+    async def queue_depth(self) -> int:
+        depth, _ = await self.queue_stats()
+        return depth
+
+    async def queue_stats(self) -> Tuple[int, Optional[int]]:
+        async with self._async_redis_client.pipeline(transaction=False) as pipe:
+            for key in self.lane_keys.values():
+                pipe.xinfo_groups(key)
+                pipe.xlen(key)
+            pipe.get(self.finished_key)
+            *lanes, finished = await pipe.execute(raise_on_error=False)
+        depth, entries_read, pending, has_lag = 0, 0, 0, True
+        for groups, length in zip(lanes[::2], lanes[1::2]):
+            if isinstance(groups, Exception):
+                continue
+            for group in groups:
+                if group['name'] == self.processor_group:
+                    pending += group['pending']
+                    # `lag` and `entries-read` are not available before Redis 7.
+                    # A lane never read has no `entries-read`, but its `lag`.
+                    if group.get('lag') is None:
+                        # Entries finished are deleted: the ones left but pending are not read yet.
+                        depth += max(0, length - group['pending']) if isinstance(length, int) else 0
+                        has_lag = False
+                    else:
+                        depth += group['lag']
+                        entries_read += group.get('entries-read') or 0
+        if has_lag:
+            return depth, entries_read
+        # Without `entries-read`, requests taken are the ones finished(or dropped, purged) and the pending ones.
+        if isinstance(finished, Exception):
+            return depth, None
+        return depth, int(finished or 0) + pending
+
+    async def housekeep(self, consumer_name: str, stale_ms: int, expiration_ms: int) -> Tuple[int, int, int]:
+        # Per lane: trims entries older than any pending(or undelivered) one by ID, as they are acked,
+        # purges pending entries sent `stale_ms` ago(their callers have given up), and removes idle consumers(dead ones).
+        # Stale entries are reclaimed(`reclaim`) long before, so ones still pending are failing on every consumer.
+        stale_id = f"{int(time.time() * 1000) - stale_ms}"
+        async with self._async_redis_client.pipeline(transaction=False) as pipe:
+            for key in self.lane_keys.values():
+                pipe.xinfo_groups(key)
+                pipe.xpending(key, self.processor_group)
+                pipe.xpending_range(key, self.processor_group, min="-", max=stale_id, count=self.housekeeping_count)
+                pipe.xinfo_consumers(key, self.processor_group)
+            lanes = await pipe.execute(raise_on_error=False)
+
+        min_ids: Dict[str, str] = {}
+        stale_ids: Dict[str, List[str]] = {}
+        idle_consumers: Dict[str, List[str]] = {}
+        for index, key in enumerate(self.lane_keys.values()):
+            groups, pending, stale_entries, consumers = lanes[index * 4:index * 4 + 4]
+            if any(isinstance(result, Exception) for result in (groups, pending, stale_entries, consumers)):
+                continue
+            group = next((group for group in groups if group['name'] == self.processor_group), None)
+            if group is None:
+                continue
+            min_ids[key] = pending['min'] if pending['pending'] else group['last-delivered-id']
+            stale_ids[key] = [entry['message_id'] for entry in stale_entries]
+            idle_consumers[key] = [
+                consumer['name'] for consumer in consumers
+                if consumer['name'] != consumer_name and not consumer['pending'] and consumer['idle'] > stale_ms
+            ]
+
+        async with self._async_redis_client.pipeline(transaction=False) as pipe:
+            trimming = [key for key, min_id in min_ids.items() if min_id != "0-0"]
+            for key in trimming:
+                pipe.xtrim(key, minid=min_ids[key], approximate=False)
+            for key, ids in stale_ids.items():
+                if ids:
+                    pipe.xack(key, self.processor_group, *ids)
+                    pipe.xdel(key, *ids)
+                    pipe.incrby(self.finished_key, len(ids))
+            for key, names in idle_consumers.items():
+                for name in names:
+                    pipe.xgroup_delconsumer(key, self.processor_group, name)
+            # Responses in a stream(of `BatchProcessor._mark_as_finished_as_stream`), by their age.
+            pipe.xtrim(self.response_key, minid=f"{int(time.time() * 1000) - expiration_ms}", approximate=False)
+            results = await pipe.execute(raise_on_error=False)
+        trimmed = sum(result for result in results[:len(trimming)] if isinstance(result, int))
+        purged = sum(len(ids) for ids in stale_ids.values())
+        removed = sum(len(names) for names in idle_consumers.values())
+        return trimmed, purged, removed
+
+
+class _ReplyReader:
+    """(Internally used) Reader of the reply list of an event loop, shared by every `Transport` of a route on it.
+
+    Responses(and partial results) of the requests sent on the same event loop are pushed to one list,
+    read by a single ``BLPOP`` at a time while anyone waits, and handed to their waiters:
+    waiting requests do not hold connections of the pool.
+    An entry arrived before it is waited for is kept for a while. A failed request is handed ``None`` at once.
+    """
+    max_unclaimed = 4096
+    max_block_sec = 1
+
+    def __init__(self, response_key: str):
+        self.token = uuid.uuid4().hex[:16]
+        self.key = f"{response_key}:{self.token}"
+        self._futures: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._arrived: "OrderedDict[Tuple[str, str], deque]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def _async_raw_redis_client(self) -> redis.asyncio.Redis:
+        return get_default_async_client(decode_responses=False)
+
+    async def take(self, kind: str, request_id: str, timeout: float) -> Optional[bytes]:
+        # ``None`` if the request failed, or nothing of it arrives in `timeout` seconds. Checks once, without blocking, if not positive.
+        key = (kind, request_id)
+        if key not in self._arrived:
+            if timeout <= 0:
+                self._arrive(await self._drain())
+            else:
+                future = asyncio.get_running_loop().create_future()
+                self._futures[key] = future
+                if self._task is None or self._task.done():
+                    self._task = asyncio.create_task(self._read())
+                try:
+                    await asyncio.wait([future], timeout=timeout)
+                finally:
+                    self._futures.pop(key, None)
+                if future.done():
+                    # Raises the error of the reader, if failed.
+                    future.result()
+        entries = self._arrived.get(key)
+        if not entries:
+            return None
+        entry = entries.popleft()
+        if not entries:
+            del self._arrived[key]
+        return entry
+
+    async def _drain(self) -> List[bytes]:
+        async with self._async_raw_redis_client.pipeline(transaction=True) as pipe:
+            entries, _ = await pipe.lrange(self.key, 0, -1).delete(self.key).execute()
+        return entries
+
+    async def _read(self) -> None:
+        # Runs while anyone waits, blocking a while at once, not to be over the socket timeout of the client.
+        try:
+            while self._futures:
+                popped = await self._async_raw_redis_client.blpop([self.key], timeout=self.max_block_sec)
+                if popped:
+                    self._arrive([popped[1]] + await self._drain())
+        except Exception as e:
+            for future in self._futures.values():
+                if not future.done():
+                    future.set_exception(e)
+
+    def _arrive(self, entries: List[bytes]) -> None:
+        for entry in entries:
+            request_id, fields = Transport._decode_entry(entry)
+            key = (fields["kind"], request_id)
+            # ``None`` for a failed request.
+            self._arrived.setdefault(key, deque()).append(None if fields.get("failed") else fields["body"])
+            future = self._futures.get(key)
+            if future is not None and not future.done():
+                future.set_result(None)
+        while len(self._arrived) > self.max_unclaimed:
+            self._arrived.popitem(last=False)
+
+
+_REPLY_READERS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, _ReplyReader]]" = weakref.WeakKeyDictionary()
+
+
+class RedisListTransport(Transport):
+    """Requests in a list, popped in bulk(``BLMPOP``): at-most-once, lighter than a stream.
+
+    A response(and a partial result) is pushed to the reply list of the event loop sending its request,
+    read by a single ``BLPOP`` for all the requests waiting on the loop(a gunicorn worker).
+    No consumer group, no pending list, no acks: a request popped by a dead `BatchProcessor` is lost.
+
+    Each priority has its own list(a lane), and ``BLMPOP`` pops from the highest lane not empty.
+    Before Redis 7, without ``BLMPOP``, ``BRPOP`` pops the first one, and the rest are taken from the same lane at once.
+
+    Note:
+        A response is waited for on the event loop sending its request.
+    """
+    name = "list"
+    blocking_response = True
+
+    def __init__(
+            self,
+            request_key: str = REDIS__LIST_KEY_REQUEST,
+            response_key: str = REDIS__LIST_KEY_RESPONSE,
+            route: Optional[str] = None,
+        ):
+        self.route = route
+        self.request_key = route_key(request_key, route)
+        self.response_key = route_key(response_key, route)
+        self.lane_keys: Dict[str, str] = {priority: lane_key(self.request_key, priority) for priority in PRIORITIES}
+        # A counter of requests finished, as a list has no record of ones popped.
+        self.finished_key = f"{self.request_key}:finished"
+        # Whether the server has ``BLMPOP``(Redis 7+), checked by `prepare`.
+        self._has_blmpop: Optional[bool] = None
+
+    async def prepare(self, force: bool = False) -> None:
+        if self._has_blmpop is not None and not force:
+            return
+        server = await self._async_redis_client.info("server")
+        version = tuple(int(number) for number in str(server["redis_version"]).split(".")[:2])
+        self._has_blmpop = version >= (7, 0)
+
+    def _reply_key(self, request_id: str) -> str:
+        # Of the reader of the sender, by the token in the request ID.
+        return f"{self.response_key}:{request_id.split('-')[1]}"
+
+    def _new_request_id(self) -> str:
+        return f"{int(time.time() * 1000)}-{self._get_reader().token}-{uuid.uuid4().hex}"
+
+    async def send(self, fields: Dict, priority: str = DEFAULT_PRIORITY) -> str:
+        request_id = self._new_request_id()
+        await self._async_redis_client.lpush(self.lane_keys[priority], self._encode_entry(request_id, fields))
+        return request_id
+
+    async def send_many(self, fields_list: List[Dict], priority: str = DEFAULT_PRIORITY) -> List[str]:
+        # Pushed in order, to be popped in order.
+        request_ids = [self._new_request_id() for _ in fields_list]
+        if request_ids:
+            await self._async_redis_client.lpush(
+                self.lane_keys[priority],
+                *[self._encode_entry(request_id, fields) for request_id, fields in zip(request_ids, fields_list)],
+            )
+        return request_ids
+
+    async def pop_response(self, request_id: str) -> Optional[bytes]:
+        return await self._get_reader().take("response", request_id, timeout=0)
+
+    async def pop_responses(self, request_ids: List[str]) -> List[Optional[bytes]]:
+        return [await self.pop_response(request_id) for request_id in request_ids]
+
+    async def wait_response(self, request_id: str, timeout: float) -> Optional[bytes]:
+        return await self._get_reader().take("response", request_id, timeout=timeout)
+
+    async def wait_responses(self, request_ids: List[str], timeout: float) -> List[Optional[bytes]]:
+        # All handed by the same reader, whichever arrives first.
+        reader = self._get_reader()
+        return list(await asyncio.gather(*[reader.take("response", request_id, timeout=timeout) for request_id in request_ids]))
+
+    async def read(self, consumer_name: str, count: int, block: int) -> List[Tuple[str, Dict]]:
+        if self._has_blmpop is None:
+            await self.prepare()
+        if not self._has_blmpop:
+            return await self._read_by_brpop(count, block)
+        popped = await self._async_raw_redis_client.blmpop(
+            block / 1000,
+            len(self.lane_keys),
+            *self.lane_keys.values(),
+            direction="RIGHT",
+            count=count,
+        )
+        if not popped:
+            return []
+        return [self._decode_entry(entry) for entry in popped[1]]
+
+    async def _read_by_brpop(self, count: int, block: int) -> List[Tuple[str, Dict]]:
+        # ``BRPOP`` pops from the first lane not empty, in the order given: the highest one.
+        # A timeout of 1ms may be rounded down to 0, which means forever: blocks at least 2ms.
+        popped = await self._async_raw_redis_client.brpop(list(self.lane_keys.values()), timeout=max(block, 2) / 1000)
+        if not popped:
+            return []
+        key, entries = popped[0], [popped[1]]
+        if count > 1:
+            # The oldest ones are at the right: taken at once, and reversed to be in order.
+            async with self._async_raw_redis_client.pipeline(transaction=True) as pipe:
+                rest, _ = await pipe.lrange(key, -(count - 1), -1).ltrim(key, 0, -count).execute()
+            entries += rest[::-1]
+        return [self._decode_entry(entry) for entry in entries]
+
+    async def finish(
+            self,
+            request_ids: List[str],
+            responses: List[Optional[bytes]],
+            expiration: Union[int, List[int]],
+            reply_channels: Optional[List[Optional[str]]] = None,
+        ) -> None:
+        async with self._async_redis_client.pipeline(transaction=False) as pipe:
+            for request_id, response, seconds in zip(request_ids, responses, _per_request(expiration, request_ids)):
+                # A failed one as well, not to be waited for until its timeout.
+                if response is None:
+                    entry = self._encode_entry(request_id, {"kind": "response", "failed": True})
+                else:
+                    entry = self._encode_entry(request_id, {"kind": "response", "body": response})
+                pipe.rpush(self._reply_key(request_id), entry)
+                pipe.expire(self._reply_key(request_id), seconds)
+            pipe.incrby(self.finished_key, len(request_ids))
+            await pipe.execute()
+
+    async def drop(self, request_ids: List[str]) -> None:
+        # Popped already, but counted: they have left the queue as well.
+        if request_ids:
+            await self._async_redis_client.incrby(self.finished_key, len(request_ids))
+
+    async def queue_depth(self) -> int:
+        async with self._async_redis_client.pipeline(transaction=False) as pipe:
+            for key in self.lane_keys.values():
+                pipe.llen(key)
+            return sum(await pipe.execute())
+
+    async def queue_stats(self) -> Tuple[int, Optional[int]]:
+        async with self._async_redis_client.pipeline(transaction=False) as pipe:
+            for key in self.lane_keys.values():
+                pipe.llen(key)
+            pipe.get(self.finished_key)
+            *depths, finished = await pipe.execute()
+        return sum(depths), int(finished or 0)
+
+
+def _decode_stream_entries(messages: List) -> List[Tuple[str, Dict]]:
+    # Entries read by a client not decoding responses: all in ``str``, but bodies.
+    return [
+        (
+            stream_id.decode(),
+            {
+                key.decode(): value if key.decode() in _PAYLOAD_FIELDS else value.decode()
+                for key, value in fields.items()
+            },
+        )
+        for stream_id, fields in messages
+    ]
+
+
+def _per_request(expiration: Union[int, List[int]], request_ids: List[str]) -> List[int]:
+    # Expiration given for all requests, or per request.
+    if isinstance(expiration, int):
+        return [expiration for _ in request_ids]
+    return expiration
+
+
+def _publish_finished(
+        pipe: redis.asyncio.client.Pipeline,
+        request_ids: List[str],
+        reply_channels: List[Optional[str]],
+    ) -> None:
+    # Requests sent by `delivery="push"` have a channel to reply. One message per channel.
+    finished: Dict[str, List[str]] = {}
+    for request_id, channel in zip(request_ids, reply_channels):
+        if channel:
+            finished.setdefault(channel, []).append(request_id)
+    for channel, channel_request_ids in finished.items():
+        pipe.publish(channel, ",".join(channel_request_ids))
+
+
+TRANSPORTS: Dict[str, Type[Transport]] = {
+    RedisStreamTransport.name: RedisStreamTransport,
+    RedisListTransport.name: RedisListTransport,
+}
+
+
+def get_transport(name: str, route: Optional[str] = None) -> Transport:
+    """Create a transport by its name: ``stream`` or ``list``, on a route(a model) if given.
+
+    Raises:
+        ValueError: the transport is unknown.
+    """
+    if name not in TRANSPORTS:
+        raise ValueError(f"'transport' should be one of {tuple(TRANSPORTS)}: {name}")
+    return TRANSPORTS[name](route=route)
@@ -0,0 +1,250 @@
+"""
+====================================
+ :mod:`shm_engine` Module
+====================================
+.. moduleauthor:: Youngju Jaden Kim <pydemia@gmail.com>
+.. note:: Info
+
+Info
+====
+    Shared memory for payloads between `DynamicBatcher` and `BatchProcessor` on the same host.
+
+    Each client process owns a ring of fixed-size slots in a ``multiprocessing.shared_memory`` segment.
+    A request body is written into a free slot, and Redis carries only where it is(segment, offset, size).
+    `BatchProcessor` attaches the segment by its name, reads the body, and writes the response back into the same slot.
+
+    A segment starts with a header of its owner(pid) and its slots, so a slot out of the ring is never read or written,
+    and a segment of a client gone is detached.
+
+"""
+
+
+from typing import Optional, Dict, List
+import os
+import uuid
+import atexit
+import struct
+import threading
+from collections import OrderedDict
+from multiprocessing import shared_memory, resource_tracker
+
+
+__all__ = [
+    "SHM__SLOTS",
+    "SHM__SLOT_SIZE",
+    "SHM__MAX_ATTACHED",
+    "SharedMemoryRing",
+    "get_ring",
+    "attach",
+    "detach",
+    "prune",
+    "read_slot",
+    "write_slot",
+]
+
+
+SHM__SLOTS = int(os.getenv("SHM__SLOTS", "64"))
+SHM__SLOT_SIZE = int(os.getenv("SHM__SLOT_SIZE", str(256 * 1024)))
+SHM__MAX_ATTACHED = int(os.getenv("SHM__MAX_ATTACHED", "64"))
+
+# magic, pid of the owner, slots, slot_size: padded to keep the slots aligned.
+_HEADER = struct.Struct("<8sIII")
+_HEADER_SIZE = 64
+_MAGIC = b"DYNBATCH"
+_NAME_PREFIX = "dynamic_batcher_"
+
+
+class SharedMemoryRing:
+    """A ring of fixed-size slots in a shared memory segment, owned by a client process.
+
+    A slot is acquired for a request, and released after its response is read.
+    If no slot is free, or a body is larger than a slot, the body goes through Redis instead.
+
+    Args:
+        slots (int): Number of slots. Defaults to ``64``.
+            If ``SHM__SLOTS`` is set, the argument default value is overrided.
+        slot_size (int): Bytes of a slot. Defaults to ``262144``(256KiB).
+            If ``SHM__SLOT_SIZE`` is set, the argument default value is overrided.
+
+    Attributes:
+        name (str): Name of the segment, to be attached by `BatchProcessor`.
+
+    Example:
+        >>> ring = SharedMemoryRing(slots=4, slot_size=1024)
+        >>> slot = ring.acquire()
+        >>> ring.write(slot, b'{"a": 1}')
+        8
+        >>> ring.read(slot, 8)
+        b'{"a": 1}'
+        >>> ring.release(slot)
+
+    """
+
+    def __init__(self, slots: int = SHM__SLOTS, slot_size: int = SHM__SLOT_SIZE):
+        if slots < 1 or slot_size < 1:
+            raise ValueError(f"'slots' and 'slot_size' should be positive integers: {slots}, {slot_size}")
+        self.slots = slots
+        self.slot_size = slot_size
+        self._shm = shared_memory.SharedMemory(
+            name=f"{_NAME_PREFIX}{os.getpid()}_{uuid.uuid4().hex[:8]}",
+            create=True,
+            size=_HEADER_SIZE + slots * slot_size,
+        )
+        self.name = self._shm.name
+        self._pid = os.getpid()
+        _HEADER.pack_into(self._shm.buf, 0, _MAGIC, self._pid, slots, slot_size)
+        self._free: List[int] = list(range(slots))
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Optional[int]:
+        with self._lock:
+            return self._free.pop() if self._free else None
+
+    def release(self, slot: int) -> None:
+        with self._lock:
+            self._free.append(slot)
+
+    def offset(self, slot: int) -> int:
+        return _HEADER_SIZE + slot * self.slot_size
+
+    def write(self, slot: int, data: bytes) -> int:
+        return write_slot(self._shm, self.offset(slot), self.slot_size, data)
+
+    def read(self, slot: int, size: int) -> bytes:
+        return read_slot(self._shm, self.offset(slot), size)
+
+    def close(self) -> None:
+        # A forked process inherits the ring, but does not own it.
+        if os.getpid() != self._pid:
+            return
+        self._shm.close()
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _read_header(shm: shared_memory.SharedMemory) -> tuple:
+    if shm.size < _HEADER_SIZE:
+        raise ValueError(f"Not a segment of a ring: {shm.name}")
+    magic, pid, slots, slot_size = _HEADER.unpack_from(shm.buf, 0)
+    if magic != _MAGIC or shm.size < _HEADER_SIZE + slots * slot_size:
+        raise ValueError(f"Not a segment of a ring: {shm.name}")
+    return pid, slots, slot_size
+
+
+def _check_slot(shm: shared_memory.SharedMemory, offset: int, size: int) -> None:
+    # Where and how much is given by a client(through Redis): only a whole slot of the ring is accessed.
+    _, slots, slot_size = _read_header(shm)
+    slot, remainder = divmod(offset - _HEADER_SIZE, slot_size)
+    if offset < _HEADER_SIZE or remainder or slot >= slots:
+        raise ValueError(f"Not an offset of a slot: {offset}")
+    if not 0 <= size <= slot_size:
+        raise ValueError(f"Data is larger than the slot: {size} > {slot_size}")
+
+
+def write_slot(shm: shared_memory.SharedMemory, offset: int, capacity: int, data: bytes) -> int:
+    size = len(data)
+    if size > capacity:
+        raise ValueError(f"Data is larger than the slot: {size} > {capacity}")
+    _check_slot(shm, offset, size)
+    shm.buf[offset:offset + size] = data
+    return size
+
+
+def read_slot(shm: shared_memory.SharedMemory, offset: int, size: int) -> bytes:
+    _check_slot(shm, offset, size)
+    return bytes(shm.buf[offset:offset + size])
+
+
+# Rings are per process, not to be shared by forked workers.
+_RINGS: Dict[int, SharedMemoryRing] = {}
+_RINGS_LOCK = threading.Lock()
+
+
+def get_ring() -> SharedMemoryRing:
+    """Get the ring of this process, created on the first use and removed at exit."""
+    pid = os.getpid()
+    with _RINGS_LOCK:
+        ring = _RINGS.get(pid)
+        if ring is None:
+            ring = SharedMemoryRing()
+            _RINGS[pid] = ring
+            atexit.register(ring.close)
+    return ring
+
+
+# The least recently used one is detached over `SHM__MAX_ATTACHED`.
+_ATTACHED: "OrderedDict[str, shared_memory.SharedMemory]" = OrderedDict()
+_ATTACHED_LOCK = threading.Lock()
+
+
+def attach(name: str) -> shared_memory.SharedMemory:
+    """Attach a segment of a client by its name, cached.
+    Up to ``SHM__MAX_ATTACHED`` segments are kept attached, the least recently used one detached first.
+
+    Raises:
+        FileNotFoundError: the segment is removed, as its client is gone.
+        ValueError: the segment is not of a ring.
+    """
+    with _ATTACHED_LOCK:
+        shm = _ATTACHED.get(name)
+        if shm is not None:
+            _ATTACHED.move_to_end(name)
+            return shm
+    if not name.startswith(_NAME_PREFIX):
+        raise ValueError(f"Not a segment of a ring: {name}")
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        pid, _, _ = _read_header(shm)
+    except Exception:
+        pid = None
+    # Only the client owns the segment: not to be removed when this process exits.
+    if pid != os.getpid():
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+    if pid is None:
+        shm.close()
+        raise ValueError(f"Not a segment of a ring: {name}")
+    with _ATTACHED_LOCK:
+        _ATTACHED[name] = shm
+        while len(_ATTACHED) > SHM__MAX_ATTACHED:
+            _, evicted = _ATTACHED.popitem(last=False)
+            evicted.close()
+    return shm
+
+
+def detach(name: str) -> None:
+    with _ATTACHED_LOCK:
+        shm = _ATTACHED.pop(name, None)
+    if shm is not None:
+        shm.close()
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def prune() -> List[str]:
+    """Detach the segments of clients gone(by the pid in its header).
+
+    Returns:
+        Names of the segments detached.
+    """
+    with _ATTACHED_LOCK:
+        attached = list(_ATTACHED.items())
+    pruned = []
+    for name, shm in attached:
+        pid, _, _ = _read_header(shm)
+        if not _is_alive(pid):
+            detach(name)
+            pruned.append(name)
+    return pruned
@@ -65,6 +65,24 @@ def get_arity(f):
     return arity
 
 
+def is_coroutine_callable(f):
+    if inspect.iscoroutinefunction(f):
+        return True
+    return inspect.iscoroutinefunction(getattr(f, "__call__", None))
+
+
+def is_async_generator_callable(f):
+    if inspect.isasyncgenfunction(f):
+        return True
+    return inspect.isasyncgenfunction(getattr(f, "__call__", None))
+
+
+def is_generator_callable(f):
+    if inspect.isgeneratorfunction(f):
+        return True
+    return inspect.isgeneratorfunction(getattr(f, "__call__", None))
+
+
 def validate_callable(arity):
     def _validate_callable(val):
         if isinstance(val, str):
@@ -8,16 +8,22 @@ from fastapi import FastAPI, Depends
 from pydantic import BaseModel
 from fastapi.responses import RedirectResponse
 
-from dynamic_batcher import DynamicBatcher
+from dynamic_batcher import DynamicBatcher, get_batcher
 
 
 def get_dynamic_batcher():
-    return DynamicBatcher(delay=0.01, timeout=100)
+    return get_batcher(delay=0.01, timeout=100)
 
 
 app = FastAPI()
 
 
+@app.on_event("startup")
+async def setup_dynamic_batcher():
+    # Connects and sets up streams once, not on every request.
+    get_dynamic_batcher()
+
+
 class Item(BaseModel):
     name: str
     description: str | None = None
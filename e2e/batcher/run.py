@@ -14,7 +14,7 @@ from pathlib import Path
 from dynamic_batcher import BatchProcessor
 
 DYNAMIC_BATCHER__BATCH_SIZE = int(os.getenv("DYNAMIC_BATCHER__BATCH_SIZE", "64"))
-DYNAMIC_BATCHER__BATCH_TIME = int(os.getenv("DYNAMIC_BATCHER__BATCH_TIME", "2"))
+DYNAMIC_BATCHER__BATCH_TIME = float(os.getenv("DYNAMIC_BATCHER__BATCH_TIME", "2"))
 
 
 def add_1(bodies: List[Dict]) -> List[Dict]:
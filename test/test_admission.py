@@ -0,0 +1,56 @@
+import pytest
+from dynamic_batcher import admission
+from dynamic_batcher.admission import AdmissionController, OverloadedError
+
+
+def test_admission_estimated_wait(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    controller = AdmissionController(max_queue_wait=2)
+
+    controller.observe(queue_depth=100, taken=0)
+    # The throughput is not known yet.
+    controller.check(count=1)
+    now[0] = 1.0
+    controller.observe(queue_depth=100, taken=100)
+    assert controller.load().throughput == 100
+    controller.check(count=50)
+    with pytest.raises(OverloadedError) as e:
+        controller.check(count=100)
+    assert e.value.estimated_wait == pytest.approx(2.5)
+    assert e.value.retry_after == pytest.approx(0.5)
+    # Over the timeout of the request.
+    with pytest.raises(OverloadedError):
+        controller.check(count=1, timeout=1)
+
+
+def test_admission_with_stream_transport(monkeypatch):
+    import asyncio
+    import uuid
+    from dynamic_batcher import redis_engine
+
+    now = [0.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    route = f"admission-{uuid.uuid4().hex}"
+    transport = redis_engine.get_transport("stream", route=route)
+    controller = AdmissionController(max_queue_wait=2)
+
+    async def run():
+        await transport.prepare()
+        await transport.send_many([{"body": b"1"} for _ in range(100)])
+        queue_depth, taken = await transport.queue_stats()
+        controller.observe(route, queue_depth=queue_depth, taken=taken)
+        requests = await transport.read("test-consumer", count=10, block=100)
+        await transport.finish([i for i, v in requests], [b"2" for _ in requests], expiration=10)
+        now[0] = 1.0
+        queue_depth, taken = await transport.queue_stats()
+        controller.observe(route, queue_depth=queue_depth, taken=taken)
+
+    try:
+        asyncio.run(run())
+    finally:
+        redis_engine.get_default_client().delete(*transport.lane_keys.values(), transport.finished_key)
+    # 90 requests waiting, taken 10 per second: over `max_queue_wait`, on any version of Redis.
+    assert controller.load(route).throughput == 10
+    with pytest.raises(OverloadedError):
+        controller.check(route, count=1)
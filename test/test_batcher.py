@@ -8,3 +8,428 @@ def test_launch_processor():
 
 def test_batcher():
     batcher = DynamicBatcher()
+
+
+def test_columnar_batch():
+    from dynamic_batcher.batcher import _to_columns, _from_columns
+    processor = BatchProcessor(columnar=True)
+    assert processor.columnar
+
+    columns = _to_columns([{'a': 1, 'b': 2}, {'a': 3}])
+    assert columns == {'a': [1, 3], 'b': [2, None]}
+    assert _from_columns({'sum': [3, 3]}) == [{'sum': 3}, {'sum': 3}]
+    with pytest.raises(ValueError):
+        _from_columns({'a': [1, 2], 'b': [1]})
+
+
+def test_get_batcher():
+    from dynamic_batcher import get_batcher
+    batcher = get_batcher(timeout=3)
+    assert get_batcher(timeout=3) is batcher
+    assert get_batcher(timeout=5) is not batcher
+
+
+@pytest.mark.parametrize("transport", ["stream", "list"])
+def test_routes(transport):
+    import asyncio
+    import uuid
+    from dynamic_batcher import start_daemons
+
+    def add_1(bodies):
+        return [body + 1 for body in bodies]
+
+    def add_10(bodies):
+        return [body + 10 for body in bodies]
+
+    async def run():
+        add_1_route = f"add_1-{uuid.uuid4().hex}"
+        add_10_route = f"add_10-{uuid.uuid4().hex}"
+        batcher = DynamicBatcher(timeout=5, transport=transport, route=add_1_route)
+        daemons = asyncio.create_task(start_daemons([
+            (BatchProcessor(batch_size=4, batch_time=0.01, transport=transport, route=add_1_route), add_1),
+            (BatchProcessor(batch_size=2, batch_time=0.01, transport=transport, route=add_10_route), add_10),
+        ]))
+        try:
+            return await asyncio.gather(
+                batcher.asend(1),
+                batcher.asend(1, route=add_10_route),
+                batcher.asend(2, route=add_10_route),
+            )
+        finally:
+            daemons.cancel()
+
+    assert asyncio.run(run()) == [2, 11, 12]
+
+
+@pytest.mark.parametrize("transport,delivery", [("stream", "poll"), ("stream", "push"), ("list", "poll")])
+def test_asend_many(transport, delivery):
+    import asyncio
+    import uuid
+
+    def add_1(bodies):
+        return [body + 1 for body in bodies]
+
+    async def run():
+        route = f"asend_many-{uuid.uuid4().hex}"
+        batcher = DynamicBatcher(timeout=5, transport=transport, delivery=delivery, route=route)
+        processor = BatchProcessor(batch_size=8, batch_time=0.01, transport=transport, route=route)
+        daemon = asyncio.create_task(processor.start_daemon(add_1))
+        try:
+            return await batcher.asend_many(list(range(20)))
+        finally:
+            daemon.cancel()
+
+    assert asyncio.run(run()) == list(range(1, 21))
+
+
+def test_coalesce_window():
+    import asyncio
+    import uuid
+
+    sent = []
+
+    def add_1(bodies):
+        return [body + 1 for body in bodies]
+
+    async def run():
+        route = f"coalesce-{uuid.uuid4().hex}"
+        batcher = DynamicBatcher(timeout=5, coalesce_window=0.01, route=route)
+        transport = batcher.transport
+        send_many = transport.send_many
+
+        async def record_send_many(fields_list, priority):
+            sent.append(len(fields_list))
+            return await send_many(fields_list, priority=priority)
+
+        transport.send_many = record_send_many
+        processor = BatchProcessor(batch_size=8, batch_time=0.01, route=route)
+        daemon = asyncio.create_task(processor.start_daemon(add_1))
+        try:
+            return await asyncio.gather(*[batcher.asend(value) for value in range(5)])
+        finally:
+            daemon.cancel()
+
+    assert asyncio.run(run()) == [1, 2, 3, 4, 5]
+    assert sent == [5]
+
+
+@pytest.mark.parametrize("transport", ["stream", "list"])
+def test_astream(transport):
+    import asyncio
+    import uuid
+
+    async def count_up(bodies):
+        for step in range(3):
+            yield [body + step for body in bodies]
+
+    async def run():
+        route = f"astream-{uuid.uuid4().hex}"
+        batcher = DynamicBatcher(timeout=5, transport=transport, route=route)
+        processor = BatchProcessor(batch_size=8, batch_time=0.01, transport=transport, route=route)
+        daemon = asyncio.create_task(processor.start_daemon(count_up))
+        try:
+            streamed = [chunk async for chunk in batcher.astream(10)]
+            return streamed, await batcher.asend(20)
+        finally:
+            daemon.cancel()
+
+    streamed, response = asyncio.run(run())
+    assert streamed == [10, 11, 12]
+    assert response == [20, 21, 22]
+
+
+def test_push_delivery():
+    import asyncio
+    import uuid
+
+    def add_1(bodies):
+        return [body + 1 for body in bodies]
+
+    async def run():
+        route = f"push-{uuid.uuid4().hex}"
+        batcher = DynamicBatcher(timeout=5, delivery="push", route=route)
+        # Not to check by itself: responses come only by notifications.
+        batcher.push_fallback_interval = 10
+        processor = BatchProcessor(batch_size=4, batch_time=0.01, route=route)
+        daemon = asyncio.create_task(processor.start_daemon(add_1))
+        try:
+            results = await asyncio.wait_for(asyncio.gather(*[batcher.asend(value) for value in range(6)]), timeout=3)
+            listener = await batcher._get_response_listener(batcher.transport)
+            return results, listener.is_alive
+        finally:
+            daemon.cancel()
+
+    results, is_listening = asyncio.run(run())
+    assert results == [1, 2, 3, 4, 5, 6]
+    assert is_listening
+
+
+def test_bulk_read():
+    import asyncio
+    import time
+    import uuid
+
+    batch_sizes = []
+
+    def add_1(bodies):
+        batch_sizes.append(len(bodies))
+        return [body + 1 for body in bodies]
+
+    async def run():
+        route = f"bulk-{uuid.uuid4().hex}"
+        batcher = DynamicBatcher(timeout=10, route=route)
+        processor = BatchProcessor(batch_size=8, batch_time=5, route=route)
+        daemon = asyncio.create_task(processor.start_daemon(add_1))
+        try:
+            started_at = time.time()
+            results = await asyncio.gather(*[batcher.asend(value) for value in range(8)])
+            return results, time.time() - started_at
+        finally:
+            daemon.cancel()
+
+    results, elapsed = asyncio.run(run())
+    assert results == list(range(1, 9))
+    # A full batch goes at once, without waiting for `batch_time`.
+    assert batch_sizes == [8]
+    assert elapsed < 2
+
+
+def test_reclaim_stale_requests():
+    import asyncio
+    import uuid
+
+    def add_1(bodies):
+        return [body + 1 for body in bodies]
+
+    async def run():
+        route = f"reclaim-{uuid.uuid4().hex}"
+        processor = BatchProcessor(batch_size=4, batch_time=0.01, route=route)
+        processor.reclaim_idle_sec = 0
+        transport = processor.transport
+        await transport.prepare()
+        request_id = await transport.send({"body": b"1", "codec": "json"})
+        # Read by a consumer dead before finishing it.
+        assert [i for i, v in await transport.read("dead-consumer", count=1, block=100)] == [request_id]
+        daemon = asyncio.create_task(processor.start_daemon(add_1))
+        try:
+            for _ in range(100):
+                response = await transport.pop_response(request_id)
+                if response is not None:
+                    return response
+                await asyncio.sleep(0.05)
+        finally:
+            daemon.cancel()
+
+    assert asyncio.run(run()) == b"2"
+
+
+def test_decode_batch_with_broken_body():
+    from dynamic_batcher.codecs import get_codec
+    processor = BatchProcessor()
+    streams = [(f"0-{i}", {'body': body}) for i, body in enumerate([b'{"a":1}', b'1,2', b'{"b":2}'])]
+    # The broken one is left out, and the others keep their own bodies.
+    assert processor._decode_batch(get_codec("json"), streams, [0, 1, 2]) == ([0, 2], [{'a': 1}, {'b': 2}])
+
+
+def test_accepted_codecs():
+    from dynamic_batcher.codecs import get_codec
+    streams = [
+        ("0-0", {'body': b'{"a":1}', 'codec': 'json'}),
+        ("0-1", {'body': get_codec("pickle").encode({'b': 2}), 'codec': 'pickle'}),
+    ]
+    processor = BatchProcessor()
+    codecs, batches = processor._decode_batches(streams)
+    # Not decoded at all, and responded with `None`.
+    assert codecs[1] is None
+    assert [(indices, batch) for indices, batch, _ in batches] == [([0], [{'a': 1}])]
+
+    processor = BatchProcessor(accepted_codecs=("json", "pickle"))
+    codecs, batches = processor._decode_batches(streams)
+    assert [(indices, batch) for indices, batch, _ in batches] == [([0, 1], [{'a': 1}, {'b': 2}])]
+
+    with pytest.raises(ValueError):
+        BatchProcessor(codec="pickle")
+
+
+def test_shared_memory(monkeypatch):
+    import os
+    import asyncio
+    import uuid
+    from dynamic_batcher import shm_engine
+
+    async def fill(bodies):
+        await asyncio.sleep(max(body.get('sleep', 0) for body in bodies))
+        return [{'data': 'x' * body['size']} for body in bodies]
+
+    # A small ring of this process, for responses larger than a slot.
+    ring = shm_engine.SharedMemoryRing(slots=4, slot_size=64)
+    monkeypatch.setitem(shm_engine._RINGS, os.getpid(), ring)
+
+    async def run():
+        route = f"shm-{uuid.uuid4().hex}"
+        batcher = DynamicBatcher(timeout=5, route=route, shared_memory=True)
+        batcher.shared_memory_grace_sec = 0.3
+        processor = BatchProcessor(batch_size=4, batch_time=0.01, route=route)
+        prefixes = []
+        encode_response = processor._encode_response
+
+        def _encode_response(fields, data):
+            encoded = encode_response(fields, data)
+            prefixes.append(encoded[:1] if 'shm' in fields else None)
+            return encoded
+
+        processor._encode_response = _encode_response
+        daemon = asyncio.create_task(processor.start_daemon(fill))
+        try:
+            results = await asyncio.gather(
+                batcher.asend({'size': 8}),
+                batcher.asend({'size': 200}),
+                # Larger than a slot, sent through Redis.
+                batcher.asend({'size': 8, 'padding': 'x' * 100}),
+            )
+            free_slots = len(ring._free)
+            # A slot of a request timed out is kept for a while, as the response may still be written in it.
+            timed_out = await batcher.asend({'size': 8, 'sleep': 0.5}, timeout=0.1)
+            held_slots = len(ring._free)
+            # Until the response of the one timed out is written, after its slot is released.
+            deadline = asyncio.get_running_loop().time() + 3
+            while len(prefixes) < 4 and asyncio.get_running_loop().time() < deadline:
+                await asyncio.sleep(0.05)
+            return results, sorted(prefixes, key=str), free_slots, timed_out, held_slots, len(ring._free)
+        finally:
+            daemon.cancel()
+
+    try:
+        results, prefixes, free_slots, timed_out, held_slots, released_slots = asyncio.run(run())
+    finally:
+        ring.close()
+    assert results == [{'data': 'x' * 8}, {'data': 'x' * 200}, {'data': 'x' * 8}]
+    # Not in shared memory, larger than the slot, too late for the slot, and in the slot.
+    assert prefixes == [None, b"r", b"r", b"s"]
+    assert free_slots == 4
+    assert timed_out is None
+    assert (held_slots, released_slots) == (3, 4)
+
+
+def test_read_error_backoff():
+    import asyncio
+    import uuid
+    import redis
+    from dynamic_batcher import redis_engine
+
+    client = redis_engine.get_default_client()
+
+    async def run():
+        processor = BatchProcessor(batch_size=4, batch_time=0.01, route=f"backoff-{uuid.uuid4().hex}")
+        transport = processor.transport
+        await transport.prepare()
+        # Flushed: the group is gone.
+        client.delete(*transport.lane_keys.values())
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        assert await processor._get_next_request(count=1, block=10) is None
+        waited = loop.time() - started_at
+        # Created again, to read requests sent after.
+        request_id = await transport.send({"body": b"1", "codec": "json"})
+        requests = await processor._get_next_request(count=1, block=10)
+
+        async def fail(*args, **kwargs):
+            raise redis.ConnectionError("unavailable")
+
+        transport.read = fail
+        backoffs = []
+        for _ in range(5):
+            await processor._get_next_request(count=1, block=10)
+            backoffs.append(processor._read_backoff)
+        client.delete(*transport.lane_keys.values())
+        return waited, [i for i, v in requests], request_id, backoffs
+
+    waited, request_ids, request_id, backoffs = asyncio.run(run())
+    assert waited >= 0.1
+    assert request_ids == [request_id]
+    assert backoffs == [0.1, 0.2, 0.4, 0.8, 1.0]
+
+
+def test_push_delivery_without_response():
+    import asyncio
+    import time
+    import uuid
+
+    def add_1(bodies):
+        return [body + 1 for body in bodies]
+
+    async def run():
+        route = f"push-failed-{uuid.uuid4().hex}"
+        # Not accepted by `BatchProcessor`: notified, but responded with `None`.
+        batcher = DynamicBatcher(timeout=5, delivery="push", codec="pickle", route=route)
+        processor = BatchProcessor(batch_size=4, batch_time=0.01, route=route)
+        await processor.transport.prepare()
+
+        async def asend():
+            started_at = time.time()
+            return await batcher.asend(1), time.time() - started_at
+
+        sent = asyncio.create_task(asend())
+        # A single batch, without a daemon to cancel.
+        await processor._run(add_1)
+        return await sent
+
+    response, elapsed = asyncio.run(run())
+    assert response is None
+    assert elapsed < 2
+
+
+def test_list_transport_failed_batch():
+    import asyncio
+    import time
+    import uuid
+
+    def fail(bodies):
+        raise ValueError("failed")
+
+    async def run():
+        route = f"list-failed-{uuid.uuid4().hex}"
+        # One failed to run, and one not accepted(its codec): responded with `None` at once.
+        batcher = DynamicBatcher(timeout=5, transport="list", route=route)
+        pickle_batcher = DynamicBatcher(timeout=5, transport="list", codec="pickle", route=route)
+        processor = BatchProcessor(batch_size=4, batch_time=0.01, transport="list", route=route)
+        await processor.transport.prepare()
+
+        async def asend(batcher):
+            started_at = time.time()
+            return await batcher.asend(1), time.time() - started_at
+
+        sent = asyncio.gather(asend(batcher), asend(pickle_batcher))
+        await asyncio.sleep(0.1)
+        # A single batch, without a daemon to cancel.
+        await processor._run(fail)
+        return await sent
+
+    for response, elapsed in asyncio.run(run()):
+        assert response is None
+        assert elapsed < 2
+
+
+def test_finish_with_unencodable_result():
+    import asyncio
+    import uuid
+    from dynamic_batcher.codecs import get_codec
+
+    async def run():
+        route = f"unencodable-{uuid.uuid4().hex}"
+        processor = BatchProcessor(route=route)
+        transport = processor.transport
+        await transport.prepare()
+        request_ids = await transport.send_many([{"body": b"1", "codec": "json"}, {"body": b"2", "codec": "json"}])
+        streams = await transport.read(processor.consumer_name, count=2, block=100)
+        # `set` is not JSON serializable: only its own request fails.
+        await processor._mark_as_finished_as_record(
+            request_ids, [2, {3}], codecs=[get_codec("json")] * 2, fields=[v for i, v in streams],
+        )
+        _, reclaimed = await transport.reclaim("other-consumer", 0, "0-0", 10)
+        return await transport.pop_responses(request_ids), reclaimed
+
+    responses, reclaimed = asyncio.run(run())
+    assert responses == [b"2", None]
+    # Finished anyway: nothing left pending to be reclaimed.
+    assert reclaimed == []
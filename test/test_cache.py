@@ -0,0 +1,68 @@
+import uuid
+import asyncio
+import pytest
+from dynamic_batcher import DynamicBatcher, BatchProcessor
+from dynamic_batcher import redis_engine
+from dynamic_batcher.cache import ResponseCache
+
+
+def test_cache_coalesces_requests():
+    batch_sizes = []
+
+    def add_1(bodies):
+        batch_sizes.append(len(bodies))
+        return [{'value': body['value'] + 1} for body in bodies]
+
+    async def run():
+        batcher = DynamicBatcher(engine="memory", timeout=5, cache_size=8)
+        processor = BatchProcessor(batch_size=8, batch_time=0.05, engine="memory")
+        daemon = asyncio.create_task(processor.start_daemon(add_1))
+        try:
+            results = await asyncio.gather(
+                *[batcher.asend({'value': 1, 'key': 'a'}) for _ in range(3)],
+                batcher.asend({'value': 2, 'key': 'a'}),
+            )
+            # The order of keys does not matter.
+            results.append(await batcher.asend({'key': 'a', 'value': 1}))
+        finally:
+            daemon.cancel()
+        return results, batcher.cache.info()
+
+    results, info = asyncio.run(run())
+    assert [result['value'] for result in results] == [2, 2, 2, 3, 2]
+    assert results[0] is not results[1]
+    assert batch_sizes == [2]
+    assert (info.hits, info.misses, info.coalesced, info.size) == (1, 2, 2, 2)
+
+
+def test_cache_shared_on_redis():
+    sent = []
+
+    async def send():
+        sent.append(1)
+        return {'value': 2}
+
+    async def run():
+        cache = ResponseCache(maxsize=8, ttl=10)
+        other_cache = ResponseCache(maxsize=8, ttl=10)
+        first = await cache.aget(key, send, timeout=5)
+        second = await other_cache.aget(key, send, timeout=5)
+        return first, second, other_cache.info()
+
+    # A route of its own, not to hit a response cached by an earlier run.
+    key = ResponseCache().make_key({'value': 1}, route=f"test_cache-{uuid.uuid4().hex}")
+    try:
+        first, second, info = asyncio.run(run())
+    finally:
+        redis_engine.get_default_client().delete(key)
+    assert first == second == {'value': 2}
+    assert len(sent) == 1
+    assert (info.hits, info.shared_hits, info.misses) == (1, 1, 0)
+
+
+def test_cache_lru():
+    cache = ResponseCache(maxsize=2)
+    for value in range(3):
+        cache._keep(cache.make_key({'value': value}), cache._encode(value))
+    assert cache.make_key({'value': 0}) not in cache._responses
+    assert cache.info().size == 2
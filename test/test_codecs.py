@@ -0,0 +1,60 @@
+import pytest
+from dynamic_batcher.codecs import Codec, get_codec, register_codec
+
+
+@pytest.mark.parametrize("name", ["json", "pickle"])
+def test_codec_round_trip(name):
+    codec = get_codec(name)
+    bodies = [{"a": 1, "b": [1, 2]}, {"a": 2, "b": []}]
+
+    datas = [codec.encode(body) for body in bodies]
+    assert [codec.decode(data) for data in datas] == bodies
+    assert codec.decode_batch(datas) == bodies
+
+
+def test_json_codec_decode_batch_checks_bodies():
+    codec = get_codec("json")
+    assert codec.decode_batch([b'{"a": 1}', ' [1, 2] ', b'"\xc3\xa9"']) == [{"a": 1}, [1, 2], "\u00e9"]
+    assert codec.decode_batch([b'2', b'11', b'12']) == [2, 11, 12]
+    # Bodies not a single value, even if the batch has a value per body.
+    for datas in ([b'{"a":1}', b'1,2', b'{"b":2}'], [b'[1', b'{"a":1}', b'],3,4'], [b'1', b'', b'2']):
+        with pytest.raises(ValueError):
+            codec.decode_batch(datas)
+
+
+def test_msgpack_codec_decode_batch():
+    pytest.importorskip("msgpack")
+    codec = get_codec("msgpack")
+    bodies = [{"a": i} for i in range(20)]
+    assert codec.decode_batch([codec.encode(body) for body in bodies]) == bodies
+
+
+def test_numpy_codec_stacks_and_splits():
+    np = pytest.importorskip("numpy")
+    codec = get_codec("numpy")
+    bodies = [{"x": np.full((2, 3), i, dtype=np.float32), "mask": np.arange(2) > i} for i in range(4)]
+    datas = [codec.encode(body) for body in bodies]
+
+    batch = codec.decode_batch(datas)
+    assert batch["x"].shape == (4, 2, 3) and batch["x"].dtype == np.float32
+    assert len({codec.stack_key(data) for data in datas}) == 1
+
+    results = codec.split_batch({"y": batch["x"].sum(axis=(1, 2))})
+    assert [codec.decode(codec.encode(result))["y"] for result in results] == [0, 6, 12, 18]
+    assert codec.decode(codec.encode(None)) is None
+
+
+def test_register_codec():
+    class UpperCodec(Codec):
+        name = "upper"
+
+        def encode(self, obj):
+            return obj.upper()
+
+        def decode(self, data):
+            return data.lower()
+
+    register_codec(UpperCodec())
+    assert get_codec("upper").decode_batch(["A", "B"]) == ["a", "b"]
+    with pytest.raises(ValueError):
+        get_codec("unknown")
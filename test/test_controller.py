@@ -0,0 +1,29 @@
+import pytest
+from dynamic_batcher.controller import AdaptiveBatchController
+
+
+def test_controller_keeps_target_latency():
+    controller = AdaptiveBatchController(target_latency=0.1, max_batch_size=64, max_batch_time=2)
+    controller.observe_arrivals(count=1000, elapsed=1)
+    for batch_size in [8, 16, 32, 64]:
+        controller.observe_execution(batch_size=batch_size, elapsed=0.001 * batch_size)
+
+    batch_size, batch_time = controller.update()
+    assert 1 <= batch_size < 64
+    assert controller.estimate_execution_time(batch_size) + batch_time <= 0.1
+
+
+def test_controller_grows_batch_on_backlog():
+    controller = AdaptiveBatchController(target_latency=0.1, max_batch_size=64, max_batch_time=2)
+    controller.observe_execution(batch_size=64, elapsed=0.01)
+    idle_batch_size, _ = controller.update()
+
+    controller.observe_queue_depth(1000)
+    busy_batch_size, _ = controller.update()
+    assert idle_batch_size == 1
+    assert busy_batch_size == 64
+
+
+def test_controller_invalid_target():
+    with pytest.raises(ValueError):
+        AdaptiveBatchController(target_latency=0, max_batch_size=64, max_batch_time=2)
@@ -0,0 +1,41 @@
+import os
+import sys
+import signal
+import asyncio
+import subprocess
+import uuid
+from dynamic_batcher import DynamicBatcher
+from dynamic_batcher import redis_engine
+
+
+def add_1(bodies):
+    return [body + 1 for body in bodies]
+
+
+def test_replicas_with_process_executor():
+    route = f"replicas-{uuid.uuid4().hex}"
+    # Replicas run batches on processes of their own.
+    processor = subprocess.Popen(
+        [
+            sys.executable, "-m", "dynamic_batcher",
+            "--route", f"{route}=test.test_main.add_1",
+            "--replicas", "2",
+            "--executor", "process",
+            "--batch-time", "0.01",
+        ],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+
+    async def run():
+        batcher = DynamicBatcher(timeout=30, route=route)
+        return await asyncio.gather(*[batcher.asend(i) for i in range(8)])
+
+    try:
+        responses = asyncio.run(run())
+    finally:
+        processor.send_signal(signal.SIGTERM)
+        returncode = processor.wait(timeout=30)
+        transport = redis_engine.get_transport("stream", route=route)
+        redis_engine.get_default_client().delete(*transport.lane_keys.values())
+    assert responses == [i + 1 for i in range(8)]
+    assert returncode == 0
@@ -0,0 +1,232 @@
+import asyncio
+import pytest
+from dynamic_batcher import DynamicBatcher, BatchProcessor
+
+
+def add_1(bodies):
+    return [{'value': body['value'] + 1, 'batch_size': len(bodies)} for body in bodies]
+
+
+def test_memory_engine():
+    async def run():
+        batcher = DynamicBatcher(engine="memory", timeout=5)
+        processor = BatchProcessor(batch_size=4, batch_time=0.05, engine="memory")
+        daemon = asyncio.create_task(processor.start_daemon(add_1))
+        try:
+            return await asyncio.gather(*[batcher.asend({'value': i}) for i in range(6)])
+        finally:
+            daemon.cancel()
+
+    results = asyncio.run(run())
+    assert [result['value'] for result in results] == [1, 2, 3, 4, 5, 6]
+    assert sorted(result['batch_size'] for result in results) == [2, 2, 4, 4, 4, 4]
+
+
+def test_memory_engine_timeout():
+    async def run():
+        batcher = DynamicBatcher(engine="memory")
+        return await batcher.asend({'value': 1}, timeout=0.01)
+
+    assert asyncio.run(run()) is None
+
+
+def test_memory_engine_priority():
+    batches = []
+
+    def record(bodies):
+        batches.append([body['lane'] for body in bodies])
+        return bodies
+
+    async def run():
+        batcher = DynamicBatcher(engine="memory", timeout=5)
+        processor = BatchProcessor(batch_size=2, batch_time=0.05, engine="memory")
+        # Queued before the processor starts.
+        sent = [asyncio.create_task(batcher.asend({'lane': lane}, priority=lane)) for lane in ["low", "low", "high", "high"]]
+        await asyncio.sleep(0)
+        daemon = asyncio.create_task(processor.start_daemon(record))
+        try:
+            await asyncio.gather(*sent)
+        finally:
+            daemon.cancel()
+
+    asyncio.run(run())
+    assert batches == [["high", "high"], ["low", "low"]]
+
+
+def test_memory_engine_early_dispatch():
+    async def run():
+        loop = asyncio.get_running_loop()
+        batcher = DynamicBatcher(engine="memory", timeout=5)
+        processor = BatchProcessor(batch_size=8, batch_time=3, engine="memory")
+        daemon = asyncio.create_task(processor.start_daemon(add_1))
+        started_at = loop.time()
+        try:
+            result = await batcher.asend({'value': 1}, priority="high")
+        finally:
+            daemon.cancel()
+        return result, loop.time() - started_at
+
+    result, elapsed = asyncio.run(run())
+    assert result['value'] == 2 and elapsed < 1
+
+
+def test_memory_engine_buckets():
+    batches = []
+
+    def record(bodies):
+        batches.append([len(body['tokens']) for body in bodies])
+        return bodies
+
+    async def run():
+        batcher = DynamicBatcher(engine="memory", timeout=5)
+        processor = BatchProcessor(
+            batch_size=2, batch_time=0.1, engine="memory", bucket_by="tokens", bucket_boundaries=[4, 16],
+        )
+        # Queued before the processor starts.
+        sent = [asyncio.create_task(batcher.asend({'tokens': [0] * size})) for size in [2, 10, 3, 12, 1]]
+        await asyncio.sleep(0)
+        daemon = asyncio.create_task(processor.start_daemon(record))
+        try:
+            await asyncio.gather(*sent)
+        finally:
+            daemon.cancel()
+
+    asyncio.run(run())
+    assert batches == [[2, 3], [10, 12], [1]]
+
+
+def test_memory_engine_astream():
+    def count_up(bodies):
+        for step in range(3):
+            yield [{'value': body['value'] + step} for body in bodies]
+
+    async def run():
+        batcher = DynamicBatcher(engine="memory", timeout=5)
+        processor = BatchProcessor(batch_size=4, batch_time=0.05, engine="memory")
+        daemon = asyncio.create_task(processor.start_daemon(count_up))
+        try:
+            return [[chunk['value'] async for chunk in batcher.astream({'value': i})] for i in range(2)]
+        finally:
+            daemon.cancel()
+
+    assert asyncio.run(run()) == [[0, 1, 2], [1, 2, 3]]
+
+
+def test_memory_engine_admission():
+    from dynamic_batcher import OverloadedError
+
+    async def run():
+        # No `BatchProcessor`: requests are left waiting in the queue.
+        batcher = DynamicBatcher(engine="memory", max_queue_depth=2)
+        return await asyncio.gather(*[batcher.asend({'value': i}, timeout=0.1) for i in range(3)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert results[:2] == [None, None]
+    assert isinstance(results[2], OverloadedError)
+    assert results[2].queue_depth == 3
+
+
+def test_memory_engine_pipeline_depth():
+    import threading
+    import time
+
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+
+    def slow_add_1(bodies):
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.2)
+        with lock:
+            running[0] -= 1
+        return [{'value': body['value'] + 1} for body in bodies]
+
+    async def run():
+        batcher = DynamicBatcher(engine="memory", timeout=5)
+        processor = BatchProcessor(batch_size=1, batch_time=0.01, engine="memory", executor="thread", pipeline_depth=2)
+        daemon = asyncio.create_task(processor.start_daemon(slow_add_1))
+        try:
+            return await asyncio.gather(*[batcher.asend({'value': i}) for i in range(4)])
+        finally:
+            daemon.cancel()
+
+    results = asyncio.run(run())
+    assert [result['value'] for result in results] == [1, 2, 3, 4]
+    # Batches run along, but no more than `pipeline_depth` at once.
+    assert max_running[0] == 2
+
+
+def test_memory_engine_async_callables():
+    async def add_1(bodies):
+        await asyncio.sleep(0)
+        return [{'value': body['value'] + 1} for body in bodies]
+
+    async def count_up(bodies):
+        for step in range(2):
+            await asyncio.sleep(0)
+            yield [body['value'] + step for body in bodies]
+
+    async def run(func):
+        batcher = DynamicBatcher(engine="memory", timeout=5)
+        processor = BatchProcessor(batch_size=4, batch_time=0.01, engine="memory")
+        daemon = asyncio.create_task(processor.start_daemon(func))
+        try:
+            return await asyncio.gather(*[batcher.asend({'value': i}) for i in range(2)])
+        finally:
+            daemon.cancel()
+
+    assert asyncio.run(run(add_1)) == [{'value': 1}, {'value': 2}]
+    # Results of each request over the steps.
+    assert asyncio.run(run(count_up)) == [[0, 1], [1, 2]]
+
+
+def test_memory_engine_oldest_request_deadline():
+    import time
+
+    async def run():
+        batcher = DynamicBatcher(engine="memory", timeout=5)
+        processor = BatchProcessor(batch_size=8, batch_time=0.5, engine="memory")
+        started_at = time.time()
+        request = asyncio.create_task(batcher.asend({'value': 1}))
+        # The request waits before the batch starts to be gathered.
+        await asyncio.sleep(0.3)
+        daemon = asyncio.create_task(processor.start_daemon(add_1))
+        try:
+            result = await request
+            return result, time.time() - started_at
+        finally:
+            daemon.cancel()
+
+    result, elapsed = asyncio.run(run())
+    assert result['value'] == 2
+    # Due `batch_time` after the request was sent(0.5s), not after gathering started(0.8s).
+    assert 0.45 <= elapsed < 0.7
+
+
+def test_memory_engine_shed_expired_requests():
+    bodies_run = []
+
+    def record_add_1(bodies):
+        bodies_run.extend(body['value'] for body in bodies)
+        return add_1(bodies)
+
+    async def run():
+        batcher = DynamicBatcher(engine="memory", timeout=5)
+        processor = BatchProcessor(batch_size=8, batch_time=0.3, engine="memory")
+        daemon = asyncio.create_task(processor.start_daemon(record_add_1))
+        try:
+            results = await asyncio.gather(
+                batcher.asend({'value': 1}, timeout=0.05),
+                batcher.asend({'value': 2}),
+            )
+            return results, processor.shed_count
+        finally:
+            daemon.cancel()
+
+    results, shed_count = asyncio.run(run())
+    # Expired before `batch_time`: dropped without running.
+    assert results[0] is None and results[1]['value'] == 3
+    assert bodies_run == [2]
+    assert shed_count == 1
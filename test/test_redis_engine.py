@@ -1,4 +1,5 @@
 import json
+import asyncio
 import pytest
 import redis
 from dynamic_batcher import ResponseStream
@@ -14,6 +15,22 @@ def test_get_client():
     )
     assert client.ping()
 
+
+def test_get_client_cached():
+    client = redis_engine.get_default_client()
+    assert redis_engine.get_default_client() is client
+    assert client.connection_pool.max_connections == redis_engine.REDIS__MAX_CONNECTIONS
+
+
+def test_get_async_client():
+    async def _ping():
+        client = redis_engine.get_default_async_client()
+        same_pool_client = redis_engine.get_default_async_client()
+        assert client.connection_pool is same_pool_client.connection_pool
+        return await client.ping()
+
+    assert asyncio.run(_ping())
+
 # def test_ping_redis():
 #     # assert redis.ping()
 #     return True
@@ -83,3 +100,188 @@ def test_redis_get_default_client():
     _body = _fields['body']
     assert isinstance(_id, str) and _id == stream_id
     assert isinstance(_body, str) and _body == json.dumps(body)
+
+
+@pytest.mark.parametrize("name", ["stream", "list"])
+def test_transport(name):
+    import uuid
+    redis_engine.get_default_client()
+    # A route of its own, not to read requests left by the others.
+    transport = redis_engine.get_transport(name, route=f"transport-{uuid.uuid4().hex}")
+
+    async def run():
+        await transport.prepare()
+        low_request_id = await transport.send({"body": b'{"a": 0}'}, priority="low")
+        request_id = await transport.send({"body": b'{"a": 1}', "codec": "json", "deadline": 1.5}, priority="high")
+        requests = await transport.read("test-consumer", count=8, block=100)
+        if len(requests) == 1:
+            requests += await transport.read("test-consumer", count=8, block=100)
+        # Higher lanes first.
+        assert [i for i, v in requests] == [request_id, low_request_id]
+        requests = requests[:-1]
+        await transport.drop([low_request_id])
+        fields = requests[-1][1]
+        assert fields["body"] == b'{"a": 1}' and fields["codec"] == "json" and float(fields["deadline"]) == 1.5
+
+        await transport.finish([request_id], [b'{"a": 2}'], expiration=10)
+        if transport.blocking_response:
+            return await transport.wait_response(request_id, timeout=1)
+        return await transport.pop_response(request_id)
+
+    try:
+        assert asyncio.run(run()) == b'{"a": 2}'
+    finally:
+        redis_engine.get_default_client().delete(*transport.lane_keys.values(), transport.finished_key)
+    with pytest.raises(ValueError):
+        redis_engine.get_transport("unknown")
+
+
+def test_list_transport_without_blmpop():
+    import uuid
+    transport = redis_engine.get_transport("list", route=f"brpop-{uuid.uuid4().hex}")
+
+    async def run():
+        await transport.prepare()
+        # As on Redis before 7, even if the server has ``BLMPOP``.
+        transport._has_blmpop = False
+        request_ids = [await transport.send({"body": str(i).encode()}) for i in range(5)]
+        high_request_id = await transport.send({"body": b"5"}, priority="high")
+        read = [await transport.read("test-consumer", count=3, block=100) for _ in range(4)]
+        return request_ids, high_request_id, [[i for i, v in requests] for requests in read]
+
+    request_ids, high_request_id, read = asyncio.run(run())
+    # The highest lane first, then up to `count` at once, in order.
+    assert read == [[high_request_id], request_ids[:3], request_ids[3:], []]
+
+
+def test_housekeep():
+    import uuid
+    transport = redis_engine.get_transport("stream", route=f"housekeep-{uuid.uuid4().hex}")
+    client = redis_engine.get_default_client()
+    key = transport.lane_keys[redis_engine.DEFAULT_PRIORITY]
+
+    async def run():
+        await transport.prepare()
+        request_ids = [await transport.send({"body": b"1"}) for _ in range(4)]
+        await transport.read("dead-consumer", count=2, block=100)
+        # Acknowledged, but left in the stream.
+        client.xack(key, transport.processor_group, request_ids[0])
+        assert await transport.housekeep("test-consumer", stale_ms=60000, expiration_ms=60000) == (1, 0, 0)
+        await asyncio.sleep(0.01)
+        trimmed, purged, _ = await transport.housekeep("test-consumer", stale_ms=0, expiration_ms=60000)
+        assert (trimmed, purged) == (0, 1)
+        # The consumer has no pending requests now, to be removed.
+        await asyncio.sleep(0.01)
+        await transport.housekeep("test-consumer", stale_ms=0, expiration_ms=60000)
+        return request_ids
+
+    try:
+        request_ids = asyncio.run(run())
+        # Requests not read yet are never deleted.
+        assert [i for i, v in client.xrange(key)] == request_ids[2:]
+        assert not any(client.xinfo_consumers(lane, transport.processor_group) for lane in transport.lane_keys.values())
+    finally:
+        client.delete(*transport.lane_keys.values())
+
+
+def test_get_async_client_pool_key():
+    async def run():
+        client = redis_engine.get_default_async_client()
+        same_pool_client = redis_engine.get_default_async_client()
+        other_pool_client = redis_engine.get_async_client(
+            host=redis_engine.REDIS__HOST,
+            port=redis_engine.REDIS__PORT,
+            db=redis_engine.REDIS__DB,
+            password=redis_engine.REDIS__PASSWORD,
+            max_connections=2,
+        )
+        return client.connection_pool, same_pool_client.connection_pool, other_pool_client.connection_pool
+
+    pool, same_pool, other_pool = asyncio.run(run())
+    assert pool is same_pool
+    assert other_pool is not pool and other_pool.max_connections == 2
+
+
+def test_list_transport_reply_reader():
+    import uuid
+    transport = redis_engine.get_transport("list", route=f"reply-{uuid.uuid4().hex}")
+
+    async def run():
+        await transport.prepare()
+        request_ids = await transport.send_many([{"body": str(i).encode()} for i in range(32)])
+        waiting = asyncio.gather(*[transport.wait_response(request_id, timeout=5) for request_id in request_ids[1:]])
+        await asyncio.sleep(0.1)
+        # All of them waiting on a single connection.
+        pool = transport._async_raw_redis_client.connection_pool
+        in_use = len(list(pool._get_in_use_connections()))
+
+        requests = await transport.read("test-consumer", count=32, block=100)
+        await transport.finish([i for i, v in requests], [v["body"] + b"!" for i, v in requests], expiration=10)
+        await transport.push_chunks(request_ids[:1], [[b"a", b"b"]], expiration=10, reply_keys=[transport.stream_key()])
+        chunks = [await transport.pop_chunk(request_ids[0], timeout=1) for _ in range(2)]
+        return in_use, await transport.pop_response(request_ids[0]), chunks, await waiting
+
+    in_use, response, chunks, responses = asyncio.run(run())
+    assert in_use == 1
+    assert response == b"0!"
+    assert chunks == [b"a", b"b"]
+    assert responses == [f"{i}!".encode() for i in range(1, 32)]
+
+
+def test_stream_transport_chunks():
+    import time
+    import uuid
+    transport = redis_engine.get_transport("stream", route=f"chunks-{uuid.uuid4().hex}")
+
+    async def run():
+        await transport.prepare()
+        request_ids = await transport.send_many([{"body": str(i).encode(), "stream": transport.stream_key()} for i in range(32)])
+        waiting = asyncio.gather(*[transport.pop_chunk(request_id, timeout=5) for request_id in request_ids])
+        await asyncio.sleep(0.1)
+        # All of them waiting on a single connection.
+        pool = transport._async_raw_redis_client.connection_pool
+        in_use = len(list(pool._get_in_use_connections()))
+
+        requests = await transport.read("test-consumer", count=32, block=100)
+        await transport.push_chunks(
+            [i for i, v in requests],
+            [[v["body"] + b"!"] for i, v in requests],
+            expiration=10,
+            reply_keys=[v["stream"] for i, v in requests],
+        )
+        chunks = await waiting
+        # Not to block forever, with a timeout too short for ``BLPOP``.
+        started = time.time()
+        nothing = await asyncio.wait_for(transport.pop_chunk(request_ids[0], timeout=0.0008), timeout=1)
+        return in_use, chunks, nothing, time.time() - started
+
+    try:
+        in_use, chunks, nothing, elapsed = asyncio.run(run())
+    finally:
+        redis_engine.get_default_client().delete(*transport.lane_keys.values())
+    assert in_use == 1
+    assert chunks == [f"{i}!".encode() for i in range(32)]
+    assert nothing is None
+    assert elapsed < 0.5
+
+
+def test_queue_stats():
+    import uuid
+    transport = redis_engine.get_transport("stream", route=f"queue-stats-{uuid.uuid4().hex}")
+
+    async def run():
+        await transport.prepare()
+        await transport.send_many([{"body": b"1"} for _ in range(3)])
+        await transport.send({"body": b"1"}, priority="high")
+        requests = await transport.read("test-consumer", count=1, block=100)
+        await transport.finish([i for i, v in requests[:1]], [b"2"], expiration=10)
+        # Without `lag`(before Redis 7, or after deletions), by the length of the lanes less the pending ones.
+        return await transport.queue_depth(), await transport.queue_stats()
+
+    try:
+        depth, (_, taken) = asyncio.run(run())
+    finally:
+        redis_engine.get_default_client().delete(*transport.lane_keys.values(), transport.finished_key)
+    assert depth == 2
+    # One of each lane, finished or pending.
+    assert taken == 2
@@ -0,0 +1,76 @@
+import pytest
+from dynamic_batcher import shm_engine
+
+
+def test_shared_memory_ring():
+    ring = shm_engine.SharedMemoryRing(slots=2, slot_size=16)
+    try:
+        slot = ring.acquire()
+        assert ring.write(slot, b'{"a": 1}') == 8
+        assert ring.read(slot, 8) == b'{"a": 1}'
+        with pytest.raises(ValueError):
+            ring.write(slot, b'x' * 17)
+
+        assert ring.acquire() is not None
+        assert ring.acquire() is None
+        ring.release(slot)
+        assert ring.acquire() == slot
+    finally:
+        ring.close()
+
+
+def test_attach_ring():
+    ring = shm_engine.get_ring()
+    assert shm_engine.get_ring() is ring
+
+    slot = ring.acquire()
+    try:
+        ring.write(slot, b'{"a": 1}')
+        shm = shm_engine.attach(ring.name)
+        assert shm_engine.read_slot(shm, ring.offset(slot), 8) == b'{"a": 1}'
+        shm_engine.write_slot(shm, ring.offset(slot), ring.slot_size, b'{"b": 2}')
+        assert ring.read(slot, 8) == b'{"b": 2}'
+    finally:
+        shm_engine.detach(ring.name)
+        ring.release(slot)
+
+
+def test_check_slot():
+    ring = shm_engine.get_ring()
+    shm = shm_engine.attach(ring.name)
+    try:
+        # Only a whole slot of the ring: not the header, nor across slots, nor out of the ring.
+        for offset, size in [(0, 8), (ring.offset(0) + 1, 8), (ring.offset(0), ring.slot_size + 1), (ring.offset(ring.slots), 8)]:
+            with pytest.raises(ValueError):
+                shm_engine.write_slot(shm, offset, size, b'x' * size)
+            with pytest.raises(ValueError):
+                shm_engine.read_slot(shm, offset, size)
+        with pytest.raises(ValueError):
+            shm_engine.attach("not_a_ring")
+    finally:
+        shm_engine.detach(ring.name)
+
+
+def test_detach_attached(monkeypatch):
+    import subprocess
+    import sys
+    from collections import OrderedDict
+    monkeypatch.setattr(shm_engine, "SHM__MAX_ATTACHED", 2)
+    monkeypatch.setattr(shm_engine, "_ATTACHED", OrderedDict())
+    rings = [shm_engine.SharedMemoryRing(slots=1, slot_size=16) for _ in range(3)]
+    try:
+        for ring in rings:
+            shm_engine.attach(ring.name)
+        # The least recently used one is detached.
+        assert list(shm_engine._ATTACHED) == [rings[1].name, rings[2].name]
+
+        # A ring of a process gone.
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        shm_engine._HEADER.pack_into(rings[2]._shm.buf, 0, shm_engine._MAGIC, process.pid, 1, 16)
+        assert shm_engine.prune() == [rings[2].name]
+        assert list(shm_engine._ATTACHED) == [rings[1].name]
+    finally:
+        for ring in rings:
+            shm_engine.detach(ring.name)
+            ring.close()